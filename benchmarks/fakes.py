@@ -0,0 +1,180 @@
+"""Extraction and chat model backends that replay recorded responses with simulated latency, for offline benchmarks.
+
+Responses are stored as one JSON file per request under a recordings folder, keyed by a hash of the PDF or of the
+normalized prompt. A backend given a source records what the source returns for requests that are not recorded yet:
+
+- ReplayExtractionBackend falls back to the local extraction backend, so every deck with a text layer can be replayed
+  without credentials. Recording from the Adobe backend also covers scanned decks.
+- ReplayChatModel synthesizes a deterministic answer of the requested shape when no recording and no source exist.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain.chat_models.base import SimpleChatModel
+from langchain.schema import AIMessage, BaseMessage, ChatGeneration, ChatResult
+from pdfrw import PdfReader
+
+from piqa.document_processing import ExtractionBackend, LocalExtractionBackend
+from piqa.document_processing.extraction_backends import PdfSource
+from piqa.large_language_models.chunking import get_token_counter
+from piqa.large_language_models.langchain_conversation import _normalize_content
+
+DEFAULT_RECORDINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings")
+
+# Quoted keys of the JSON object requested by a structured prompt, e.g. '"team" (names and titles)'
+SECTION_KEY_PATTERN = re.compile(r'"(\w+)" \(')
+
+_write_lock = threading.Lock()
+
+
+def _load(path: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def _store(path: str, recording: Dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Written next to the recording first, so concurrent readers never see a partial file
+    with _write_lock:
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(recording, f)
+        os.replace(f"{path}.tmp", path)
+
+
+class ReplayExtractionBackend(ExtractionBackend):
+    """Replays recorded extractions, sleeping like a remote service would.
+
+    Args:
+        recordings_path (str, optional): Folder of the recordings. Defaults to benchmarks/recordings.
+        source (ExtractionBackend, optional): Backend that extracts and records PDFs that are not recorded yet.
+            Defaults to the local extraction backend.
+        latency (float, optional): Seconds every request takes. Defaults to 2.0.
+        page_latency (float, optional): Additional seconds per page. Defaults to 0.5.
+
+    Attributes:
+        replayed (int): Number of extractions served from the recordings.
+        recorded (int): Number of extractions requested from the source.
+    """
+    name = "replay"
+
+    def __init__(self, recordings_path: str = DEFAULT_RECORDINGS_PATH, source: Optional[ExtractionBackend] = None,
+                 latency: float = 2.0, page_latency: float = 0.5):
+        self.recordings_path = os.path.join(recordings_path, "extraction")
+        self.source = source or LocalExtractionBackend()
+        self.latency = latency
+        self.page_latency = page_latency
+        self.replayed = 0
+        self.recorded = 0
+
+    def extract(self, source: PdfSource, output_path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        if isinstance(source, bytes):
+            pdf = source
+        else:
+            with open(source, "rb") as f:
+                pdf = f.read()
+
+        path = os.path.join(self.recordings_path, f"{hashlib.sha256(pdf).hexdigest()}.json")
+
+        recording = _load(path)
+        if recording is None:
+            self.recorded += 1
+            recording = {"pages": len(PdfReader(fdata=pdf).pages), "response": self.source.extract(pdf)}
+            _store(path, recording)
+        else:
+            self.replayed += 1
+            time.sleep(self.latency + self.page_latency * recording["pages"])
+
+        return recording["response"]
+
+
+class ReplayChatModel(SimpleChatModel):
+    """Replays recorded completions, waiting like the API would for the first token and every further token.
+
+    Attributes:
+        recordings_path (str): Folder of the recordings. Defaults to benchmarks/recordings.
+        source (BaseChatModel, optional): Chat model that answers and records prompts that are not recorded yet.
+            Without a source, answers are synthesized and not recorded.
+        latency (float): Seconds until the first token. Defaults to 0.5.
+        token_latency (float): Seconds per completion token. Defaults to 0.02.
+        answer_tokens (int): Approximate number of tokens of a synthesized answer. Defaults to 500.
+        replayed (int): Number of completions served from the recordings.
+        synthesized (int): Number of completions synthesized.
+    """
+    recordings_path: str = DEFAULT_RECORDINGS_PATH
+    source: Any = None
+    latency: float = 0.5
+    token_latency: float = 0.02
+    answer_tokens: int = 500
+    replayed: int = 0
+    synthesized: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": "replay", "source": getattr(self.source, "_identifying_params", None)}
+
+    def _recording_path(self, messages: List[BaseMessage]) -> str:
+        prompt = json.dumps([[message.type, _normalize_content(message.content)] for message in messages])
+        return os.path.join(self.recordings_path, "completions", f"{hashlib.sha256(prompt.encode()).hexdigest()}.json")
+
+    def _synthesize(self, messages: List[BaseMessage]) -> str:
+        prompt = messages[-1].content
+        seed = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        keys = SECTION_KEY_PATTERN.findall(prompt)
+
+        if keys:
+            words = " ".join([seed[:8]] * (self.answer_tokens // (2 * len(keys))))
+            return json.dumps({key: f"- {key}: {words}" for key in keys})
+
+        if "NOTES:" in prompt:
+            return "\n".join(f"- note {seed[i:i + 8]}" for i in range(0, 48, 8))
+
+        words = " ".join([seed[:8]] * (self.answer_tokens // 20))
+        return "\n\n".join(f"# {section}\n\n{words}" for section in ("Name of the Product", "Team", "Traction",
+                                                                    "Problem", "Solution", "Market", "Market Size",
+                                                                    "Business Model", "Concise Summary",
+                                                                    "Recommendation"))
+
+    def _answer(self, messages: List[BaseMessage]) -> Dict[str, Any]:
+        """Get the recorded answer, recording or synthesizing it if needed, and the seconds the API would take."""
+        path = self._recording_path(messages)
+        recording = _load(path)
+
+        if recording is None and self.source is not None:
+            recording = {"content": self.source(messages).content}
+            _store(path, recording)
+            return {"content": recording["content"], "delay": 0.0}
+
+        if recording is None:
+            self.synthesized += 1
+            content = self._synthesize(messages)
+        else:
+            self.replayed += 1
+            content = recording["content"]
+
+        return {"content": content, "delay": self.latency + self.token_latency * get_token_counter()(content)}
+
+    def _call(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None,
+              **kwargs: Any) -> str:
+        answer = self._answer(messages)
+        time.sleep(answer["delay"])
+        return answer["content"]
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None,
+                         **kwargs: Any) -> ChatResult:
+        answer = self._answer(messages)
+        await asyncio.sleep(answer["delay"])
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer["content"]))])
@@ -0,0 +1,80 @@
+"""Measure how long it takes to import the package and which dependencies the time goes to.
+
+Every statement runs in a fresh interpreter with ``python -X importtime``, so nothing is cached between runs.
+
+Usage:
+    python benchmarks/import_time.py [--repeat 5] [--top 10] [statement ...]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+DEFAULT_STATEMENTS = [
+    "import piqa",
+    "import piqa.config",
+    "from piqa import PiQaClient",
+    "from piqa.document_processing import process_pdf",
+    "from piqa.large_language_models import get_chat_model; get_chat_model()",
+]
+
+IMPORT_TIME_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def measure(statement: str) -> Tuple[float, Dict[str, float]]:
+    """Import in a fresh interpreter.
+
+    Args:
+        statement (str): Python statement to run.
+
+    Returns:
+        Tuple[float, Dict[str, float]]: Total import time in seconds, and the self time in seconds per top level
+            package.
+    """
+    env = {**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "benchmark")}
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], capture_output=True, text=True,
+                            env=env, check=True)
+
+    total = 0.0
+    per_package: Dict[str, float] = defaultdict(float)
+
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if not match:
+            continue
+
+        self_time, cumulative_time, indent, module = match.groups()
+        per_package[module.split(".")[0]] += int(self_time) / 1e6
+
+        # Only the modules imported directly by the statement add up to the total
+        if len(indent) == 1:
+            total += int(cumulative_time) / 1e6
+
+    return total, per_package
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("statements", nargs="*", default=DEFAULT_STATEMENTS)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per statement, the median is reported")
+    parser.add_argument("--top", type=int, default=10, help="Number of packages to break the time down into")
+    args = parser.parse_args(argv)
+
+    for statement in args.statements:
+        runs = [measure(statement) for _ in range(args.repeat)]
+        totals = [total for total, _ in runs]
+        median_run = sorted(runs, key=lambda run: run[0])[len(runs) // 2]
+
+        print(f"{statement}\n  median {statistics.median(totals):.3f}s, min {min(totals):.3f}s, "
+              f"max {max(totals):.3f}s over {args.repeat} runs")
+
+        for package, seconds in sorted(median_run[1].items(), key=lambda item: -item[1])[:args.top]:
+            print(f"    {package:<24} {seconds:.3f}s")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,119 @@
+"""Time the hot functions of the package on fixed inputs, without the rest of the pipeline.
+
+Every function runs on a fresh copy of its input, copying is not timed. Rendering needs poppler and is skipped where
+it is not installed, paragraphs are then detected on a synthetic page.
+
+Usage:
+    python -m benchmarks.microbenchmarks [--repeat 20] [--document tests/data/documents/moz.pdf] [benchmark ...]
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+from pdfrw import PdfReader
+
+from piqa.document_processing import LocalExtractionBackend, convert_pdf_to_images, flatten_and_preprocess_adobe_json
+from piqa.document_processing.extraction import _postprocess_elements
+from piqa.document_processing.pdf_operations import trim_pdf
+from piqa.image_processing import detect_paragraph_boxes, detect_paragraphs
+
+DEFAULT_ELEMENTS_PATH = "tests/data/adobe_outputs/moz-output_transformed.json"
+
+
+def measure(func: Callable[[Any], Any], make_input: Callable[[], Any], repeat: int) -> List[float]:
+    """Time a function on fresh inputs.
+
+    Args:
+        func (Callable[[Any], Any]): Function to time.
+        make_input (Callable[[], Any]): Creates the input of every call, not timed.
+        repeat (int): Number of calls.
+
+    Returns:
+        List[float]: Seconds of every call.
+    """
+    durations = []
+    for _ in range(repeat):
+        value = make_input()
+        started_at = time.perf_counter()
+        func(value)
+        durations.append(time.perf_counter() - started_at)
+
+    return durations
+
+
+def _synthetic_page(path: str) -> str:
+    # Blocks of text lines on a slide sized page, like a page rendered at 200 dpi
+    page = np.full((1500, 2000, 3), 255, dtype=np.uint8)
+    for column, left in enumerate((150, 1100)):
+        for line in range(12):
+            cv2.putText(page, "Lorem ipsum dolor sit amet", (left, 300 + 45 * line + 300 * column),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 2)
+    cv2.imwrite(path, page)
+
+    return path
+
+
+def benchmarks(document: str, work_dir: str) -> Dict[str, Optional[tuple]]:
+    """Build the benchmarks, a function and an input factory each, or None for benchmarks that cannot run here."""
+    with open(DEFAULT_ELEMENTS_PATH) as f:
+        adobe_json = json.load(f)
+
+    pdf, page_sizes = trim_pdf(PdfReader(document), [0, 1, 2, 3, 4])
+    extracted = LocalExtractionBackend().extract(pdf) or {"elements": []}
+
+    try:
+        image_path = convert_pdf_to_images(document, work_dir, pages=[0])[0]
+        render: Optional[tuple] = (lambda _: convert_pdf_to_images(document, work_dir, pages=range(5)), lambda: None)
+    except Exception as e: # pylint: disable=broad-except
+        print(f"Rendering is skipped, paragraphs are detected on a synthetic page: {e}")
+        image_path, render = _synthetic_page(os.path.join(work_dir, "page.png")), None
+
+    return {
+        "flatten_and_preprocess_adobe_json": (flatten_and_preprocess_adobe_json, lambda: copy.deepcopy(adobe_json)),
+        "_postprocess_elements": (lambda data: _postprocess_elements(data, page_sizes),
+                                  lambda: copy.deepcopy(extracted)),
+        "convert_pdf_to_images": render,
+        "detect_paragraphs": (detect_paragraphs, lambda: image_path),
+        "detect_paragraph_boxes": (lambda path: detect_paragraph_boxes(path, 0.5), lambda: image_path),
+    }
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("names", nargs="*", help="Benchmarks to run, all by default")
+    parser.add_argument("--repeat", type=int, default=20, help="Calls per benchmark")
+    parser.add_argument("--document", default="tests/data/documents/moz.pdf", help="PDF of the extraction and "
+                                                                                    "rendering benchmarks")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results: Dict[str, Dict[str, float]] = {}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, benchmark in benchmarks(args.document, work_dir).items():
+            if args.names and name not in args.names:
+                continue
+            if benchmark is None:
+                print(f"{name:<36} skipped")
+                continue
+
+            durations = measure(*benchmark, repeat=args.repeat)
+            results[name] = {"min": min(durations), "p50": float(np.percentile(durations, 50)),
+                             "p95": float(np.percentile(durations, 95))}
+            print(f"{name:<36} p50 {results[name]['p50'] * 1000:>9.2f}ms  p95 {results[name]['p95'] * 1000:>9.2f}ms  "
+                  f"min {results[name]['min'] * 1000:>9.2f}ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,250 @@
+"""Benchmark the full PiQaClient pipeline over a folder of decks, offline, with replayed extraction and completions.
+
+Every span of the run is collected from the instrumentation and reported per stage as the number of calls, their
+throughput and p50/p95 latency, next to the wall time and the peak resident memory. Caches are disabled, so every run
+extracts and completes every deck. Decks whose replayed extraction is empty, such as scanned decks recorded with the
+local backend, would skip completion, so they are excluded from the measured runs and reported separately unless
+--include-empty is given. Simulated latencies are multiplied by --latency-scale, so a run takes seconds instead of
+minutes while the stages keep their relative cost.
+
+Usage:
+    python -m benchmarks.pipeline [--documents data/documents] [--repeat 3] [--save-baseline]
+    python -m benchmarks.pipeline --record  # record the responses of the configured backends, needs credentials
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from piqa import PiQaClient
+from piqa.document_processing import get_extraction_backend
+from piqa.document_processing.extraction import extraction_cache
+from piqa.instrumentation import event_logger, metrics, peak_memory_bytes
+from piqa.large_language_models import AsyncCompletionEngine, get_chat_model
+from benchmarks.fakes import DEFAULT_RECORDINGS_PATH, ReplayChatModel, ReplayExtractionBackend
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+class SpanCollector(logging.Handler):
+    """Collects the duration of every span from the JSON events of the instrumentation."""
+    def __init__(self) -> None:
+        super().__init__(logging.INFO)
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        event = json.loads(record.getMessage())
+        name = f"{event['span']}:{event['stage']}" if "stage" in event else event["span"]
+        self.samples[name].append(event["seconds"])
+
+
+def run(file_paths: List[str], args: argparse.Namespace, record: bool = False) -> Dict[str, Any]:
+    """Run the pipeline once over the decks.
+
+    Args:
+        file_paths (List[str]): Paths to the decks.
+        args (argparse.Namespace): Options of the benchmark.
+        record (bool, optional): Record the responses of the configured backends. Defaults to False.
+
+    Returns:
+        Dict[str, Any]: Wall time, paths of the decks without data and the span samples of the run.
+    """
+    scale = 0 if record else args.latency_scale
+    extraction_backend = ReplayExtractionBackend(args.recordings, get_extraction_backend() if record else None,
+                                                 latency=2.0 * scale, page_latency=0.5 * scale)
+    chat_model = ReplayChatModel(recordings_path=args.recordings, source=get_chat_model() if record else None,
+                                 latency=0.5 * scale, token_latency=0.02 * scale)
+
+    engine = AsyncCompletionEngine(chat_model, requests_per_minute=0, tokens_per_minute=0, timeout=0)
+    client = PiQaClient(max_number_pages=args.pages, extraction_backend=extraction_backend, use_llm_cache=False,
+                        completion_engine=engine, layout_blocks=args.layout_blocks)
+
+    collector = SpanCollector()
+    level, propagate = event_logger.level, event_logger.propagate
+    event_logger.addHandler(collector)
+    event_logger.setLevel(logging.INFO)
+    event_logger.propagate = False
+    metrics.json_logs = True
+    started_at = time.perf_counter()
+
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            results = client.pipeline_pitchdeck_metrics(file_paths, output_dir, args.structured,
+                                                        extraction_workers=args.extraction_workers,
+                                                        completion_workers=args.completion_workers)
+    finally:
+        metrics.json_logs = False
+        event_logger.setLevel(level)
+        event_logger.propagate = propagate
+        event_logger.removeHandler(collector)
+
+    return {
+        "wall": time.perf_counter() - started_at,
+        "without_data": sorted(file_path for file_path, result in results.items() if result == "No data extracted"),
+        "samples": collector.samples,
+    }
+
+
+def summarize(runs: List[Dict[str, Any]], decks: int, excluded: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Summarize runs into the wall time, throughput and latency percentiles of every stage.
+
+    Args:
+        runs (List[Dict[str, Any]]): Results of run.
+        decks (int): Number of decks of every run.
+        excluded (List[str], optional): Decks left out of the runs because their replayed extraction is empty.
+
+    Returns:
+        Dict[str, Any]: The summary, as saved in the baseline.
+    """
+    wall = float(np.median([result["wall"] for result in runs]))
+    samples: Dict[str, List[float]] = defaultdict(list)
+    for result in runs:
+        for name, durations in result["samples"].items():
+            samples[name].extend(durations)
+
+    stages = {
+        name: {
+            "calls": len(durations) / len(runs),
+            "per_second": len(durations) / len(runs) / wall,
+            "p50": float(np.percentile(durations, 50)),
+            "p95": float(np.percentile(durations, 95)),
+        }
+        for name, durations in sorted(samples.items())
+    }
+
+    return {"decks": decks, "without_data": len(runs[-1]["without_data"]),
+            "excluded": [os.path.basename(file_path) for file_path in excluded or []], "wall": wall,
+            "decks_per_second": decks / wall, "peak_memory_bytes": peak_memory_bytes(), "stages": stages}
+
+
+def compare(summary: Dict[str, Any], baseline: Dict[str, Any], threshold: float,
+            min_seconds: float = 0.005) -> List[str]:
+    """Find the timings and the peak memory that got worse than the baseline by more than the threshold.
+
+    Args:
+        summary (Dict[str, Any]): Summary of this benchmark.
+        baseline (Dict[str, Any]): Summary of the baseline.
+        threshold (float): Relative increase that counts as a regression, e.g. 0.1 for 10%.
+        min_seconds (float, optional): Smallest increase of a timing that counts as a regression, so the noise of
+            spans of a few milliseconds is not reported. Defaults to 0.005.
+
+    Returns:
+        List[str]: A description of every regression.
+    """
+    values = [("wall", summary["wall"], baseline["wall"], min_seconds),
+              ("peak_memory_bytes", summary["peak_memory_bytes"], baseline.get("peak_memory_bytes"), 0)]
+    values += [(f"{name} {percentile}", stage[percentile], baseline["stages"][name][percentile], min_seconds)
+               for name, stage in summary["stages"].items() if name in baseline["stages"]
+               for percentile in ("p50", "p95")]
+
+    return [f"{name}: {value:.4g} vs {previous:.4g} (+{value / previous - 1:.0%})"
+            for name, value, previous, min_increase in values
+            if value and previous and value > previous * (1 + threshold) and value - previous > min_increase]
+
+
+def report(summary: Dict[str, Any]) -> None:
+    print(f"{summary['decks']} decks ({summary['without_data']} without data) in {summary['wall']:.2f}s, "
+          f"{summary['decks_per_second']:.2f} decks/s, peak memory {summary['peak_memory_bytes'] / 2 ** 20:.0f} MiB")
+    if summary["excluded"]:
+        print(f"  Excluded {len(summary['excluded'])} decks whose replayed extraction is empty, record them with "
+              f"--record: {', '.join(summary['excluded'])}")
+    print(f"  {'span':<36} {'calls':>7} {'per s':>8} {'p50 ms':>9} {'p95 ms':>9}")
+
+    for name, stage in summary["stages"].items():
+        print(f"  {name:<36} {stage['calls']:>7.0f} {stage['per_second']:>8.2f} {stage['p50'] * 1000:>9.1f} "
+              f"{stage['p95'] * 1000:>9.1f}")
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", default="data/documents", help="Folder of the decks")
+    parser.add_argument("--pages", type=int, default=5, help="Pages extracted per deck")
+    parser.add_argument("--repeat", type=int, default=3, help="Measured runs, the median wall time is reported")
+    parser.add_argument("--warmup", type=int, default=1, help="Runs before measuring, which also fill the recordings")
+    parser.add_argument("--latency-scale", type=float, default=0.1, help="Factor of the simulated latencies")
+    parser.add_argument("--extraction-workers", type=int, default=4)
+    parser.add_argument("--completion-workers", type=int, default=8)
+    parser.add_argument("--structured", action="store_true", help="Request one entry per section")
+    parser.add_argument("--layout-blocks", action="store_true", help="Merge elements into detected paragraph boxes")
+    parser.add_argument("--include-empty", action="store_true", help="Also measure decks whose replayed extraction "
+                                                                     "is empty")
+    parser.add_argument("--recordings", default=DEFAULT_RECORDINGS_PATH, help="Folder of the recorded responses")
+    parser.add_argument("--record", action="store_true", help="Record with the configured extraction backend and "
+                                                              "chat model instead of measuring")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="Summary to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="Save this summary as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown reported as a regression")
+    parser.add_argument("--min-seconds", type=float, default=0.005, help="Smallest slowdown of a timing reported "
+                                                                          "as a regression")
+    parser.add_argument("--output", help="Also write the summary to this JSON file")
+    args = parser.parse_args(argv)
+
+    file_paths = sorted(glob.glob(os.path.join(args.documents, "*.pdf")))
+    if not file_paths:
+        parser.error(f"No PDF files in {args.documents}")
+
+    # Every run extracts and completes every deck
+    extraction_cache.enabled = False
+    logging.getLogger().setLevel(logging.ERROR)
+
+    if args.record:
+        run(file_paths, args, record=True)
+        print(f"Recorded the responses for {len(file_paths)} decks to {args.recordings}")
+        return 0
+
+    # The first warm up run also finds the decks without data
+    excluded: List[str] = []
+    for warmup in range(max(args.warmup, 0 if args.include_empty else 1)):
+        without_data = run(file_paths, args)["without_data"]
+        if warmup == 0 and not args.include_empty:
+            excluded = without_data
+            file_paths = [file_path for file_path in file_paths if file_path not in excluded]
+
+    if not file_paths:
+        parser.error("Every deck has an empty replayed extraction, record them with --record")
+
+    summary = summarize([run(file_paths, args) for _ in range(args.repeat)], len(file_paths), excluded)
+    report(summary)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Saved the baseline to {args.baseline}")
+        return 0
+
+    baseline: Optional[Dict[str, Any]] = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if baseline is None:
+        print("No baseline to compare with, save one with --save-baseline")
+        return 0
+
+    if (baseline["decks"], baseline.get("excluded", [])) != (summary["decks"], summary["excluded"]):
+        print(f"The baseline measured {baseline['decks']} decks and excluded {baseline.get('excluded', [])}, its "
+              f"timings are not comparable")
+
+    regressions = compare(summary, baseline, args.threshold, args.min_seconds)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print(f"No regressions against {args.baseline} beyond {args.threshold:.0%}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
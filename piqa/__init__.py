@@ -1 +1,4 @@
-from .client import PiQaClient
+from .utils import lazy_exports
+
+__all__ = ["PiQaClient"]
+__getattr__, __dir__ = lazy_exports(__name__, {"PiQaClient": ".client"})
@@ -0,0 +1,241 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from piqa.config import logging
+from piqa.instrumentation import metrics
+
+INDEX_FILE_NAME = "index.json"
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """Write bytes to a file so readers never observe a partially written file.
+
+    Args:
+        path (str): Destination path.
+        data (bytes): Content to write.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class DiskCache:
+    """Content-addressed JSON cache persisted on disk with an index and eviction.
+
+    Entries are stored as one JSON file per key next to an ``index.json`` that records their size,
+    creation and last access time. Entries older than ``max_age`` seconds are dropped and, once the
+    total size exceeds ``max_bytes``, the least recently used entries are evicted first.
+
+    Args:
+        directory (str): Folder in which the entries and index are stored.
+        max_bytes (int, optional): Maximum total size of all entries. Defaults to None (unbounded).
+        max_age (float, optional): Maximum age of an entry in seconds. Defaults to None (never expires).
+        enabled (bool, optional): When False every lookup misses and nothing is written. Defaults to True.
+        name (str, optional): Label of the cache in the metrics. Defaults to "cache".
+
+    Attributes:
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups not found in the cache.
+    """
+    def __init__(self, directory: str, max_bytes: Optional[int] = None, max_age: Optional[float] = None,
+                 enabled: bool = True, name: str = "cache"):
+        self.directory = directory
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.RLock()
+        self._index: Optional[Dict[str, Dict[str, Any]]] = None
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, INDEX_FILE_NAME)
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        if self._index is None:
+            try:
+                with open(self._index_path) as f:
+                    self._index = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._index = {}
+
+        return self._index
+
+    def _save_index(self) -> None:
+        atomic_write(self._index_path, json.dumps(self._load_index()).encode("utf-8"))
+
+    def _is_expired(self, entry: Dict[str, Any], now: float) -> bool:
+        return self.max_age is not None and now - entry["created_at"] > self.max_age
+
+    def _remove(self, key: str) -> None:
+        self._load_index().pop(key, None)
+
+        if os.path.exists(self._entry_path(key)):
+            os.remove(self._entry_path(key))
+
+    def get(self, key: str) -> Optional[Any]:
+        """Look up a cached value.
+
+        Args:
+            key (str): Cache key.
+
+        Returns:
+            Optional[Any]: The cached value, or None on a miss.
+        """
+        return self.get_many([key])[key]
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Optional[Any]]:
+        """Look up several cached values, updating the index only once.
+
+        Args:
+            keys (Iterable[str]): Cache keys.
+
+        Returns:
+            Dict[str, Optional[Any]]: The cached value of every key, None for misses.
+        """
+        keys = list(dict.fromkeys(keys))
+
+        if not self.enabled:
+            self.misses += len(keys)
+            metrics.count("cache_misses", len(keys), cache=self.name)
+            return {key: None for key in keys}
+
+        values: Dict[str, Optional[Any]] = {}
+
+        with self._lock:
+            index = self._load_index()
+            now = time.time()
+            indexed = any(key in index for key in keys)
+
+            for key in keys:
+                values[key] = self._read(index, key, now)
+
+            # Access times and dropped entries only need to be persisted if any key was indexed
+            if indexed:
+                self._save_index()
+
+        return values
+
+    def _read(self, index: Dict[str, Dict[str, Any]], key: str, now: float) -> Optional[Any]:
+        entry = index.get(key)
+
+        if entry is None or self._is_expired(entry, now):
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            metrics.count("cache_misses", cache=self.name)
+            return None
+
+        try:
+            with open(self._entry_path(key)) as f:
+                value = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            logging.warning(f"Dropping unreadable cache entry {key}")
+            self._remove(key)
+            self.misses += 1
+            metrics.count("cache_misses", cache=self.name)
+            return None
+
+        entry["accessed_at"] = now
+        self.hits += 1
+        metrics.count("cache_hits", cache=self.name)
+        metrics.count("bytes_read", entry["size"], source=f"{self.name}_cache")
+
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        """Store a JSON serializable value and evict entries that no longer fit.
+
+        Args:
+            key (str): Cache key.
+            value (Any): JSON serializable value.
+        """
+        self.set_many({key: value})
+
+    def set_many(self, items: Dict[str, Any]) -> None:
+        """Store several JSON serializable values, updating the index only once.
+
+        Args:
+            items (Dict[str, Any]): Values keyed by cache key.
+        """
+        if not self.enabled:
+            return
+
+        data = {key: json.dumps(value).encode("utf-8") for key, value in items.items()}
+
+        with self._lock:
+            index = self._load_index()
+            now = time.time()
+
+            for key, content in data.items():
+                atomic_write(self._entry_path(key), content)
+                index[key] = {"size": len(content), "created_at": now, "accessed_at": now}
+
+            self._evict(now)
+            self._save_index()
+
+        metrics.count("bytes_written", sum(map(len, data.values())), target=f"{self.name}_cache")
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            entry = self._load_index().get(key)
+            return self.enabled and entry is not None and not self._is_expired(entry, time.time())
+
+    def _evict(self, now: float) -> None:
+        index = self._load_index()
+
+        for key in [key for key, entry in index.items() if self._is_expired(entry, now)]:
+            self._remove(key)
+
+        if self.max_bytes is None:
+            return
+
+        total_size = sum(entry["size"] for entry in index.values())
+        for key, entry in sorted(index.items(), key=lambda item: item[1]["accessed_at"]):
+            if total_size <= self.max_bytes:
+                break
+
+            total_size -= entry["size"]
+            self._remove(key)
+            logging.debug(f"Evicted cache entry {key}")
+
+    def clear(self) -> None:
+        """Remove every entry from the cache."""
+        with self._lock:
+            for key in list(self._load_index()):
+                self._remove(key)
+            self._save_index()
+
+    def stats(self) -> Dict[str, int]:
+        """Get hit/miss counters and the current size of the cache.
+
+        Returns:
+            Dict[str, int]: Number of hits, misses, entries and total bytes.
+        """
+        with self._lock:
+            index = self._load_index()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(index),
+                "bytes": sum(entry["size"] for entry in index.values()),
+            }
@@ -1,15 +1,62 @@
+import asyncio
+import json
 import os
-from dotenv import load_dotenv
-from typing import Optional, Union
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-from .config import logging
+import pandas as pd
+from pdfrw import PdfReader
+
+from .config import (logging,
+                     LAYOUT_BLOCKS,
+                     LLM_MAX_CONTENT_TOKENS,
+                     LLM_MAX_PROMPT_TOKENS,
+                     LLM_RELEVANCE_FILTER,
+                     NEAR_DUPLICATES_ENABLED,
+                     OPENAI_MODEL,
+                     PARAGRAPH_DETECTION_SCALE,
+                     FINAL_OUTPUT_PATH,
+                     PIPELINE_EXTRACTION_WORKERS,
+                     PIPELINE_COMPLETION_WORKERS,
+                     PIPELINE_WRITE_WORKERS,
+                     PIPELINE_QUEUE_SIZE)
 from .document_processing import (process_pdf,
-                                  convert_pdf_to_images,
+                                  ExtractionBackend,
+                                  get_extraction_backend,
+                                  iter_pdf_images,
+                                  select_pages,
+                                  detect_layout_blocks,
+                                  merge_layout_blocks,
                                   flatten_and_preprocess_adobe_json)
-from .image_processing import detect_paragraphs
-from .large_language_models import get_chat_completion
+from .large_language_models import (get_chat_completion,
+                                    agenerate_chat_completion,
+                                    AsyncCompletionEngine,
+                                    stream_chat_completion,
+                                    astream_chat_completion,
+                                    tee_to_file,
+                                    atee_to_file,
+                                    PitchDeckMetrics,
+                                    failed_sections,
+                                    get_structured_completion,
+                                    agenerate_structured_completion)
+from .instrumentation import metrics
+from .near_duplicates import NearDuplicateDetector, options_key
+from .pipeline import Stage, StageFailed, run_pipeline
+
+if TYPE_CHECKING:
+    from .document_processing.adobe_api import AdobeExtractionSession
+
+# Results that mean a deck could not be processed
+ERROR_RESULTS = {"No data extracted", "Error generating pitch deck metrics", "Error generating chat completion"}
+
+
+def is_error_result(result: Union[str, PitchDeckMetrics]) -> bool:
+    """Check whether a result means a deck could not be processed: an error message, or structured metrics without
+    any section because every request failed."""
+    if isinstance(result, str):
+        return result in ERROR_RESULTS
+
+    return all(value is None for value in result.values())
 
-load_dotenv()
 
 class PiQaClient:
     """Client to handle Pitch Deck operations.
@@ -17,53 +64,434 @@ class PiQaClient:
     Args:
         max_number_pages (int, optional): Maximum number of pages. Defaults to 5.
         tail (bool, optional): Tail option for page processing. Defaults to False.
+        pages (Iterable[int], optional): Explicit zero based page indices to process, overrides
+            max_number_pages and tail. Defaults to None.
+        extraction_backend (ExtractionBackend, optional): Backend used for PDF extraction.
+            Defaults to the backend chosen by the EXTRACTION_BACKEND setting.
+        extraction_session (AdobeExtractionSession, optional): Session for the Adobe backend.
+            Defaults to the session shared by the whole process.
+        use_llm_cache (bool, optional): Reuse cached completions of identical prompts. Defaults to True.
+        completion_engine (AsyncCompletionEngine, optional): Engine for the async API. Defaults to the engine of the
+            running event loop, so its concurrency and rate limits hold across clients.
+        layout_blocks (bool, optional): Merge the extracted elements into the paragraph boxes detected on the page
+            images, in reading order. Defaults to the LAYOUT_BLOCKS setting.
+        near_duplicates (bool, optional): Reuse the result of a near identical prior deck, and the extraction of the
+            unchanged pages of a similar one. Defaults to the NEAR_DUPLICATES_ENABLED setting.
+        near_duplicate_detector (NearDuplicateDetector, optional): Detector of the prior decks, implies
+            near_duplicates. Defaults to a detector with the NEAR_DUPLICATE* settings.
 
     Attributes:
         max_number_pages (int): Maximum number of pages.
         tail (bool): Tail option for page processing.
+        pages (Optional[List[int]]): Explicit page indices to process.
+        extraction_backend (ExtractionBackend): Backend used for PDF extraction.
+        use_llm_cache (bool): Reuse cached completions of identical prompts.
+        completion_engine (Optional[AsyncCompletionEngine]): Engine for the async API, None for the engine of the
+            running event loop.
+        layout_blocks (bool): Merge the extracted elements into detected paragraph boxes.
+        near_duplicate_detector (Optional[NearDuplicateDetector]): Detector of the prior decks, None to process every
+            deck in full.
     """
-    def __init__(self, max_number_pages: int = 5, tail: bool = False):
+    def __init__(self, max_number_pages: int = 5, tail: bool = False, pages: Optional[Iterable[int]] = None,
+                 extraction_backend: Optional[ExtractionBackend] = None,
+                 extraction_session: Optional["AdobeExtractionSession"] = None, use_llm_cache: bool = True,
+                 completion_engine: Optional[AsyncCompletionEngine] = None, layout_blocks: bool = LAYOUT_BLOCKS,
+                 near_duplicates: bool = NEAR_DUPLICATES_ENABLED,
+                 near_duplicate_detector: Optional[NearDuplicateDetector] = None):
         self.max_number_pages = max_number_pages
         self.tail = tail
+        self.pages = list(pages) if pages is not None else None
+
+        if extraction_backend is None and extraction_session is not None:
+            # The Adobe SDK is only imported when a session is given, the backend setting loads it on its own
+            from .document_processing.adobe_api import AdobeExtractionBackend
+            extraction_backend = AdobeExtractionBackend(extraction_session)
+        self.extraction_backend = extraction_backend or get_extraction_backend()
+        self.use_llm_cache = use_llm_cache
+        self.completion_engine = completion_engine
+        self.layout_blocks = layout_blocks
+        self.near_duplicate_detector = near_duplicate_detector or (NearDuplicateDetector() if near_duplicates else None)
+
+    def _page_indices(self, file_path: str) -> List[int]:
+        return select_pages(len(PdfReader(file_path).pages), self.max_number_pages, self.tail, self.pages)
+
+    def _result_options(self, structured: bool) -> str:
+        """Serialize every option the prompt of a deck depends on, so a result is not reused once they changed."""
+        return options_key(structured=structured, model=OPENAI_MODEL, backend=self.extraction_backend.name,
+                           layout_blocks=self.layout_blocks,
+                           detection_scale=PARAGRAPH_DETECTION_SCALE if self.layout_blocks else None,
+                           max_prompt_tokens=LLM_MAX_PROMPT_TOKENS, relevance_filter=LLM_RELEVANCE_FILTER,
+                           max_content_tokens=LLM_MAX_CONTENT_TOKENS)
+
+    def _reused_result(self, file_path: str, structured: bool) -> Optional[Union[str, PitchDeckMetrics]]:
+        """Get the result of a near identical prior deck, if near duplicates are detected."""
+        if self.near_duplicate_detector is None:
+            return None
+
+        try:
+            return self.near_duplicate_detector.find_result(file_path, self._page_indices(file_path),
+                                                            self._result_options(structured))
+        except Exception as e:
+            logging.warning(f"Error looking up near duplicates, processing the deck: {e}")
+            return None
+
+    def _remember_result(self, file_path: str, structured: bool, result: Union[str, PitchDeckMetrics]) -> None:
+        """Index a processed deck for the near duplicates of later decks.
+
+        Failed results are not indexed. Neither are partially failed structured results, they are returned to the
+        caller but a later near duplicate requests the failed sections again.
+        """
+        if self.near_duplicate_detector is None or is_error_result(result):
+            return
+        if not isinstance(result, str) and failed_sections(result):
+            logging.info(f"Not indexing {file_path} for near duplicates, sections failed: "
+                         f"{', '.join(failed_sections(result))}")
+            return
+
+        try:
+            self.near_duplicate_detector.remember(file_path, self._page_indices(file_path),
+                                                  self.extraction_backend.name, self._result_options(structured),
+                                                  result)
+        except Exception as e:
+            logging.warning(f"Error indexing the deck for near duplicates: {e}")
+
+    def _extract_elements(self, file_path: str) -> Optional[pd.DataFrame]:
+        if self.near_duplicate_detector is not None:
+            try:
+                self.near_duplicate_detector.reuse_pages(file_path, self._page_indices(file_path),
+                                                         self.extraction_backend.name)
+            except Exception as e:
+                logging.warning(f"Error reusing the pages of near duplicates, extracting every page: {e}")
+
+        adobe_json_data = process_pdf(file_path, self.max_number_pages, self.tail, self.extraction_backend, self.pages)
+
+        if not adobe_json_data:
+            return None
+
+        df = flatten_and_preprocess_adobe_json(adobe_json_data)
+
+        if self.layout_blocks:
+            df = self._merge_layout_blocks(file_path, df)
+
+        return df
+
+    def _merge_layout_blocks(self, file_path: str, df: pd.DataFrame) -> pd.DataFrame:
+        """Merge the elements into the paragraph boxes of their pages, or keep them if the pages cannot be rendered."""
+        try:
+            merged = merge_layout_blocks(df, detect_layout_blocks(file_path, self._page_indices(file_path)))
+
+            logging.debug(f"Merged {len(df)} elements into {len(merged)} layout blocks")
+            return merged
+
+        except Exception as e:
+            logging.warning(f"Error detecting the layout, using the extracted elements: {e}")
+            return df
 
-    def generate_pitchdeck_metrics(self, file_path: str) -> Union[str, dict]:
+    def generate_pitchdeck_metrics(self, file_path: str, structured: bool = False) -> Union[str, PitchDeckMetrics]:
         """Generate pitch deck metrics.
 
         Args:
             file_path (str): Path to the input file.
+            structured (bool, optional): Return one entry per section, requested in parallel, instead of markdown.
+                Defaults to False.
 
         Returns:
-            Union[str, dict]: Metrics result or error message.
+            Union[str, PitchDeckMetrics]: Metrics result or error message.
         """
         try:
-            adobe_json_data = process_pdf(file_path, self.max_number_pages, self.tail)
+            reused_result = self._reused_result(file_path, structured)
+            if reused_result is not None:
+                return reused_result
 
-            if not adobe_json_data:
+            df = self._extract_elements(file_path)
+
+            if df is None:
                 return "No data extracted"
 
-            df = flatten_and_preprocess_adobe_json(adobe_json_data)
-            completion_result = get_chat_completion(df)
+            if structured:
+                completion_result = get_structured_completion(df, self.use_llm_cache)
+            else:
+                completion_result = get_chat_completion(df, self.use_llm_cache)
+
+            self._remember_result(file_path, structured, completion_result)
+
+            return completion_result
+
+        except Exception as e:
+            logging.error(f"Error generating pitch deck metrics: {e}")
+            metrics.count("errors", stage="pitch_deck_metrics", error=type(e).__name__)
+            return "Error generating pitch deck metrics"
+
+    async def agenerate_pitchdeck_metrics(self, file_path: str,
+                                          structured: bool = False) -> Union[str, PitchDeckMetrics]:
+        """Generate pitch deck metrics without blocking the event loop.
+
+        The extraction runs in a worker thread and the completions are requested through the completion engine.
+
+        Args:
+            file_path (str): Path to the input file.
+            structured (bool, optional): Return one entry per section, requested in parallel, instead of markdown.
+                Defaults to False.
+
+        Returns:
+            Union[str, PitchDeckMetrics]: Metrics result or error message.
+        """
+        try:
+            reused_result = await asyncio.to_thread(self._reused_result, file_path, structured)
+            if reused_result is not None:
+                return reused_result
+
+            df = await asyncio.to_thread(self._extract_elements, file_path)
+            completion_result = await self._acomplete_elements(df, structured)
+
+            await asyncio.to_thread(self._remember_result, file_path, structured, completion_result)
 
             return completion_result
 
         except Exception as e:
             logging.error(f"Error generating pitch deck metrics: {e}")
+            metrics.count("errors", stage="pitch_deck_metrics", error=type(e).__name__)
             return "Error generating pitch deck metrics"
 
+    def stream_pitchdeck_metrics(self, file_path: str, by_section: bool = False,
+                                 output_path: Optional[str] = None) -> Iterator[str]:
+        """Generate pitch deck metrics, yielding the markdown while it is generated.
+
+        Args:
+            file_path (str): Path to the input file.
+            by_section (bool, optional): Yield whole sections instead of tokens. Defaults to False.
+            output_path (str, optional): File the output is written to as it arrives. Defaults to None.
+
+        Yields:
+            str: Tokens or sections of the metrics, or an error message.
+
+        Raises:
+            CompletionInterrupted: If the completion fails after part of it was yielded, the output file is removed.
+        """
+        try:
+            df = self._extract_elements(file_path)
+        except Exception as e:
+            logging.error(f"Error generating pitch deck metrics: {e}")
+            metrics.count("errors", stage="pitch_deck_metrics", error=type(e).__name__)
+            yield "Error generating pitch deck metrics"
+            return
+
+        if df is None:
+            yield "No data extracted"
+            return
+
+        pieces = stream_chat_completion(df, self.use_llm_cache, by_section)
+        yield from tee_to_file(pieces, output_path) if output_path else pieces
+
+    async def astream_pitchdeck_metrics(self, file_path: str, by_section: bool = False,
+                                        output_path: Optional[str] = None) -> AsyncIterator[str]:
+        """Generate pitch deck metrics without blocking the event loop, yielding the markdown while it is generated.
+
+        Args:
+            file_path (str): Path to the input file.
+            by_section (bool, optional): Yield whole sections instead of tokens. Defaults to False.
+            output_path (str, optional): File the output is written to as it arrives. Defaults to None.
+
+        Yields:
+            str: Tokens or sections of the metrics, or an error message.
+
+        Raises:
+            CompletionInterrupted: If the completion fails after part of it was yielded, the output file is removed.
+        """
+        try:
+            df = await asyncio.to_thread(self._extract_elements, file_path)
+        except Exception as e:
+            logging.error(f"Error generating pitch deck metrics: {e}")
+            metrics.count("errors", stage="pitch_deck_metrics", error=type(e).__name__)
+            yield "Error generating pitch deck metrics"
+            return
+
+        if df is None:
+            yield "No data extracted"
+            return
+
+        pieces = astream_chat_completion(df, self.completion_engine, self.use_llm_cache, by_section)
+        async for piece in atee_to_file(pieces, output_path) if output_path else pieces:
+            yield piece
+
+    async def agenerate_pitchdeck_metrics_batch(self, file_paths: Iterable[str],
+                                                structured: bool = False) -> Dict[str, Union[str, PitchDeckMetrics]]:
+        """Generate the metrics of several pitch decks concurrently.
+
+        Args:
+            file_paths (Iterable[str]): Paths to the input files.
+            structured (bool, optional): Return one entry per section instead of markdown. Defaults to False.
+
+        Returns:
+            Dict[str, Union[str, PitchDeckMetrics]]: Metrics result or error message per input file.
+        """
+        file_paths = list(file_paths)
+        results = await asyncio.gather(*[
+            self.agenerate_pitchdeck_metrics(file_path, structured) for file_path in file_paths
+        ])
+
+        return dict(zip(file_paths, results))
+
+    def generate_pitchdeck_metrics_batch(self, file_paths: Iterable[str],
+                                         structured: bool = False) -> Dict[str, Union[str, PitchDeckMetrics]]:
+        """Generate the metrics of several pitch decks concurrently, from synchronous code.
+
+        Args:
+            file_paths (Iterable[str]): Paths to the input files.
+            structured (bool, optional): Return one entry per section instead of markdown. Defaults to False.
+
+        Returns:
+            Dict[str, Union[str, PitchDeckMetrics]]: Metrics result or error message per input file.
+        """
+        return asyncio.run(self.agenerate_pitchdeck_metrics_batch(file_paths, structured))
+
+    async def _acomplete_elements(self, df: Optional[pd.DataFrame], structured: bool) -> Union[str, PitchDeckMetrics]:
+        if df is None:
+            return "No data extracted"
+
+        if structured:
+            return await agenerate_structured_completion(df, self.completion_engine, self.use_llm_cache)
+
+        return await agenerate_chat_completion(df, self.completion_engine, self.use_llm_cache)
+
+    @staticmethod
+    def _write_result(file_path: str, result: Union[str, PitchDeckMetrics], output_dir: str) -> str:
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        os.makedirs(output_dir, exist_ok=True)
+
+        if isinstance(result, dict):
+            output_path = os.path.join(output_dir, f"{name}_{OPENAI_MODEL}_result.json")
+            content = json.dumps(result, indent=2, ensure_ascii=False)
+        else:
+            output_path = os.path.join(output_dir, f"{name}_{OPENAI_MODEL}_result.md")
+            content = result
+
+        with open(output_path, "w") as f:
+            f.write(content)
+
+        return output_path
+
+    async def apipeline_pitchdeck_metrics(self, file_paths: Iterable[str],
+                                          output_dir: Optional[str] = FINAL_OUTPUT_PATH, structured: bool = False,
+                                          extraction_workers: int = PIPELINE_EXTRACTION_WORKERS,
+                                          completion_workers: int = PIPELINE_COMPLETION_WORKERS,
+                                          write_workers: int = PIPELINE_WRITE_WORKERS,
+                                          queue_size: int = PIPELINE_QUEUE_SIZE,
+                                          stats: Optional[Dict[str, Dict[str, float]]] = None
+                                          ) -> AsyncIterator[Tuple[str, Union[str, PitchDeckMetrics]]]:
+        """Generate the metrics of many pitch decks in a pipeline, yielding every deck as soon as it is done.
+
+        Extraction, completion and writing the result are stages with their own number of workers, connected by
+        bounded queues. Decks are extracted while earlier decks are completed, and a slow stage holds back the stages
+        before it instead of piling up decks in memory.
+
+        Args:
+            file_paths (Iterable[str]): Paths to the input files, consumed as the extraction stage takes them.
+            output_dir (str, optional): Folder every result is written to as '<name>_<model>_result.md', or '.json'
+                when structured, None to not write results. Failed results are not written. Defaults to the
+                FINAL_OUTPUT_PATH setting.
+            structured (bool, optional): Return one entry per section instead of markdown. Defaults to False.
+            extraction_workers (int, optional): Decks extracted at the same time. Defaults to the
+                PIPELINE_EXTRACTION_WORKERS setting.
+            completion_workers (int, optional): Decks completed at the same time, the requests are also limited by
+                the completion engine. Defaults to the PIPELINE_COMPLETION_WORKERS setting.
+            write_workers (int, optional): Results written at the same time. Defaults to the PIPELINE_WRITE_WORKERS
+                setting.
+            queue_size (int, optional): Decks waiting in front of every stage. Defaults to the PIPELINE_QUEUE_SIZE
+                setting.
+            stats (Dict[str, Dict[str, float]], optional): Filled with the statistics of every stage, see run_pipeline.
+
+        Yields:
+            Tuple[str, Union[str, PitchDeckMetrics]]: The path and the metrics result or error message of every deck,
+                in order of completion.
+        """
+        async def extract(file_path: str, _: Any) -> Union[Optional[pd.DataFrame], str, PitchDeckMetrics]:
+            # The result of a near duplicate skips the extraction and the completion
+            reused_result = await asyncio.to_thread(self._reused_result, file_path, structured)
+            if reused_result is not None:
+                return reused_result
+
+            return await asyncio.to_thread(self._extract_elements, file_path)
+
+        async def complete(file_path: str, df: Union[Optional[pd.DataFrame], str, PitchDeckMetrics]
+                           ) -> Union[str, PitchDeckMetrics]:
+            if df is not None and not isinstance(df, pd.DataFrame):
+                return df
+
+            completion_result = await self._acomplete_elements(df, structured)
+            await asyncio.to_thread(self._remember_result, file_path, structured, completion_result)
+
+            return completion_result
+
+        async def write(file_path: str, result: Union[str, PitchDeckMetrics]) -> Union[str, PitchDeckMetrics]:
+            if is_error_result(result):
+                logging.warning(f"Not writing the metrics of {file_path}: {result}")
+                return result
+
+            output_path = await asyncio.to_thread(self._write_result, file_path, result, output_dir)
+            logging.info(f"Wrote the metrics of {file_path} to {output_path}")
+            return result
+
+        stages = [Stage("extraction", extract, extraction_workers), Stage("completion", complete, completion_workers)]
+        if output_dir is not None:
+            stages.append(Stage("write", write, write_workers))
+
+        async for file_path, result in run_pipeline(file_paths, stages, queue_size, stats):
+            if isinstance(result, StageFailed):
+                result = "Error generating pitch deck metrics"
+            yield file_path, result
+
+    def pipeline_pitchdeck_metrics(self, file_paths: Iterable[str], output_dir: Optional[str] = FINAL_OUTPUT_PATH,
+                                   structured: bool = False, **kwargs: Any) -> Dict[str, Union[str, PitchDeckMetrics]]:
+        """Generate the metrics of many pitch decks in a pipeline, from synchronous code.
+
+        Args:
+            file_paths (Iterable[str]): Paths to the input files.
+            output_dir (str, optional): Folder the results are written to, None to not write results. Defaults to
+                the FINAL_OUTPUT_PATH setting.
+            structured (bool, optional): Return one entry per section instead of markdown. Defaults to False.
+            **kwargs: Workers and queue size of the stages, see apipeline_pitchdeck_metrics.
+
+        Returns:
+            Dict[str, Union[str, PitchDeckMetrics]]: Metrics result or error message per input file, in order of
+                completion.
+        """
+        stats: Dict[str, Dict[str, float]] = {}
+
+        async def collect() -> Dict[str, Union[str, PitchDeckMetrics]]:
+            pipeline = self.apipeline_pitchdeck_metrics(file_paths, output_dir, structured, stats=stats, **kwargs)
+            return {file_path: result async for file_path, result in pipeline}
+
+        results = asyncio.run(collect())
+
+        wall = stats["pipeline"]["wall"]
+        for stage, stage_stats in stats.items():
+            if stage != "pipeline":
+                logging.info(f"{stage}: {stage_stats['items']:.0f} decks, {stage_stats['failures']:.0f} failed, "
+                             f"busy {stage_stats['busy']:.1f}s in {wall:.1f}s")
+
+        return results
+
     def _optional_enhancements(self, file_path: str) -> Optional[str]:
         """Optional enhancements like image conversion and paragraph detection.
 
+        Pages are rendered in memory and their paragraphs are detected in parallel processes while the next pages
+        are rendered.
+
         Args:
             file_path (str): Path to the input file.
 
         Returns:
             Optional[str]: Error message, if any.
         """
+        # OpenCV is only needed here, so it is not imported with the client
+        from .image_processing import detect_paragraphs_batch
+
         try:
-            page_image_paths = convert_pdf_to_images(file_path)
+            page_images = (image for _, image in iter_pdf_images(file_path, grayscale=True, as_array=True))
+            page_paragraphs = list(detect_paragraphs_batch(page_images))
 
-            for page_image_path in page_image_paths:
-                detect_paragraphs(page_image_path)
+            logging.debug(f"Detected {sum(map(len, page_paragraphs))} paragraphs on {len(page_paragraphs)} pages")
 
         except Exception as e:
             logging.error(f"Error in optional enhancements: {e}")
@@ -1,6 +1,97 @@
 import os
 import logging
 
+from dotenv import load_dotenv
+
+# Loaded once here, before any setting is read, so a .env file configures every module of the package
+load_dotenv()
+
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 logging.basicConfig(level=LOG_LEVEL)
 ENV = os.getenv("ENV", "dev")
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+
+# Name of the extraction backend used by process_pdf, either "adobe" or "local"
+EXTRACTION_BACKEND = os.getenv("EXTRACTION_BACKEND", "adobe")
+ADOBE_CREDENTIALS_PATH = os.getenv("ADOBE_CREDENTIALS_PATH", "credentials/pdfservices-api-credentials.json")
+
+ADOBE_OUTPUTS_PATH = os.getenv("ADOBE_OUTPUTS_PATH", "data/adobe_outputs")
+PERSIST_EXTRACTION_OUTPUTS = os.getenv("PERSIST_EXTRACTION_OUTPUTS", "false").lower() == "true"
+
+EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", "data/adobe_outputs/cache")
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(1024 ** 3)))
+EXTRACTION_CACHE_MAX_AGE = float(os.getenv("EXTRACTION_CACHE_MAX_AGE", str(30 * 24 * 60 * 60)))
+
+# Budget of the extraction service, shared by all extractions of the process, 0 requests per minute is unlimited
+EXTRACTION_REQUESTS_PER_MINUTE = float(os.getenv("EXTRACTION_REQUESTS_PER_MINUTE", "25"))
+EXTRACTION_MAX_CONCURRENCY = int(os.getenv("EXTRACTION_MAX_CONCURRENCY", "4"))
+EXTRACTION_MAX_RETRIES = int(os.getenv("EXTRACTION_MAX_RETRIES", "5"))
+EXTRACTION_BACKOFF_BASE = float(os.getenv("EXTRACTION_BACKOFF_BASE", "2"))
+EXTRACTION_BACKOFF_MAX = float(os.getenv("EXTRACTION_BACKOFF_MAX", "60"))
+
+# Completions are cached by model, parameters and prompt, set LLM_CACHE_ENABLED="false" to always call the model
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "data/llm_cache")
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 ** 2)))
+LLM_CACHE_MAX_AGE = float(os.getenv("LLM_CACHE_MAX_AGE", str(7 * 24 * 60 * 60)))
+
+# Decks whose text does not fit a prompt of LLM_MAX_PROMPT_TOKENS are summarized in chunks, LLM_MAX_WORKERS at a time
+LLM_MAX_PROMPT_TOKENS = int(os.getenv("LLM_MAX_PROMPT_TOKENS", "3000"))
+LLM_MAX_WORKERS = int(os.getenv("LLM_MAX_WORKERS", "4"))
+
+# Limits of the async completion engine shared by all decks in flight in an event loop, 0 disables a limit
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "3500"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "90000"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+
+# Drop repeated elements and keep the most relevant ones within LLM_MAX_CONTENT_TOKENS, 0 keeps every element so long
+# decks are summarized in chunks
+LLM_RELEVANCE_FILTER = os.getenv("LLM_RELEVANCE_FILTER", "true").lower() == "true"
+LLM_MAX_CONTENT_TOKENS = int(os.getenv("LLM_MAX_CONTENT_TOKENS", "0"))
+
+# Pages are rendered RASTER_THREAD_COUNT at a time, so only that many page images are held in memory
+RASTER_DPI = int(os.getenv("RASTER_DPI", "200"))
+RASTER_THREAD_COUNT = int(os.getenv("RASTER_THREAD_COUNT", "4"))
+RASTER_IMAGES_PATH = os.getenv("RASTER_IMAGES_PATH", "data/images")
+
+# Paragraphs are detected on images downscaled by PARAGRAPH_DETECTION_SCALE, in PARAGRAPH_MAX_WORKERS processes (0 is
+# one per CPU)
+PARAGRAPH_DETECTION_SCALE = float(os.getenv("PARAGRAPH_DETECTION_SCALE", "0.5"))
+PARAGRAPH_MAX_WORKERS = int(os.getenv("PARAGRAPH_MAX_WORKERS", "0"))
+
+# Merge extracted elements into the paragraph boxes detected on the page images, this renders every page
+LAYOUT_BLOCKS = os.getenv("LAYOUT_BLOCKS", "false").lower() == "true"
+
+# Stages of the batch pipeline work on this many decks at the same time, with PIPELINE_QUEUE_SIZE decks between stages
+PIPELINE_EXTRACTION_WORKERS = int(os.getenv("PIPELINE_EXTRACTION_WORKERS", "4"))
+PIPELINE_COMPLETION_WORKERS = int(os.getenv("PIPELINE_COMPLETION_WORKERS", "8"))
+PIPELINE_WRITE_WORKERS = int(os.getenv("PIPELINE_WRITE_WORKERS", "2"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+FINAL_OUTPUT_PATH = os.getenv("FINAL_OUTPUT_PATH", "data/final_output")
+
+# Spans and counters of every stage, logged as JSON events with INSTRUMENTATION_JSON_LOGS and served in the Prometheus
+# format on METRICS_PORT by run_piqa_package.py (0 does not serve them)
+INSTRUMENTATION_ENABLED = os.getenv("INSTRUMENTATION_ENABLED", "true").lower() == "true"
+INSTRUMENTATION_JSON_LOGS = os.getenv("INSTRUMENTATION_JSON_LOGS", "false").lower() == "true"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Service mode of run_piqa_service.py: a job queue persisted in SERVICE_DB_PATH, worked on by SERVICE_WORKERS threads
+# sharing one warm client, with uploaded decks stored in SERVICE_UPLOADS_PATH by content hash. Decks submitted by path
+# must be in SERVICE_DOCUMENTS_PATH, "" only accepts uploads
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8080"))
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", "4"))
+SERVICE_DB_PATH = os.getenv("SERVICE_DB_PATH", "data/service/jobs.sqlite3")
+SERVICE_UPLOADS_PATH = os.getenv("SERVICE_UPLOADS_PATH", "data/service/uploads")
+SERVICE_MAX_UPLOAD_BYTES = int(os.getenv("SERVICE_MAX_UPLOAD_BYTES", str(50 * 1024 ** 2)))
+SERVICE_DOCUMENTS_PATH = os.getenv("SERVICE_DOCUMENTS_PATH", "data/documents")
+
+# Decks are fingerprinted from their text layer and indexed in NEAR_DUPLICATES_DB_PATH. The result of a prior deck with
+# the same text on every page is reused, and pages with unchanged text of a deck at least NEAR_DUPLICATE_PAGES_THRESHOLD
+# similar reuse the extraction of the prior deck
+NEAR_DUPLICATES_ENABLED = os.getenv("NEAR_DUPLICATES_ENABLED", "false").lower() == "true"
+NEAR_DUPLICATES_DB_PATH = os.getenv("NEAR_DUPLICATES_DB_PATH", "data/near_duplicates.sqlite3")
+NEAR_DUPLICATE_PAGES_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_PAGES_THRESHOLD", "0.5"))
@@ -1,3 +1,25 @@
-from .adobe_api import process_pdf
-from .adobe_parsing import flatten_and_preprocess_adobe_json
-from .pdf_operations import convert_pdf_to_images
+from piqa.utils import lazy_exports
+
+# Public names are imported on first use, so only the dependencies of the modules that are used get loaded
+_EXPORTS = {
+    "process_pdf": ".extraction",
+    "process_pdfs": ".extraction",
+    "AdobeExtractionBackend": ".adobe_api",
+    "AdobeExtractionSession": ".adobe_api",
+    "get_extraction_session": ".adobe_api",
+    "ExtractionBackend": ".extraction_backends",
+    "ExtractionError": ".extraction_backends",
+    "LocalExtractionBackend": ".extraction_backends",
+    "get_extraction_backend": ".extraction_backends",
+    "register_extraction_backend": ".extraction_backends",
+    "ExtractionScheduler": ".scheduling",
+    "flatten_and_preprocess_adobe_json": ".adobe_parsing",
+    "convert_pdf_to_images": ".pdf_operations",
+    "iter_pdf_images": ".pdf_operations",
+    "select_pages": ".pdf_operations",
+    "detect_layout_blocks": ".layout",
+    "merge_layout_blocks": ".layout",
+}
+
+__all__ = list(_EXPORTS)
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS)
@@ -8,12 +8,12 @@
 # OF ANY KIND, either express or implied. See the License for the specific language
 # governing permissions and limitations under the License.
 # Standard library imports
+import io
 import json
 import os
-import shutil
-import time
-from glob import glob
-from typing import Any, Dict, List, Optional
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
 import zipfile
 
 # Third party imports
@@ -24,6 +24,7 @@ from adobe.pdfservices.operation.exception.exceptions import (
     ServiceUsageException,
 )
 from adobe.pdfservices.operation.execution_context import ExecutionContext
+from adobe.pdfservices.operation.internal.auth.authenticator import Authenticator
 from adobe.pdfservices.operation.io.file_ref import FileRef
 from adobe.pdfservices.operation.pdfops.extract_pdf_operation import ExtractPDFOperation
 from adobe.pdfservices.operation.pdfops.options.extractpdf.extract_element_type import (
@@ -35,191 +36,236 @@ from adobe.pdfservices.operation.pdfops.options.extractpdf.extract_pdf_options i
 from adobe.pdfservices.operation.pdfops.options.extractpdf.extract_renditions_element_type import (
     ExtractRenditionsElementType,
 )
-from pdfrw import PdfReader, PdfWriter
 
 # Local application imports
-from piqa.config import logging
-
-TMP_PATH = 'data/tmp'
-
-def _update_bounds(element: Dict[str, Any], page_sizes: List[Dict[str, int]], dpi: int) -> None:
-    bounds = element["Bounds"]
-    page_index = element["Page"]
-    page_size = page_sizes[page_index - 1]
-
-    height = page_size["height"]
-    width = page_size["width"]
-
-    element["PercentileBounds"] = {
-        "left": bounds[0] / width,
-        "top": (height - bounds[3]) / height,
-        "right": bounds[2] / width,
-        "bottom": (height - bounds[1]) / height,
-    }
-
-    if element.get("CharBounds"):
-        new_bounds = []
-        for bound in element.get("CharBounds", []):
-            new_bounds.append(
-                {
-                    "left": bounds[0] / width,
-                    "top": (height - bounds[3]) / height,
-                    "right": bounds[2] / width,
-                    "bottom": (height - bounds[1]) / height,
-                }
+from piqa.instrumentation import metrics
+from piqa.utils import persist_in_background
+from .extraction_backends import ExtractionBackend, ExtractionError, PdfSource
+from .scheduling import ExtractionScheduler
+from piqa.config import (ADOBE_CREDENTIALS_PATH,
+                         EXTRACTION_REQUESTS_PER_MINUTE,
+                         EXTRACTION_MAX_CONCURRENCY,
+                         EXTRACTION_MAX_RETRIES,
+                         EXTRACTION_BACKOFF_BASE,
+                         EXTRACTION_BACKOFF_MAX)
+
+class _CachedTokenAuthenticator(Authenticator):
+    """Wraps the SDK authenticator so its access token is reused until it is about to expire.
+
+    The SDK decides to refresh based on the age of the token rather than its expiry, which fetches a new token
+    every few minutes. This wrapper only refreshes when the token is within ``refresh_margin`` of expiring.
+    """
+    def __init__(self, authenticator: Authenticator, refresh_margin: timedelta):
+        self._authenticator = authenticator
+        self._refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._token: Any = None
+
+    def session_token(self) -> Any:
+        with self._lock:
+            if self._token is None or self._token.expired_at - datetime.now() <= self._refresh_margin:
+                self._token = self._authenticator.refresh_token()
+            return self._token
+
+    def refresh_token(self) -> Any:
+        with self._lock:
+            self._token = self._authenticator.refresh_token()
+            return self._token
+
+    def get_api_key(self) -> str:
+        return self._authenticator.get_api_key()
+
+
+class AdobeExtractionSession:
+    """Long-lived, thread-safe session with the Adobe PDF Extract API.
+
+    Credentials are loaded once and the execution context, including its access token, is reused for every
+    extraction until the token expires.
+
+    Args:
+        credentials_path (str, optional): Path to the service account credentials. Defaults to ADOBE_CREDENTIALS_PATH.
+        token_refresh_margin (timedelta, optional): Refresh the token this long before it expires.
+            Defaults to 5 minutes.
+    """
+    def __init__(self, credentials_path: str = ADOBE_CREDENTIALS_PATH,
+                 token_refresh_margin: timedelta = timedelta(minutes=5)):
+        self.credentials_path = credentials_path
+        self.token_refresh_margin = token_refresh_margin
+
+        self._lock = threading.Lock()
+        self._execution_context: Optional[ExecutionContext] = None
+        self._extract_pdf_options: Optional[ExtractPDFOptions] = None
+
+    @property
+    def execution_context(self) -> ExecutionContext:
+        with self._lock:
+            if self._execution_context is None:
+                credentials = (
+                    Credentials.service_account_credentials_builder()
+                        .from_file(self.credentials_path)
+                        .build()
+                )
+
+                execution_context = ExecutionContext.create(credentials)
+                execution_context.authenticator = _CachedTokenAuthenticator( # type: ignore
+                    execution_context.authenticator, self.token_refresh_margin # type: ignore
+                )
+                self._execution_context = execution_context
+
+            return self._execution_context
+
+    @property
+    def extract_pdf_options(self) -> ExtractPDFOptions:
+        if self._extract_pdf_options is None:
+            self._extract_pdf_options = (
+                ExtractPDFOptions.builder()
+                    .with_elements_to_extract(
+                        [
+                            ExtractElementType.TEXT,
+                            ExtractElementType.TABLES,
+                        ]
+                    )
+                    .with_elements_to_extract_renditions(
+                        [
+                            ExtractRenditionsElementType.TABLES,
+                            ExtractRenditionsElementType.FIGURES,
+                        ]
+                    )
+                    .build()
             )
 
-        element["PercentileCharBounds"] = new_bounds
+        return self._extract_pdf_options
 
+    def extract(self, source: PdfSource) -> FileRef:
+        """Run the extract operation on a PDF.
 
-def _preprocess_pdf(input_file_path: str, output_file_path: str, max_number_pages: int, tail: bool) -> List[Dict[str, int]]:
-    pdf_input = PdfReader(input_file_path)
-    pdf_output_writer = PdfWriter()
-    pages = pdf_input.pages[-max_number_pages:] if tail else pdf_input.pages[:max_number_pages] #type: ignore
+        Args:
+            source (PdfSource): Path to the PDF or its content.
 
-    for page in pages: #type: ignore
-        pdf_output_writer.addPage(page)
+        Returns:
+            FileRef: Reference to the zip file returned by the service.
+        """
+        extract_pdf_operation = ExtractPDFOperation.create_new()
 
-    os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
-    pdf_output_writer.write(output_file_path)
+        if isinstance(source, bytes):
+            input_file_ref = FileRef.create_from_stream(io.BytesIO(source), "application/pdf") # type: ignore
+        else:
+            input_file_ref = FileRef.create_from_local_file(source)
+        extract_pdf_operation.set_input(input_file_ref)
+        extract_pdf_operation.set_options(self.extract_pdf_options)
 
-    pdf_output = PdfReader(output_file_path)
-    page_sizes = []
+        result: FileRef = extract_pdf_operation.execute(self.execution_context)
 
-    for page_index, page in enumerate(pdf_output.pages): #type: ignore
-        width, height = page.inheritable.MediaBox[-2:]
-        width = int(float(width))
-        height = int(float(height))
-        page_sizes.append({"page_index": page_index, "width": width, "height": height})
+        return result
 
-    return page_sizes
 
+_extraction_session: Optional[AdobeExtractionSession] = None
+_extraction_session_lock = threading.Lock()
 
-def _call_adobe_service(file_path: str) -> FileRef:
-    credentials = (
-        Credentials.service_account_credentials_builder()
-            .from_file("credentials/pdfservices-api-credentials.json")
-            .build()
-    )
 
-    execution_context = ExecutionContext.create(credentials)
-    extract_pdf_operation = ExtractPDFOperation.create_new()
+def get_extraction_session() -> AdobeExtractionSession:
+    """Get the extraction session shared by every caller in the process.
 
-    source = FileRef.create_from_local_file(file_path)
-    extract_pdf_operation.set_input(source)
+    Returns:
+        AdobeExtractionSession: The shared session.
+    """
+    global _extraction_session # pylint: disable=global-statement
 
-    extract_pdf_options: ExtractPDFOptions = (
-        ExtractPDFOptions.builder()
-            .with_elements_to_extract(
-                [
-                    ExtractElementType.TEXT,
-                    ExtractElementType.TABLES,
-                ]
-            )
-            .with_elements_to_extract_renditions(
-                [
-                    ExtractRenditionsElementType.TABLES,
-                    ExtractRenditionsElementType.FIGURES,
-                ]
-            )
-            .build()
-    )
-    extract_pdf_operation.set_options(extract_pdf_options)
-
-    result: FileRef = extract_pdf_operation.execute(execution_context)
+    with _extraction_session_lock:
+        if _extraction_session is None:
+            _extraction_session = AdobeExtractionSession()
 
-    return result
+        return _extraction_session
 
 
-def _extract_data_from_result(result: FileRef, op_zip_file_path: str) -> Optional[Dict[str, Any]]:
-    if os.path.exists(op_zip_file_path):
-        os.remove(op_zip_file_path)
+# Throttling, timeouts and server errors are transient, anything else (e.g. an invalid PDF) fails the same way again
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
 
-    result.save_as(op_zip_file_path)
-
-    json_data = None
-    with zipfile.ZipFile(op_zip_file_path, "r") as zip_ref:
-        names = zip_ref.namelist()
-        for name in names:
-            if name.find("structuredData.json") == -1:
-                continue
-            with open("/tmp/structuredData.json", "wb") as f:
-                json_data = json.loads(zip_ref.read(name))
-                break
 
-    logging.debug("Saved zip file to {op_zip_file_path}")
+def _is_retryable_error(err: Exception) -> bool:
+    if isinstance(err, (ServiceApiException, ServiceUsageException)):
+        return err.status_code in RETRYABLE_STATUS_CODES
 
-    with open(op_zip_file_path.replace(".zip", ".json"), "w+") as f:
-        f.write(json.dumps(json_data))
+    # Raised by the SDK for connection errors and timeouts
+    return isinstance(err, SdkException)
 
-    return json_data
 
+extraction_scheduler = ExtractionScheduler(
+    requests_per_minute=EXTRACTION_REQUESTS_PER_MINUTE,
+    max_concurrency=EXTRACTION_MAX_CONCURRENCY,
+    max_retries=EXTRACTION_MAX_RETRIES,
+    backoff_base=EXTRACTION_BACKOFF_BASE,
+    backoff_max=EXTRACTION_BACKOFF_MAX,
+    is_retryable=_is_retryable_error,
+)
 
-def _postprocess_elements(json_data: Dict[str, Any], page_sizes: List[Dict[str, int]], dpi: int = 72) -> Dict[str, Any]:
-    for element in json_data["elements"]:
-        if element.get("Bounds"):
-            _update_bounds(element, page_sizes, dpi)
-
-        if element.get("Kids"):
-            for kid in element["Kids"]:
-                if kid.get("Bounds"):
-                    _update_bounds(kid, page_sizes, dpi)
-
-    os.makedirs("data/adobe_outputs", exist_ok=True)
-    return json_data
 
-def process_pdf(input_file_path: str, max_number_pages: int = 1, tail: bool = False) -> Optional[Dict[str, Any]]:
-    start_time = time.perf_counter()
+@metrics.timed("adobe_service")
+def _call_adobe_service(source: PdfSource, session: Optional[AdobeExtractionSession] = None) -> FileRef:
+    return (session or get_extraction_session()).extract(source)
 
-    os.makedirs(TMP_PATH, exist_ok=True)
 
-    root, _ = os.path.splitext(input_file_path)
-    file_name = os.path.basename(root)
-    output_file_path = f"data/processed_documents/{file_name}.pdf"
+class _ResultBuffer(io.BytesIO):
+    """In-memory stream that survives ``FileRef.write_to_stream`` closing it."""
+    def close(self) -> None:
+        pass
 
-    existing_files = glob(f"data/adobe_outputs/{file_name}*.json")
 
-    if existing_files:
-        logging.debug("Not calling Adobe SDK, file already processed")
-        shutil.rmtree(TMP_PATH)
+def _read_result(result: FileRef) -> bytes:
+    buffer = _ResultBuffer()
+    result.write_to_stream(buffer)
 
-        with open(existing_files[0]) as json_file:
-            return json.load(json_file)
+    # The SDK downloads results to a temporary file which is only cleaned up by save_as()
+    result_file_path = getattr(result, "_file_path", None)
+    if result_file_path and os.path.exists(result_file_path):
+        os.remove(result_file_path)
 
-    page_sizes = _preprocess_pdf(input_file_path, output_file_path, max_number_pages, tail)
+    return buffer.getvalue()
 
-    logging.debug(f"[{round(time.perf_counter() - start_time, 2)}s] Starting...")
 
-    try:
-        result = _call_adobe_service(output_file_path)
+@metrics.timed("read_result")
+def _extract_data_from_result(result: FileRef, op_zip_file_path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    zip_content = _read_result(result)
+    metrics.count("bytes_read", len(zip_content), source="adobe_result")
 
-        op_zip_file_path = f'{output_file_path.replace("processed_documents", "tmp")}-output.zip'
-        json_data = _extract_data_from_result(result, op_zip_file_path)
+    json_content = None
+    with zipfile.ZipFile(io.BytesIO(zip_content), "r") as zip_ref:
+        for name in zip_ref.namelist():
+            if name.endswith("structuredData.json"):
+                json_content = zip_ref.read(name)
+                break
 
-        if not json_data:
-            logging.warning(f"[{round(time.perf_counter() - start_time, 2)}s] No data extracted")
-            return None
+    if op_zip_file_path:
+        files = {op_zip_file_path: zip_content}
+        if json_content is not None:
+            files[op_zip_file_path.replace(".zip", ".json")] = json_content
+        persist_in_background(files)
 
-        processed_json_data = _postprocess_elements(json_data, page_sizes)
+    return json.loads(json_content) if json_content is not None else None
 
-        op_json_file_path = (
-            op_zip_file_path.replace(".zip", "_transformed.json").replace("tmp", "adobe_outputs").replace(".pdf", "")
-        )
 
-        with open(op_json_file_path, "w+") as f:
-            f.write(json.dumps(processed_json_data))
+class AdobeExtractionBackend(ExtractionBackend):
+    """Extracts PDFs remotely with the Adobe PDF Extract API.
 
-        logging.debug(f"[{round(time.perf_counter() - start_time, 2)}s] Transformed JSON data and written to {op_json_file_path}")
+    Calls go through a scheduler that keeps them within the request budget of the service and retries throttled or
+    failed calls.
 
-        logging.debug(f"[{round(time.perf_counter() - start_time, 2)}s] Finished")
-        logging.debug(
-            "--------------------------------------------------------------------------------------------------------------"
-        )
+    Args:
+        session (AdobeExtractionSession, optional): Session to extract with. Defaults to the shared session.
+        scheduler (ExtractionScheduler, optional): Scheduler to call the service with. Defaults to the shared
+            scheduler configured by the EXTRACTION_* settings.
+    """
+    name = "adobe"
 
-        # shutil.rmtree(TMP_PATH)
+    def __init__(self, session: Optional[AdobeExtractionSession] = None,
+                 scheduler: Optional[ExtractionScheduler] = None):
+        self.session = session
+        self.scheduler = scheduler or extraction_scheduler
 
-    except (SdkException, ServiceApiException, ServiceUsageException) as err:
-        logging.error(f"[{round(time.perf_counter() - start_time, 2)}s] Exception encountered: {err}")
-        shutil.rmtree(TMP_PATH)
+    def extract(self, source: PdfSource, output_path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        try:
+            result = self.scheduler.run(_call_adobe_service, source, self.session)
+        except (SdkException, ServiceApiException, ServiceUsageException) as err:
+            raise ExtractionError(f"Could not extract PDF: {err}") from err
 
-        return None
+        return _extract_data_from_result(result, output_path)
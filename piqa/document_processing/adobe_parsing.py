@@ -1,28 +1,139 @@
-from typing import Dict, Any
+import os
+from typing import Dict, Any, Iterable, List, Optional, Sequence
 
+import numpy as np
 import pandas as pd
 
-def flatten_and_preprocess_adobe_json(json_data: Dict[Any, Any]) -> pd.DataFrame:
+from piqa.instrumentation import metrics
+
+# Dtypes of the element fields we know how to flatten, nested fields are addressed with dots
+ELEMENT_SCHEMA: Dict[str, str] = {
+    "Text": "object",
+    "Page": "Int32",
+    "TextSize": "float32",
+    "Path": "category",
+    "Lang": "category",
+    "PercentileBounds.left": "float32",
+    "PercentileBounds.top": "float32",
+    "PercentileBounds.right": "float32",
+    "PercentileBounds.bottom": "float32",
+    "Font.name": "category",
+    "Font.family_name": "category",
+    "Font.weight": "float32",
+    "Font.italic": "boolean",
+}
+
+DEFAULT_COLUMNS = (
+    "Text",
+    "Page",
+    "TextSize",
+    "Path",
+    "PercentileBounds.left",
+    "PercentileBounds.top",
+    "PercentileBounds.right",
+    "PercentileBounds.bottom",
+)
+
+MIN_TEXT_LENGTH = 3
+
+
+def _get_field(element: Dict[str, Any], keys: List[str]) -> Any:
+    value: Any = element
+    for key in keys:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+
+    return value
+
+
+def _to_series(values: List[Any], dtype: str, index: pd.Index) -> pd.Series:
+    if dtype.startswith("float"):
+        values = [np.nan if value is None else value for value in values]
+
+    return pd.Series(values, dtype=dtype, index=index)
+
+
+@metrics.timed("flatten_elements")
+def flatten_and_preprocess_adobe_json(json_data: Dict[Any, Any], columns: Sequence[str] = DEFAULT_COLUMNS,
+                                      min_text_length: int = MIN_TEXT_LENGTH) -> pd.DataFrame:
     """
     Flatten the input JSON data and filter out the rows based on the 'Text' column.
 
+    Only the requested columns are built, and elements without enough text are skipped while parsing, so the other
+    nested fields of the elements are never materialized.
+
     Args:
         json_data (Dict[Any, Any]): The input JSON data.
+        columns (Sequence[str], optional): Fields to flatten, nested fields are joined with dots.
+            Defaults to DEFAULT_COLUMNS.
+        min_text_length (int, optional): Minimum length of the 'Text' of an element. Defaults to 3.
 
     Returns:
-        pd.DataFrame: The preprocessed dataframe after flattening and filtering.
+        pd.DataFrame: The preprocessed dataframe after flattening and filtering, indexed by element position.
     """
     try:
-        # Create DataFrame
-        df = pd.json_normalize(json_data, 'elements')
+        columns = list(dict.fromkeys(["Text", *columns]))
+        paths = [column.split(".") for column in columns]
+        values: Dict[str, List[Any]] = {column: [] for column in columns}
+        positions = []
+        has_text = False
 
-        # Filter rows based on Text column
-        df_filtered = df.dropna(subset=['Text'])
-        df_filtered = df_filtered[df_filtered['Text'].str.len() >= 3]
+        # Flatten the requested fields of the elements with enough text
+        for position, element in enumerate(json_data["elements"]):
+            has_text = has_text or "Text" in element
+            text = element.get("Text")
 
-        return df_filtered
+            if text is None or len(text) < min_text_length:
+                continue
+
+            positions.append(position)
+            for column, keys in zip(columns, paths):
+                values[column].append(_get_field(element, keys))
+
+        if not has_text:
+            raise KeyError("Text")
+
+        index = pd.Index(positions, dtype="int64")
+        return pd.DataFrame({
+            column: _to_series(values[column], ELEMENT_SCHEMA.get(column, "object"), index) for column in columns
+        }, index=index)
 
     except KeyError as e:
         raise KeyError(f"Key not found in the provided JSON data: {e}") from e
     except Exception as e:
         raise Exception(f"An error occurred while processing the JSON data: {e}") from e
+
+
+def save_elements(df: pd.DataFrame, path: str) -> None:
+    """
+    Save flattened elements to a columnar file, Parquet for '.parquet' paths and Arrow IPC otherwise.
+
+    Args:
+        df (pd.DataFrame): Flattened elements.
+        path (str): Destination path.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    if path.endswith(".parquet"):
+        df.to_parquet(path)
+    else:
+        df.rename_axis("element_index").reset_index().to_feather(path)
+
+
+def load_elements(path: str, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """
+    Load flattened elements saved with save_elements.
+
+    Args:
+        path (str): Path to the columnar file.
+        columns (Iterable[str], optional): Only load these columns. Defaults to None (all columns).
+
+    Returns:
+        pd.DataFrame: The flattened elements, indexed by element position.
+    """
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path, columns=list(columns) if columns is not None else None)
+
+    columns = ["element_index", *columns] if columns is not None else None
+    return pd.read_feather(path, columns=columns).set_index("element_index").rename_axis(None)
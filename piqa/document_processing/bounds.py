@@ -0,0 +1,103 @@
+from typing import Any, Dict, List, NamedTuple
+
+import numpy as np
+
+BOUND_KEYS = ("left", "top", "right", "bottom")
+
+
+class BoundsArrays(NamedTuple):
+    """Percentile bounds of a batch of elements, in the order the elements were collected.
+
+    Attributes:
+        elements (List[Dict[str, Any]]): The elements and kids that have 'Bounds'.
+        percentile_bounds (np.ndarray): (N, 4) array of left, top, right and bottom per element.
+        char_percentile_bounds (np.ndarray): (M, 4) array with the bounds of every character of every element.
+        char_offsets (np.ndarray): (N + 1,) array, the characters of element i are
+            ``char_percentile_bounds[char_offsets[i]:char_offsets[i + 1]]``.
+    """
+    elements: List[Dict[str, Any]]
+    percentile_bounds: np.ndarray
+    char_percentile_bounds: np.ndarray
+    char_offsets: np.ndarray
+
+
+def compute_percentile_bounds(bounds: np.ndarray, pages: np.ndarray, page_sizes: List[Dict[str, int]]) -> np.ndarray:
+    """Convert PDF bounds to fractions of the page size, with the origin moved to the top left corner.
+
+    Args:
+        bounds (np.ndarray): (N, 4) array of left, bottom, right and top in PDF points.
+        pages (np.ndarray): (N,) array with the zero based page index of every row.
+        page_sizes (List[Dict[str, int]]): Width and height of every page.
+
+    Returns:
+        np.ndarray: (N, 4) array of left, top, right and bottom as fractions of the page.
+    """
+    widths = np.array([page_size["width"] for page_size in page_sizes], dtype=np.float64)
+    heights = np.array([page_size["height"] for page_size in page_sizes], dtype=np.float64)
+
+    bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+    width = widths[pages]
+    height = heights[pages]
+
+    return np.column_stack([
+        bounds[:, 0] / width,
+        (height - bounds[:, 3]) / height,
+        bounds[:, 2] / width,
+        (height - bounds[:, 1]) / height,
+    ])
+
+
+def collect_bounded_elements(json_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Get every element and kid that has 'Bounds'.
+
+    Args:
+        json_data (Dict[str, Any]): Structured data with an 'elements' list.
+
+    Returns:
+        List[Dict[str, Any]]: The elements, each followed by its kids.
+    """
+    elements = []
+
+    for element in json_data["elements"]:
+        if element.get("Bounds"):
+            elements.append(element)
+
+        for kid in element.get("Kids") or []:
+            if kid.get("Bounds"):
+                elements.append(kid)
+
+    return elements
+
+
+def normalize_bounds(elements: List[Dict[str, Any]], page_sizes: List[Dict[str, int]]) -> BoundsArrays:
+    """Compute the percentile bounds of a batch of elements and all of their characters at once.
+
+    Args:
+        elements (List[Dict[str, Any]]): Elements with 'Bounds', 'Page' and optionally 'CharBounds'.
+        page_sizes (List[Dict[str, int]]): Width and height of every page.
+
+    Returns:
+        BoundsArrays: The elements together with their element and character level percentile bounds.
+    """
+    pages = np.fromiter((element["Page"] for element in elements), dtype=np.intp, count=len(elements))
+    bounds = np.array([element["Bounds"] for element in elements], dtype=np.float64).reshape(-1, 4)
+
+    char_counts = np.fromiter(
+        (len(element.get("CharBounds") or []) for element in elements), dtype=np.intp, count=len(elements)
+    )
+    char_offsets = np.concatenate([[0], np.cumsum(char_counts)])
+    char_bounds = np.array(
+        [char_bound for element in elements for char_bound in element.get("CharBounds") or []], dtype=np.float64
+    ).reshape(-1, 4)
+
+    return BoundsArrays(
+        elements=elements,
+        percentile_bounds=compute_percentile_bounds(bounds, pages, page_sizes),
+        char_percentile_bounds=compute_percentile_bounds(char_bounds, np.repeat(pages, char_counts), page_sizes),
+        char_offsets=char_offsets,
+    )
+
+
+def to_bounds_dict(row: np.ndarray) -> Dict[str, float]:
+    """Convert a row of percentile bounds to the {'left', 'top', 'right', 'bottom'} dictionary format."""
+    return dict(zip(BOUND_KEYS, row.tolist()))
@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pdfrw import PdfReader
+
+from piqa.cache import DiskCache
+from piqa.instrumentation import metrics
+from .bounds import BoundsArrays, collect_bounded_elements, normalize_bounds, to_bounds_dict
+from .extraction_backends import ExtractionBackend, ExtractionError, get_extraction_backend
+from .pdf_operations import select_pages, trim_pdf
+from piqa.config import (logging,
+                         ADOBE_OUTPUTS_PATH,
+                         PERSIST_EXTRACTION_OUTPUTS,
+                         EXTRACTION_CACHE_DIR,
+                         EXTRACTION_CACHE_MAX_BYTES,
+                         EXTRACTION_CACHE_MAX_AGE)
+
+# Describes the options passed to the extraction service, part of the cache key so changing them invalidates results
+EXTRACTION_OPTIONS = {
+    "elements": ["text", "tables"],
+    "renditions": ["tables", "figures"],
+}
+
+extraction_cache = DiskCache(EXTRACTION_CACHE_DIR, max_bytes=EXTRACTION_CACHE_MAX_BYTES,
+                             max_age=EXTRACTION_CACHE_MAX_AGE, name="extraction")
+
+
+def _write_percentile_bounds(bounds_arrays: BoundsArrays, compact: bool = True) -> None:
+    for index, element in enumerate(bounds_arrays.elements):
+        element["PercentileBounds"] = to_bounds_dict(bounds_arrays.percentile_bounds[index])
+
+        if element.get("CharBounds"):
+            char_bounds = bounds_arrays.char_percentile_bounds[
+                bounds_arrays.char_offsets[index]:bounds_arrays.char_offsets[index + 1]
+            ]
+            element["PercentileCharBounds"] = (
+                char_bounds.tolist() if compact else [to_bounds_dict(row) for row in char_bounds]
+            )
+
+
+def _update_bounds(element: Dict[str, Any], page_sizes: List[Dict[str, int]], dpi: int, compact: bool = True) -> None:
+    _write_percentile_bounds(normalize_bounds([element], page_sizes), compact)
+
+
+@metrics.timed("postprocess_elements")
+def _postprocess_elements(json_data: Dict[str, Any], page_sizes: List[Dict[str, int]], dpi: int = 72,
+                          compact: bool = True) -> Dict[str, Any]:
+    """Add percentile bounds to every element, kid and character.
+
+    Args:
+        json_data (Dict[str, Any]): Structured data with an 'elements' list.
+        page_sizes (List[Dict[str, int]]): Width and height of every page.
+        dpi (int, optional): Resolution of the bounds. Defaults to 72.
+        compact (bool, optional): Store character bounds as [left, top, right, bottom] lists instead of
+            dictionaries. Defaults to True.
+
+    Returns:
+        Dict[str, Any]: The structured data, updated in place.
+    """
+    _write_percentile_bounds(normalize_bounds(collect_bounded_elements(json_data), page_sizes), compact)
+
+    return json_data
+
+
+def _page_cache_key(page_pdf: bytes, backend_name: str = "adobe") -> str:
+    hasher = hashlib.sha256(page_pdf)
+    hasher.update(json.dumps({"backend": backend_name, "options": EXTRACTION_OPTIONS}, sort_keys=True).encode("utf-8"))
+
+    return hasher.hexdigest()
+
+
+def _split_elements_by_page(elements: List[Dict[str, Any]], page_count: int) -> List[List[Dict[str, Any]]]:
+    pages: List[List[Dict[str, Any]]] = [[] for _ in range(page_count)]
+
+    for element in elements:
+        page_index = element.get("Page", 0)
+        if 0 <= page_index < page_count:
+            pages[page_index].append(element)
+
+    return pages
+
+
+def _with_page(element: Dict[str, Any], page_index: int) -> Dict[str, Any]:
+    element = {**element, "Page": page_index}
+
+    if element.get("Kids"):
+        element["Kids"] = [{**kid, "Page": page_index} if "Page" in kid else kid for kid in element["Kids"]]
+
+    return element
+
+
+@metrics.timed("process_pdf")
+def process_pdf(input_file_path: str, max_number_pages: int = 1, tail: bool = False,
+                backend: Optional[ExtractionBackend] = None,
+                pages: Optional[Iterable[int]] = None) -> Optional[Dict[str, Any]]:
+    """Extract the elements of the selected pages of a PDF, only extracting pages that are not cached yet.
+
+    Extraction results of pages with elements are cached per page, keyed by a hash of the page's content. Elements of
+    cached and newly extracted pages are merged with 'Page' renumbered to the position of the page in the selection,
+    their 'PercentileBounds' are relative to their own page and stay valid.
+
+    Args:
+        input_file_path (str): Path to the PDF.
+        max_number_pages (int, optional): Maximum number of pages. Defaults to 1.
+        tail (bool, optional): Take the last pages instead of the first ones. Defaults to False.
+        backend (ExtractionBackend, optional): Backend to extract with. Defaults to the EXTRACTION_BACKEND setting.
+        pages (Iterable[int], optional): Explicit page indices, overrides max_number_pages and tail. Defaults to None.
+
+    Returns:
+        Optional[Dict[str, Any]]: Structured data with an 'elements' list, or None if nothing was extracted.
+    """
+    start_time = time.perf_counter()
+    backend = backend or get_extraction_backend()
+
+    root, _ = os.path.splitext(input_file_path)
+    file_name = os.path.basename(root)
+
+    # The PDF is parsed once, trimmed copies are kept in memory and handed straight to the backend
+    with metrics.span("preprocess_pdf", step="select"):
+        pdf_input = PdfReader(input_file_path)
+        page_indices = select_pages(len(pdf_input.pages), max_number_pages, tail, pages) # type: ignore
+        page_keys = [_page_cache_key(trim_pdf(pdf_input, [page_index])[0], backend.name)
+                     for page_index in page_indices]
+
+    metrics.count("bytes_read", os.path.getsize(input_file_path), source="pdf")
+    page_elements = extraction_cache.get_many(page_keys)
+
+    missing_pages = list({
+        page_keys[position]: page_index
+        for position, page_index in enumerate(page_indices) if page_elements[page_keys[position]] is None
+    }.items())
+
+    logging.debug(
+        f"[{round(time.perf_counter() - start_time, 2)}s] {len(page_indices) - len(missing_pages)} of "
+        f"{len(page_indices)} pages cached, extracting {len(missing_pages)} with the {backend.name} backend"
+    )
+
+    metrics.count("pages_cached", len(page_indices) - len(missing_pages), backend=backend.name)
+    metrics.count("pages_extracted", len(missing_pages), backend=backend.name)
+
+    if missing_pages:
+        with metrics.span("preprocess_pdf", step="trim"):
+            trimmed_pdf, page_sizes = trim_pdf(pdf_input, [page_index for _, page_index in missing_pages])
+
+        try:
+            op_zip_file_path = (
+                os.path.join(ADOBE_OUTPUTS_PATH, f"{file_name}-{missing_pages[0][0][:12]}-output.zip")
+                if PERSIST_EXTRACTION_OUTPUTS else None
+            )
+            with metrics.span("extract", backend=backend.name):
+                json_data = backend.extract(trimmed_pdf, op_zip_file_path)
+
+        except ExtractionError as err:
+            logging.error(f"[{round(time.perf_counter() - start_time, 2)}s] Exception encountered: {err}")
+            metrics.count("errors", stage="extraction", error=type(err.__cause__ or err).__name__)
+
+            return None
+
+        # Only pages with elements are cached, a page without any is extracted again next time instead of being
+        # cached as blank after a failed or empty extraction
+        if json_data is not None:
+            processed_json_data = _postprocess_elements(json_data, page_sizes)
+            extracted_pages = {
+                page_key: elements for (page_key, _), elements in zip(
+                    missing_pages, _split_elements_by_page(processed_json_data["elements"], len(missing_pages)))
+                if elements
+            }
+
+            if extracted_pages:
+                extraction_cache.set_many(extracted_pages)
+                page_elements.update(extracted_pages)
+
+            logging.debug(f"[{round(time.perf_counter() - start_time, 2)}s] Transformed JSON data and cached "
+                          f"{len(extracted_pages)} of {len(missing_pages)} pages")
+
+    elements = [
+        _with_page(element, position)
+        for position, page_key in enumerate(page_keys)
+        for element in page_elements[page_key] or []
+    ]
+
+    if not elements:
+        logging.warning(f"[{round(time.perf_counter() - start_time, 2)}s] No data extracted")
+        return None
+
+    logging.debug(f"[{round(time.perf_counter() - start_time, 2)}s] Finished")
+    logging.debug(
+        "--------------------------------------------------------------------------------------------------------------"
+    )
+
+    return {"elements": elements}
+
+
+def process_pdfs(input_file_paths: Iterable[str], max_number_pages: int = 1, tail: bool = False,
+                 max_workers: int = 4,
+                 backend: Optional[ExtractionBackend] = None,
+                 pages: Optional[Iterable[int]] = None) -> Iterator[Tuple[str, Optional[Dict[str, Any]]]]:
+    """Extract several PDFs concurrently, yielding each result as soon as it is finished.
+
+    Args:
+        input_file_paths (Iterable[str]): Paths to the input PDFs.
+        max_number_pages (int, optional): Maximum number of pages per PDF. Defaults to 1.
+        tail (bool, optional): Take the last pages instead of the first ones. Defaults to False.
+        max_workers (int, optional): Number of extractions running at the same time. Defaults to 4.
+        backend (ExtractionBackend, optional): Backend to extract with. Defaults to the EXTRACTION_BACKEND setting.
+        pages (Iterable[int], optional): Explicit page indices to extract from every PDF. Defaults to None.
+
+    Yields:
+        Tuple[str, Optional[Dict[str, Any]]]: The input path and its extracted data, in order of completion.
+    """
+    pages = list(pages) if pages is not None else None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(process_pdf, input_file_path, max_number_pages, tail, backend, pages): input_file_path
+            for input_file_path in input_file_paths
+        }
+
+        for future in as_completed(futures):
+            input_file_path = futures[future]
+
+            try:
+                yield input_file_path, future.result()
+            except Exception as err:
+                logging.error(f"Error processing {input_file_path}: {err}")
+                yield input_file_path, None
@@ -0,0 +1,98 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Optional, Union
+
+from pdfrw import PdfReader
+from pdfrw.errors import PdfParseError
+
+from piqa.config import EXTRACTION_BACKEND
+from piqa.utils import persist_in_background
+from .local_extraction import extract_text_elements
+
+# A path to a PDF or its content
+PdfSource = Union[str, bytes]
+
+
+class ExtractionError(Exception):
+    """Raised when an extraction backend fails to extract a PDF."""
+
+
+class ExtractionBackend(ABC):
+    """Turns a PDF into structured data following the Adobe PDF Extract schema.
+
+    The returned dictionary has an 'elements' list whose entries carry at least 'Text', 'Bounds', 'Page',
+    'Font' and 'TextSize'. 'PercentileBounds' are added afterwards by process_pdf.
+    """
+    name: str = ""
+
+    @abstractmethod
+    def extract(self, source: PdfSource, output_path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Extract the elements of a PDF.
+
+        Args:
+            source (PdfSource): Path to the PDF or its content.
+            output_path (str, optional): Where to persist the raw backend output, if anywhere. Defaults to None.
+
+        Returns:
+            Optional[Dict[str, Any]]: Structured data, or None if nothing was extracted.
+        """
+
+
+class LocalExtractionBackend(ExtractionBackend):
+    """Extracts the text layer of a PDF locally by interpreting its content streams.
+
+    Works offline and without quota for decks with a text layer, but does not extract tables or figures and has no
+    OCR for scanned pages.
+    """
+    name = "local"
+
+    def extract(self, source: PdfSource, output_path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        try:
+            pdf = PdfReader(fdata=source) if isinstance(source, bytes) else PdfReader(source)
+            json_data = extract_text_elements(pdf)
+        except (PdfParseError, ValueError) as err:
+            raise ExtractionError(f"Could not extract PDF: {err}") from err
+
+        if output_path:
+            persist_in_background({output_path.replace(".zip", ".json"): json.dumps(json_data).encode("utf-8")})
+
+        return json_data if json_data["elements"] else None
+
+
+def _adobe_extraction_backend() -> ExtractionBackend:
+    # The Adobe SDK is only imported once the Adobe backend is used
+    from .adobe_api import AdobeExtractionBackend
+    return AdobeExtractionBackend()
+
+
+_backends: Dict[str, Callable[[], ExtractionBackend]] = {
+    "adobe": _adobe_extraction_backend,
+    LocalExtractionBackend.name: LocalExtractionBackend,
+}
+
+
+def register_extraction_backend(name: str, factory: Callable[[], ExtractionBackend]) -> None:
+    """Make a backend available by name, e.g. through the EXTRACTION_BACKEND setting.
+
+    Args:
+        name (str): Name of the backend.
+        factory (Callable[[], ExtractionBackend]): Creates the backend.
+    """
+    _backends[name] = factory
+
+
+def get_extraction_backend(name: Optional[str] = None) -> ExtractionBackend:
+    """Create the extraction backend with the given name.
+
+    Args:
+        name (str, optional): Name of the backend. Defaults to the EXTRACTION_BACKEND setting.
+
+    Returns:
+        ExtractionBackend: The backend.
+    """
+    name = name or EXTRACTION_BACKEND
+
+    if name not in _backends:
+        raise ValueError(f"Unknown extraction backend '{name}', choose from: {', '.join(sorted(_backends))}")
+
+    return _backends[name]()
@@ -0,0 +1,199 @@
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from piqa.config import PARAGRAPH_DETECTION_SCALE
+from .pdf_operations import iter_pdf_images
+
+BOUND_COLUMNS = ["PercentileBounds.left", "PercentileBounds.top", "PercentileBounds.right", "PercentileBounds.bottom"]
+
+
+def rectangles_to_percentile_bounds(rectangles: Sequence[Tuple[int, int, int, int]], width: int,
+                                    height: int) -> np.ndarray:
+    """Convert (x, y, width, height) pixel rectangles of a page image to percentile bounds.
+
+    Args:
+        rectangles (Sequence[Tuple[int, int, int, int]]): Rectangles, e.g. from detect_paragraph_boxes.
+        width (int): Width of the page image in pixels.
+        height (int): Height of the page image in pixels.
+
+    Returns:
+        np.ndarray: (N, 4) array of left, top, right and bottom as fractions of the page.
+    """
+    rectangles = np.asarray(rectangles, dtype=np.float64).reshape(-1, 4)
+
+    return np.column_stack([
+        rectangles[:, 0] / width,
+        rectangles[:, 1] / height,
+        (rectangles[:, 0] + rectangles[:, 2]) / width,
+        (rectangles[:, 1] + rectangles[:, 3]) / height,
+    ])
+
+
+def detect_layout_blocks(path: str, page_indices: Sequence[int],
+                         scale: float = PARAGRAPH_DETECTION_SCALE) -> Dict[int, np.ndarray]:
+    """Detect the paragraph boxes of the pages of a PDF file, rendering and analyzing the pages in parallel.
+
+    Args:
+        path (str): The path to the PDF file.
+        page_indices (Sequence[int]): Zero based indices of the pages, as selected for extraction.
+        scale (float, optional): Factor the pages are resized by before detection. Defaults to the
+            PARAGRAPH_DETECTION_SCALE setting.
+
+    Returns:
+        Dict[int, np.ndarray]: The percentile bounds of the boxes, by position of the page in the selection like the
+            'Page' of the extracted elements.
+    """
+    # OpenCV is only needed here, so it is not imported with the package
+    from piqa.image_processing import detect_paragraphs_batch
+
+    sizes: List[Tuple[int, int]] = []
+
+    def page_images():
+        for _, image in iter_pdf_images(path, pages=page_indices, grayscale=True, as_array=True):
+            sizes.append((image.shape[1], image.shape[0]))
+            yield image
+
+    return {
+        position: rectangles_to_percentile_bounds(rectangles, *sizes[position])
+        for position, rectangles in enumerate(detect_paragraphs_batch(page_images(), scale))
+    }
+
+
+def assign_blocks(bounds: np.ndarray, pages: np.ndarray, block_bounds: np.ndarray,
+                  block_pages: np.ndarray) -> np.ndarray:
+    """Assign every element to the layout block on its page that contains the center of the element.
+
+    The test runs for all elements and blocks at once. An element in several nested blocks goes to the smallest one,
+    an element whose center is in no block goes to the block it overlaps most.
+
+    Args:
+        bounds (np.ndarray): (N, 4) percentile bounds of the elements.
+        pages (np.ndarray): (N,) page of every element.
+        block_bounds (np.ndarray): (M, 4) percentile bounds of the blocks.
+        block_pages (np.ndarray): (M,) page of every block.
+
+    Returns:
+        np.ndarray: (N,) index of the block of every element, -1 for elements that overlap no block.
+    """
+    if len(block_bounds) == 0:
+        return np.full(len(bounds), -1, dtype=np.intp)
+
+    left, top, right, bottom = (bounds[:, [column]] for column in range(4))
+    block_left, block_top, block_right, block_bottom = block_bounds.T
+    same_page = pages[:, None] == block_pages[None, :]
+
+    center_x, center_y = (left + right) / 2, (top + bottom) / 2
+    contains = (same_page & (block_left <= center_x) & (center_x <= block_right)
+                & (block_top <= center_y) & (center_y <= block_bottom))
+
+    block_areas = (block_right - block_left) * (block_bottom - block_top)
+    smallest = np.where(contains, block_areas, np.inf).argmin(axis=1)
+
+    overlap = (np.clip(np.minimum(right, block_right) - np.maximum(left, block_left), 0, None)
+               * np.clip(np.minimum(bottom, block_bottom) - np.maximum(top, block_top), 0, None))
+    overlap = np.where(same_page, overlap, 0)
+    largest_overlap = overlap.argmax(axis=1)
+
+    return np.where(contains.any(axis=1), smallest,
+                    np.where(overlap.max(axis=1) > 0, largest_overlap, -1)).astype(np.intp)
+
+
+def _split(starts: np.ndarray, ends: np.ndarray, indices: np.ndarray) -> List[np.ndarray]:
+    """Split boxes into groups separated by gaps along one axis, in order along that axis."""
+    order = indices[np.argsort(starts[indices], kind="stable")]
+    reach = np.maximum.accumulate(ends[order])
+    gaps = np.flatnonzero(reach[:-1] < starts[order][1:]) + 1
+
+    return np.split(order, gaps)
+
+
+def reading_order(bounds: np.ndarray) -> np.ndarray:
+    """Order the boxes of a page for reading, with a recursive XY-cut.
+
+    Boxes are split into rows at horizontal gaps and rows into columns at vertical gaps, so a column is read top to
+    bottom before the column to its right. Boxes that no gap separates are read by their top, then left edge.
+
+    Args:
+        bounds (np.ndarray): (N, 4) percentile bounds of the boxes.
+
+    Returns:
+        np.ndarray: Indices of the boxes in reading order.
+    """
+    left, top, right, bottom = bounds.T
+
+    def cut(indices: np.ndarray) -> List[int]:
+        if len(indices) <= 1:
+            return indices.tolist()
+
+        for starts, ends in ((top, bottom), (left, right)):
+            groups = _split(starts, ends, indices)
+            if len(groups) > 1:
+                return [index for group in groups for index in cut(group)]
+
+        return indices[np.lexsort((left[indices], top[indices]))].tolist()
+
+    return np.array(cut(np.arange(len(bounds))), dtype=np.intp)
+
+
+def merge_layout_blocks(df: pd.DataFrame, page_blocks: Dict[int, np.ndarray]) -> pd.DataFrame:
+    """Merge extracted elements into the layout blocks of their pages, in reading order.
+
+    Every block becomes one row with the text of its elements, ordered by their top, then left edge. Blocks are
+    ordered per page with reading_order, so the columns of a multi-column slide are no longer interleaved. Elements
+    outside every block, or without bounds, stay rows of their own.
+
+    Args:
+        df (pd.DataFrame): Flattened elements with 'Text', 'Page' and the 'PercentileBounds' columns.
+        page_blocks (Dict[int, np.ndarray]): (M, 4) percentile bounds of the blocks of every page, see
+            rectangles_to_percentile_bounds.
+
+    Returns:
+        pd.DataFrame: One row per block, with the columns of df. 'Text' and 'PercentileBounds' cover the whole
+            block, the other columns and the index are those of the first element of the block.
+    """
+    if df.empty:
+        return df
+
+    bounds = df[BOUND_COLUMNS].to_numpy(dtype=np.float64, na_value=np.nan)
+    pages = df["Page"].to_numpy(dtype=np.int64, na_value=-1)
+
+    block_pages = np.concatenate([np.full(len(blocks), page, dtype=np.int64) for page, blocks in page_blocks.items()]
+                                 or [np.empty(0, dtype=np.int64)])
+    block_bounds = np.concatenate([np.asarray(blocks, dtype=np.float64).reshape(-1, 4)
+                                   for blocks in page_blocks.values()] or [np.empty((0, 4))])
+
+    has_bounds = ~np.isnan(bounds).any(axis=1)
+    blocks = np.full(len(df), -1, dtype=np.intp)
+    blocks[has_bounds] = assign_blocks(bounds[has_bounds], pages[has_bounds], block_bounds, block_pages)
+
+    # Elements without a block get a block of their own, numbered after the detected blocks
+    unassigned = np.flatnonzero(blocks < 0)
+    blocks[unassigned] = len(block_bounds) + np.arange(len(unassigned))
+
+    elements = df.assign(_block=blocks, _position=np.arange(len(df)))
+    elements = elements.sort_values(["_block", "PercentileBounds.top", "PercentileBounds.left", "_position"],
+                                     kind="stable")
+    groups = elements.groupby("_block", sort=True)
+
+    # The first element of a block in reading order, usually its title, gives the other columns and the index
+    merged = elements.drop_duplicates("_block").copy()
+    merged["Text"] = groups["Text"].agg(" ".join).to_numpy()
+    merged[BOUND_COLUMNS] = np.column_stack([
+        groups["PercentileBounds.left"].min(), groups["PercentileBounds.top"].min(),
+        groups["PercentileBounds.right"].max(), groups["PercentileBounds.bottom"].max(),
+    ])
+    merged["_position"] = groups["_position"].min().to_numpy()
+
+    # Order the blocks of every page for reading, pages keep their order in the document
+    ordered = []
+    for _, page in merged.sort_values("_position").groupby("Page", sort=False, dropna=False):
+        page_bounds = page[BOUND_COLUMNS].to_numpy(dtype=np.float64, na_value=np.nan)
+
+        if np.isnan(page_bounds).any():
+            ordered.append(page)
+        else:
+            ordered.append(page.iloc[reading_order(page_bounds)])
+
+    return pd.concat(ordered)[list(df.columns)]
@@ -0,0 +1,449 @@
+import math
+import re
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from pdfrw import PdfReader
+from pdfrw.objects import PdfArray, PdfDict, PdfString
+from pdfrw.tokens import PdfTokens
+
+from piqa.config import logging
+
+Matrix = Tuple[float, float, float, float, float, float]
+
+IDENTITY: Matrix = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+MAX_FORM_DEPTH = 8
+
+ENCODINGS = {
+    "/WinAnsiEncoding": "cp1252",
+    "/MacRomanEncoding": "mac_roman",
+    "/StandardEncoding": "latin-1",
+}
+
+
+def _multiply(m1: Matrix, m2: Matrix) -> Matrix:
+    a1, b1, c1, d1, e1, f1 = m1
+    a2, b2, c2, d2, e2, f2 = m2
+    return (
+        a1 * a2 + b1 * c2,
+        a1 * b2 + b1 * d2,
+        c1 * a2 + d1 * c2,
+        c1 * b2 + d1 * d2,
+        e1 * a2 + f1 * c2 + e2,
+        e1 * b2 + f1 * d2 + f2,
+    )
+
+
+def _apply(matrix: Matrix, x: float, y: float) -> Tuple[float, float]:
+    a, b, c, d, e, f = matrix
+    return a * x + c * y + e, b * x + d * y + f
+
+
+def _translate(tx: float, ty: float) -> Matrix:
+    return (1.0, 0.0, 0.0, 1.0, tx, ty)
+
+
+def _decode_stream(obj: PdfDict) -> Optional[bytes]:
+    data = (obj.stream or "").encode("latin-1")
+    filters = obj.Filter
+
+    if filters is None:
+        return data
+
+    filters = filters if isinstance(filters, PdfArray) else [filters]
+    for stream_filter in filters:
+        if stream_filter not in ("/FlateDecode", "/Fl"):
+            logging.debug(f"Skipping stream with unsupported filter {stream_filter}")
+            return None
+        try:
+            data = zlib.decompress(data)
+        except zlib.error as e:
+            logging.warning(f"Skipping corrupt stream: {e}")
+            return None
+
+    return data
+
+
+def _parse_to_unicode(cmap: bytes) -> Dict[int, str]:
+    text = cmap.decode("latin-1")
+    mapping: Dict[int, str] = {}
+
+    def to_unicode(hex_string: str) -> str:
+        return bytes.fromhex(hex_string).decode("utf-16-be", errors="ignore")
+
+    for block in re.findall(r"beginbfchar(.*?)endbfchar", text, re.S):
+        for source, target in re.findall(r"<([0-9A-Fa-f]+)>\s*<([0-9A-Fa-f]*)>", block):
+            mapping[int(source, 16)] = to_unicode(target)
+
+    for block in re.findall(r"beginbfrange(.*?)endbfrange", text, re.S):
+        for start, end, target in re.findall(r"<([0-9A-Fa-f]+)>\s*<([0-9A-Fa-f]+)>\s*(<[0-9A-Fa-f]*>|\[[^\]]*\])",
+                                             block):
+            start_code, end_code = int(start, 16), int(end, 16)
+
+            if target.startswith("["):
+                for offset, item in enumerate(re.findall(r"<([0-9A-Fa-f]*)>", target)):
+                    mapping[start_code + offset] = to_unicode(item)
+                continue
+
+            # Increment the last character of the destination for every code in the range
+            base = to_unicode(target[1:-1])
+            for offset in range(end_code - start_code + 1):
+                mapping[start_code + offset] = base[:-1] + chr(ord(base[-1]) + offset) if base else ""
+
+    return mapping
+
+
+class _Font:
+    """Enough of a PDF font to decode shown strings and measure their width."""
+    def __init__(self, font: PdfDict):
+        self.subtype = font.Subtype or "/Type1"
+        self.base_font = str(font.BaseFont or "/Unknown")[1:]
+        self.two_byte = self.subtype == "/Type0"
+
+        self.to_unicode: Dict[int, str] = {}
+        if font.ToUnicode is not None:
+            cmap = _decode_stream(font.ToUnicode)
+            if cmap:
+                self.to_unicode = _parse_to_unicode(cmap)
+
+        encoding = font.Encoding
+        self.encoding = ENCODINGS.get(encoding if isinstance(encoding, str) else encoding and encoding.BaseEncoding,
+                                      "cp1252")
+
+        descriptor = font.FontDescriptor
+        if self.two_byte and font.DescendantFonts:
+            descendant = font.DescendantFonts[0]
+            descriptor = descendant.FontDescriptor
+            self.default_width = float(descendant.DW or 1000)
+            self.widths = self._parse_cid_widths(descendant.W or [])
+        else:
+            self.default_width = float(descriptor.MissingWidth or 500) if descriptor else 500.0
+            first_char = int(font.FirstChar or 0)
+            self.widths = {first_char + index: float(width) for index, width in enumerate(font.Widths or [])}
+
+        self.ascent = float(descriptor.Ascent or 800) / 1000 if descriptor else 0.8
+        self.descent = float(descriptor.Descent or -200) / 1000 if descriptor else -0.2
+        self.embedded = bool(descriptor and (descriptor.FontFile or descriptor.FontFile2 or descriptor.FontFile3))
+        self.italic = bool(descriptor and float(descriptor.ItalicAngle or 0)) or "Italic" in self.base_font
+        self.weight = int(float(descriptor.FontWeight)) if descriptor and descriptor.FontWeight else (
+            700 if "Bold" in self.base_font else 400
+        )
+
+    @staticmethod
+    def _parse_cid_widths(entries: List[Any]) -> Dict[int, float]:
+        widths: Dict[int, float] = {}
+        index = 0
+
+        while index < len(entries):
+            first = int(entries[index])
+            if isinstance(entries[index + 1], PdfArray) or isinstance(entries[index + 1], list):
+                for offset, width in enumerate(entries[index + 1]):
+                    widths[first + offset] = float(width)
+                index += 2
+            else:
+                last, width = int(entries[index + 1]), float(entries[index + 2])
+                for code in range(first, last + 1):
+                    widths[code] = width
+                index += 3
+
+        return widths
+
+    @property
+    def family_name(self) -> str:
+        name = self.base_font.split("+")[-1]
+        return re.split(r"[,-]", name)[0]
+
+    def decode(self, data: bytes) -> Iterator[Tuple[int, str, float]]:
+        """Yield the character code, its unicode text and its width in text space units per glyph."""
+        step = 2 if self.two_byte else 1
+
+        for index in range(0, len(data) - step + 1, step):
+            code = int.from_bytes(data[index:index + step], "big")
+
+            if code in self.to_unicode:
+                text = self.to_unicode[code]
+            elif self.two_byte:
+                text = ""
+            else:
+                text = bytes([code]).decode(self.encoding, errors="ignore")
+
+            yield code, text, self.widths.get(code, self.default_width) / 1000
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "name": self.base_font,
+            "family_name": self.family_name,
+            "font_type": self.subtype[1:],
+            "embedded": self.embedded,
+            "italic": self.italic,
+            "weight": self.weight,
+        }
+
+
+class _TextRun:
+    def __init__(self, text: str, bounds: List[float], font: _Font, size: float):
+        self.text = text
+        self.bounds = bounds
+        self.font = font
+        self.size = size
+
+
+class _ContentStreamInterpreter:
+    """Collects the text runs drawn by a page, following the text and graphics state operators."""
+    def __init__(self):
+        self.runs: List[_TextRun] = []
+        self._fonts: Dict[int, _Font] = {}
+
+    def _font(self, resources: Optional[PdfDict], name: str) -> Optional[_Font]:
+        font_dict = resources.Font[name] if resources is not None and resources.Font is not None else None
+        if font_dict is None:
+            return None
+
+        if id(font_dict) not in self._fonts:
+            self._fonts[id(font_dict)] = _Font(font_dict)
+
+        return self._fonts[id(font_dict)]
+
+    def run(self, content: bytes, resources: Optional[PdfDict], ctm: Matrix = IDENTITY, depth: int = 0) -> None:
+        graphics_stack: List[Matrix] = []
+        text_matrix = line_matrix = IDENTITY
+        font: Optional[_Font] = None
+        font_size = char_spacing = word_spacing = leading = rise = 0.0
+        horizontal_scaling = 1.0
+
+        operands: List[Any] = []
+        arrays: List[List[Any]] = []
+        skip_inline_image = False
+        dict_depth = 0
+
+        def show(parts: List[Any]) -> None:
+            nonlocal text_matrix
+            if font is None:
+                return
+
+            start_matrix = text_matrix
+            text = ""
+
+            for part in parts:
+                if not isinstance(part, PdfString):
+                    offset = -float(part) / 1000 * font_size * horizontal_scaling
+                    text_matrix = _multiply(_translate(offset, 0), text_matrix)
+                    if float(part) < -250 and text and not text.endswith(" "):
+                        text += " "
+                    continue
+
+                for code, glyph_text, width in font.decode(part.to_bytes()):
+                    spacing = char_spacing + (word_spacing if code == 32 and not font.two_byte else 0)
+                    advance = (width * font_size + spacing) * horizontal_scaling
+                    text_matrix = _multiply(_translate(advance, 0), text_matrix)
+                    text += glyph_text
+
+            if not text.strip():
+                return
+
+            start = _multiply(start_matrix, ctm)
+            end = _multiply(text_matrix, ctm)
+            points = [
+                _apply(matrix, 0, rise + font.descent * font_size) for matrix in (start, end)
+            ] + [
+                _apply(matrix, 0, rise + font.ascent * font_size) for matrix in (start, end)
+            ]
+            xs, ys = [point[0] for point in points], [point[1] for point in points]
+            size = font_size * math.hypot(start[2], start[3])
+
+            self.runs.append(_TextRun(text, [min(xs), min(ys), max(xs), max(ys)], font, size))
+
+        for token in PdfTokens(content.decode("latin-1")):
+            if skip_inline_image:
+                skip_inline_image = token != "EI"
+                continue
+
+            if dict_depth:
+                dict_depth += {"<<": 1, ">>": -1}.get(token, 0)
+                continue
+
+            if token == "<<":
+                dict_depth = 1
+                operands.append(None)
+                continue
+            if token == "[":
+                arrays.append([])
+                continue
+            if token == "]":
+                array = arrays.pop()
+                (arrays[-1] if arrays else operands).append(array)
+                continue
+
+            if isinstance(token, PdfString) or token.startswith("/") or re.match(r"^[+-]?(\d+\.?\d*|\.\d+)$", token):
+                (arrays[-1] if arrays else operands).append(token)
+                continue
+
+            operator = token
+            try:
+                if operator == "q":
+                    graphics_stack.append(ctm)
+                elif operator == "Q" and graphics_stack:
+                    ctm = graphics_stack.pop()
+                elif operator == "cm":
+                    ctm = _multiply(tuple(float(value) for value in operands[-6:]), ctm) # type: ignore
+                elif operator == "BT":
+                    text_matrix = line_matrix = IDENTITY
+                elif operator == "Tf":
+                    font = self._font(resources, operands[-2])
+                    font_size = float(operands[-1])
+                elif operator == "Tc":
+                    char_spacing = float(operands[-1])
+                elif operator == "Tw":
+                    word_spacing = float(operands[-1])
+                elif operator == "Tz":
+                    horizontal_scaling = float(operands[-1]) / 100
+                elif operator == "TL":
+                    leading = float(operands[-1])
+                elif operator == "Ts":
+                    rise = float(operands[-1])
+                elif operator in ("Td", "TD"):
+                    tx, ty = float(operands[-2]), float(operands[-1])
+                    if operator == "TD":
+                        leading = -ty
+                    text_matrix = line_matrix = _multiply(_translate(tx, ty), line_matrix)
+                elif operator == "Tm":
+                    text_matrix = line_matrix = tuple(float(value) for value in operands[-6:]) # type: ignore
+                elif operator == "T*":
+                    text_matrix = line_matrix = _multiply(_translate(0, -leading), line_matrix)
+                elif operator == "Tj":
+                    show([operands[-1]])
+                elif operator == "TJ":
+                    show(operands[-1])
+                elif operator in ("'", '"'):
+                    if operator == '"':
+                        word_spacing, char_spacing = float(operands[-3]), float(operands[-2])
+                    text_matrix = line_matrix = _multiply(_translate(0, -leading), line_matrix)
+                    show([operands[-1]])
+                elif operator == "Do":
+                    self._draw_xobject(resources, operands[-1], ctm, depth)
+                elif operator == "BI":
+                    skip_inline_image = True
+            except (IndexError, ValueError, TypeError, zlib.error) as err:
+                logging.debug(f"Skipping malformed {operator} operator: {err}")
+
+            operands = []
+
+    def _draw_xobject(self, resources: Optional[PdfDict], name: str, ctm: Matrix, depth: int) -> None:
+        xobjects = resources.XObject if resources is not None else None
+        xobject = xobjects[name] if xobjects is not None else None
+
+        if xobject is None or xobject.Subtype != "/Form" or depth >= MAX_FORM_DEPTH:
+            return
+
+        content = _decode_stream(xobject)
+        if content is None:
+            return
+
+        form_matrix = tuple(float(value) for value in xobject.Matrix) if xobject.Matrix else IDENTITY
+        self.run(content, xobject.Resources or resources, _multiply(form_matrix, ctm), depth + 1) # type: ignore
+
+
+def _page_content(page: PdfDict) -> bytes:
+    contents = page.Contents
+    if contents is None:
+        return b""
+
+    streams = contents if isinstance(contents, PdfArray) else [contents]
+    decoded = [_decode_stream(stream) for stream in streams]
+
+    return b"\n".join(content for content in decoded if content is not None)
+
+
+def _same_line(previous: _TextRun, run: _TextRun) -> bool:
+    tolerance = 0.5 * max(previous.size, run.size)
+    gap = run.bounds[0] - previous.bounds[2]
+
+    return abs(run.bounds[1] - previous.bounds[1]) < tolerance and -tolerance < gap < 1.5 * max(previous.size, run.size)
+
+
+def _same_paragraph(previous: _TextRun, line: _TextRun) -> bool:
+    if previous.font.base_font != line.font.base_font or abs(previous.size - line.size) > 0.1 * previous.size:
+        return False
+
+    vertical_gap = previous.bounds[1] - line.bounds[3]
+    overlaps = line.bounds[0] < previous.bounds[2] and previous.bounds[0] < line.bounds[2]
+
+    return overlaps and -0.5 * line.size < vertical_gap < 0.8 * line.size
+
+
+def _merge(runs: List[_TextRun], belongs: Any, separator: Any) -> List[_TextRun]:
+    merged: List[_TextRun] = []
+
+    for run in runs:
+        if merged and belongs(merged[-1], run):
+            previous = merged[-1]
+            join = separator(previous, run)
+            previous.text = f"{previous.text}{join}{run.text}"
+            previous.bounds = [
+                min(previous.bounds[0], run.bounds[0]),
+                min(previous.bounds[1], run.bounds[1]),
+                max(previous.bounds[2], run.bounds[2]),
+                max(previous.bounds[3], run.bounds[3]),
+            ]
+            previous.size = max(previous.size, run.size)
+        else:
+            merged.append(_TextRun(run.text, list(run.bounds), run.font, run.size))
+
+    return merged
+
+
+def _word_separator(previous: _TextRun, run: _TextRun) -> str:
+    if previous.text.endswith(" ") or run.text.startswith(" "):
+        return ""
+
+    return " " if run.bounds[0] - previous.bounds[2] > 0.15 * run.size else ""
+
+
+def extract_page_elements(page: PdfDict, page_index: int) -> List[Dict[str, Any]]:
+    """Extract the text elements of a single page in the Adobe structured data schema.
+
+    Runs shown on the same baseline are joined into lines, and consecutive lines with the same font that are
+    stacked closely on top of each other are joined into paragraphs.
+
+    Args:
+        page (PdfDict): The page as parsed by pdfrw.
+        page_index (int): Zero based index of the page, stored in the 'Page' field.
+
+    Returns:
+        List[Dict[str, Any]]: Elements with 'Bounds', 'Font', 'Page', 'Path', 'Text' and 'TextSize'.
+    """
+    interpreter = _ContentStreamInterpreter()
+    interpreter.run(_page_content(page), page.inheritable.Resources)
+
+    lines = _merge(interpreter.runs, _same_line, _word_separator)
+    paragraphs = _merge(lines, _same_paragraph, lambda previous, line: "" if previous.text.endswith(" ") else " ")
+
+    return [
+        {
+            "Bounds": paragraph.bounds,
+            "Font": paragraph.font.describe(),
+            "Page": page_index,
+            "Path": "//Document/P",
+            "Text": re.sub(r"\s+", " ", paragraph.text).strip(),
+            "TextSize": round(paragraph.size, 4),
+        }
+        for paragraph in paragraphs
+    ]
+
+
+def extract_text_elements(pdf: Any) -> Dict[str, Any]:
+    """Extract text elements from every page of a PDF without calling a remote service.
+
+    Args:
+        pdf (Any): A path to the PDF or a PdfReader.
+
+    Returns:
+        Dict[str, Any]: Structured data with an 'elements' list in the Adobe schema.
+    """
+    reader = pdf if isinstance(pdf, PdfReader) else PdfReader(pdf)
+    elements = []
+
+    for page_index, page in enumerate(reader.pages): # type: ignore
+        elements.extend(extract_page_elements(page, page_index))
+
+    return {"elements": elements}
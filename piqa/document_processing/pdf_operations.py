@@ -1,32 +1,174 @@
-from pdf2image import convert_from_path
-from typing import List
-from PIL import Image
+import io
+from pdfrw import PdfReader, PdfWriter
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import numpy as np
 import os
 
+from piqa.config import RASTER_DPI, RASTER_THREAD_COUNT, RASTER_IMAGES_PATH
+from piqa.instrumentation import metrics
 
-def convert_pdf_to_images(path: str) -> List[str]:
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+def select_pages(page_count: int, max_number_pages: Optional[int] = None, tail: bool = False,
+                 pages: Optional[Iterable[int]] = None) -> List[int]:
+    """
+    Resolve which pages of a document to process.
+
+    Args:
+        page_count (int): Number of pages in the document.
+        max_number_pages (int, optional): Take at most this many pages from the start, or from the end with tail.
+            Defaults to None (all pages).
+        tail (bool, optional): Take the last pages instead of the first ones. Defaults to False.
+        pages (Iterable[int], optional): Explicit zero based page indices or a range, negative indices count
+            from the end. Overrides max_number_pages and tail. Defaults to None.
+
+    Returns:
+        List[int]: Zero based indices of the selected pages, without duplicates.
+    """
+    if pages is None:
+        indices = list(range(page_count))
+        if max_number_pages is None:
+            return indices
+        return indices[-max_number_pages:] if tail else indices[:max_number_pages]
+
+    selected = []
+    for page in pages:
+        index = page + page_count if page < 0 else page
+        if not 0 <= index < page_count:
+            raise IndexError(f"Page {page} is out of range for a document with {page_count} pages")
+        selected.append(index)
+
+    return list(dict.fromkeys(selected))
+
+
+def get_page_sizes(pdf: PdfReader, page_indices: Iterable[int]) -> List[Dict[str, int]]:
+    """
+    Get the MediaBox size of pages, indexed by their position in the selection.
+
+    Args:
+        pdf (PdfReader): The parsed PDF.
+        page_indices (Iterable[int]): Indices of the pages.
+
+    Returns:
+        List[Dict[str, int]]: The 'page_index', 'width' and 'height' of every page.
+    """
+    page_sizes = []
+
+    for position, page_index in enumerate(page_indices):
+        left, bottom, right, top = (float(value) for value in pdf.pages[page_index].inheritable.MediaBox) # type: ignore
+        page_sizes.append({"page_index": position, "width": int(right - left), "height": int(top - bottom)})
+
+    return page_sizes
+
+
+def trim_pdf(pdf: PdfReader, page_indices: List[int]) -> Tuple[bytes, List[Dict[str, int]]]:
+    """
+    Write the selected pages of a parsed PDF to a new in-memory PDF.
+
+    Args:
+        pdf (PdfReader): The parsed PDF.
+        page_indices (List[int]): Indices of the pages to keep, in order.
+
+    Returns:
+        Tuple[bytes, List[Dict[str, int]]]: The new PDF and the sizes of its pages.
+    """
+    pdf_output_writer = PdfWriter()
+    for page_index in page_indices:
+        pdf_output_writer.addPage(pdf.pages[page_index]) # type: ignore
+
+    buffer = io.BytesIO()
+    pdf_output_writer.write(buffer)
+
+    return buffer.getvalue(), get_page_sizes(pdf, page_indices)
+
+
+def _render_batches(page_indices: List[int], batch_size: int) -> Iterator[List[int]]:
+    """Group page indices into runs of consecutive pages of at most batch_size pages, each rendered by one call."""
+    batch: List[int] = []
+
+    for page_index in page_indices:
+        if batch and (len(batch) == batch_size or page_index != batch[-1] + 1):
+            yield batch
+            batch = []
+        batch.append(page_index)
+
+    if batch:
+        yield batch
+
+
+def iter_pdf_images(path: str, dpi: int = RASTER_DPI, pages: Optional[Iterable[int]] = None,
+                    grayscale: bool = False, thread_count: int = RASTER_THREAD_COUNT,
+                    as_array: bool = False) -> Iterator[Tuple[int, Union["Image.Image", np.ndarray]]]:
+    """
+    Render the pages of a PDF file one batch at a time, without writing them to disk.
+
+    Batches are runs of at most thread_count consecutive pages, rendered in parallel, so only one batch of page
+    images is held in memory while the consumer processes them.
+
+    Args:
+        path (str): The path to the PDF file.
+        dpi (int, optional): Resolution of the images. Defaults to the RASTER_DPI setting.
+        pages (Iterable[int], optional): Zero based page indices or a range, negative indices count from the end.
+            Defaults to None (all pages).
+        grayscale (bool, optional): Render single channel images. Defaults to False.
+        thread_count (int, optional): Number of pages rendered at the same time. Defaults to the
+            RASTER_THREAD_COUNT setting.
+        as_array (bool, optional): Yield numpy arrays instead of PIL images. Defaults to False.
+
+    Yields:
+        Tuple[int, Union[Image.Image, np.ndarray]]: The zero based page index and the image of every page.
+    """
+    # pdf2image is only imported once pages are rendered, selecting and trimming pages does not need it
+    from pdf2image import convert_from_path
+
+    page_indices = select_pages(len(PdfReader(path).pages), pages=pages)
+    thread_count = max(thread_count, 1)
+
+    for batch in _render_batches(page_indices, thread_count):
+        with metrics.span("rasterize", dpi=dpi):
+            images = convert_from_path(path, dpi=dpi, first_page=batch[0] + 1, last_page=batch[-1] + 1,
+                                       thread_count=min(thread_count, len(batch)), grayscale=grayscale)
+        metrics.count("pages_rasterized", len(images))
+
+        for page_index, image in zip(batch, images):
+            yield page_index, np.asarray(image) if as_array else image
+
+        # Drop the references to the batch before the next one is rendered
+        del images
+
+
+def convert_pdf_to_images(path: str, output_dir: str = RASTER_IMAGES_PATH, dpi: int = RASTER_DPI,
+                          pages: Optional[Iterable[int]] = None, grayscale: bool = False,
+                          thread_count: int = RASTER_THREAD_COUNT) -> List[str]:
     """
     Converts each page of a PDF file into separate images and saves them.
 
-    The images are saved in the PNG format with names in the pattern 'output_{i}.png',
-    where '{i}' is the page number starting from 0.
+    The images are saved in the PNG format with names in the pattern '{filename}_{i}.png',
+    where '{i}' is the page number starting from 0. Pages are saved as they are rendered, see iter_pdf_images.
 
     Args:
         path (str): The path to the PDF file to be converted.
+        output_dir (str, optional): Folder the images are saved to. Defaults to the RASTER_IMAGES_PATH setting.
+        dpi (int, optional): Resolution of the images. Defaults to the RASTER_DPI setting.
+        pages (Iterable[int], optional): Zero based page indices or a range. Defaults to None (all pages).
+        grayscale (bool, optional): Save single channel images. Defaults to False.
+        thread_count (int, optional): Number of pages rendered at the same time. Defaults to the
+            RASTER_THREAD_COUNT setting.
 
     Returns:
-        int: The number of pages of the PDF
+        List[str]: The paths of the images, in page order.
     """
-    images = convert_from_path(path)
-
     filename_with_extension = os.path.basename(path)
     filename_without_extension = os.path.splitext(filename_with_extension)[0]
+    os.makedirs(output_dir, exist_ok=True)
 
     page_image_paths = []
-    for i, image in enumerate(images):
-        image_path = f'data/images/{filename_without_extension}_{i}.png'
+    for i, image in iter_pdf_images(path, dpi, pages, grayscale, thread_count):
+        image_path = os.path.join(output_dir, f'{filename_without_extension}_{i}.png')
 
-        image.save(image_path, 'PNG')
+        image.save(image_path, 'PNG') # type: ignore
         page_image_paths.append(image_path)
 
     return page_image_paths
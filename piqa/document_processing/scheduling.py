@@ -0,0 +1,138 @@
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from piqa.config import logging
+
+T = TypeVar("T")
+
+
+class ExtractionScheduler:
+    """Runs calls to a rate limited service with a request budget, a concurrency cap and retries.
+
+    Every attempt, including retries, waits for a free slot and for its turn in the requests per minute budget.
+    Retryable errors are retried with exponential backoff and full jitter, other errors are raised right away.
+
+    Args:
+        requests_per_minute (float, optional): Maximum number of attempts started per minute. Defaults to None
+            (unlimited).
+        max_concurrency (int, optional): Maximum number of attempts in flight at the same time. Defaults to 4.
+        max_retries (int, optional): Number of retries after the first attempt. Defaults to 5.
+        backoff_base (float, optional): Upper bound of the first backoff in seconds, doubled every retry.
+            Defaults to 1.
+        backoff_max (float, optional): Upper bound of any backoff in seconds. Defaults to 60.
+        is_retryable (Callable[[Exception], bool], optional): Decides whether an error is worth retrying.
+            Defaults to retrying nothing.
+        clock (Callable[[], float], optional): Monotonic clock. Defaults to time.monotonic.
+        sleep (Callable[[float], None], optional): Sleep function. Defaults to time.sleep.
+    """
+    def __init__(self, requests_per_minute: Optional[float] = None, max_concurrency: int = 4, max_retries: int = 5,
+                 backoff_base: float = 1.0, backoff_max: float = 60.0,
+                 is_retryable: Optional[Callable[[Exception], bool]] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.requests_per_minute = requests_per_minute
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.is_retryable = is_retryable or (lambda err: False)
+        self._clock = clock
+        self._sleep = sleep
+
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+        self.attempts = 0
+        self.retries = 0
+        self.successes = 0
+        self.failures = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.backoff_total = 0.0
+
+    def _wait_for_turn(self) -> None:
+        if not self.requests_per_minute:
+            return
+
+        # Attempts are spread evenly over the minute by reserving the next free start time
+        with self._lock:
+            now = self._clock()
+            start = max(now, self._next_start)
+            self._next_start = start + 60.0 / self.requests_per_minute
+
+        if start > now:
+            self._sleep(start - now)
+
+    def _backoff(self, retry: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** retry))
+
+    def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Call a function within the budget, retrying it on retryable errors.
+
+        Args:
+            func (Callable[..., T]): Function calling the service.
+            *args (Any): Positional arguments of the function.
+            **kwargs (Any): Keyword arguments of the function.
+
+        Returns:
+            T: The result of the first successful attempt.
+        """
+        retry = 0
+
+        while True:
+            queued_at = self._clock()
+
+            with self._slots:
+                self._wait_for_turn()
+                self._record_attempt(self._clock() - queued_at)
+
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as err:
+                    if retry == self.max_retries or not self.is_retryable(err):
+                        with self._lock:
+                            self.failures += 1
+                        raise
+
+                    error = err
+                else:
+                    with self._lock:
+                        self.successes += 1
+                    return result
+
+            # Back off without holding a slot so other calls can proceed in the meantime
+            backoff = self._backoff(retry)
+            logging.warning(f"Retrying in {round(backoff, 2)}s ({retry + 1}/{self.max_retries}) after: {error}")
+
+            with self._lock:
+                self.retries += 1
+                self.backoff_total += backoff
+            self._sleep(backoff)
+            retry += 1
+
+    def _record_attempt(self, queue_wait: float) -> None:
+        with self._lock:
+            self.attempts += 1
+            self.queue_wait_total += queue_wait
+            self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+
+    def stats(self) -> Dict[str, float]:
+        """Get the attempt, retry and queue wait counters.
+
+        Returns:
+            Dict[str, float]: Number of attempts, retries, successes and failures, and the total, mean and maximum
+                time attempts waited for a slot and their turn, and the total time spent backing off, in seconds.
+        """
+        with self._lock:
+            return {
+                "attempts": self.attempts,
+                "retries": self.retries,
+                "successes": self.successes,
+                "failures": self.failures,
+                "queue_wait_total": self.queue_wait_total,
+                "queue_wait_mean": self.queue_wait_total / self.attempts if self.attempts else 0.0,
+                "queue_wait_max": self.queue_wait_max,
+                "backoff_total": self.backoff_total,
+            }
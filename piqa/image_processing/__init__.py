@@ -1 +1,10 @@
-from .image_operations import detect_paragraphs
+from piqa.utils import lazy_exports
+
+_EXPORTS = {
+    "detect_paragraphs": ".image_operations",
+    "detect_paragraph_boxes": ".image_operations",
+    "detect_paragraphs_batch": ".image_operations",
+}
+
+__all__ = list(_EXPORTS)
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS)
@@ -0,0 +1,246 @@
+import contextvars
+import functools
+import http.server
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, TypeVar
+
+from piqa.config import logging, INSTRUMENTATION_ENABLED, INSTRUMENTATION_JSON_LOGS
+
+try:
+    import resource
+except ImportError: # pragma: no cover - not available on Windows
+    resource = None # type: ignore
+
+F = TypeVar("F", bound=Callable[..., Any])
+Labels = Tuple[Tuple[str, str], ...]
+
+# Upper bounds of the duration buckets of the spans, in seconds
+SPAN_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+event_logger = logging.getLogger("piqa.instrumentation")
+
+_current_span: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("piqa_current_span", default=None)
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def peak_memory_bytes() -> Optional[int]:
+    """Get the peak resident memory of the process, None where it cannot be measured."""
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class Metrics:
+    """Thread-safe registry of span durations and counters of the process.
+
+    Args:
+        enabled (bool, optional): When False nothing is recorded. Defaults to True.
+        json_logs (bool, optional): Log every finished span as a JSON event. Defaults to False.
+    """
+    def __init__(self, enabled: bool = True, json_logs: bool = False):
+        self.enabled = enabled
+        self.json_logs = json_logs
+
+        self._lock = threading.Lock()
+        self._spans: Dict[Tuple[str, Labels], Dict[str, Any]] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+
+    def observe(self, name: str, seconds: float, error: Optional[BaseException] = None, **labels: Any) -> None:
+        """Record a finished span.
+
+        Args:
+            name (str): Name of the span.
+            seconds (float): Duration of the span.
+            error (BaseException, optional): Exception the span raised. Defaults to None.
+            **labels: Labels of the span, e.g. the backend.
+        """
+        if not self.enabled:
+            return
+
+        key = (name, _labels(labels))
+        with self._lock:
+            span = self._spans.setdefault(key, {"count": 0, "sum": 0.0, "max": 0.0, "errors": 0,
+                                                "buckets": [0] * len(SPAN_BUCKETS)})
+            span["count"] += 1
+            span["sum"] += seconds
+            span["max"] = max(span["max"], seconds)
+            span["errors"] += error is not None
+            span["buckets"][next(i for i, bound in enumerate(SPAN_BUCKETS) if seconds <= bound)] += 1
+
+        if self.json_logs:
+            event = {"event": "span", "span": name, "parent": _current_span.get(), "seconds": round(seconds, 6),
+                     **labels}
+            if error is not None:
+                event["error"] = f"{type(error).__name__}: {error}"
+            event_logger.info(json.dumps(event, default=str))
+
+    def count(self, name: str, value: float = 1, **labels: Any) -> None:
+        """Add to a counter, e.g. 'cache_hits', 'bytes_read' or 'prompt_tokens'.
+
+        Args:
+            name (str): Name of the counter.
+            value (float, optional): Amount to add. Defaults to 1.
+            **labels: Labels of the counter, e.g. the cache.
+        """
+        if not self.enabled:
+            return
+
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    @contextmanager
+    def span(self, name: str, **labels: Any) -> Iterator[None]:
+        """Time a block of code, recording its duration and whether it raised.
+
+        Args:
+            name (str): Name of the span.
+            **labels: Labels of the span.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        token = _current_span.set(name)
+        started_at = time.perf_counter()
+        error: Optional[BaseException] = None
+
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_span.reset(token)
+            self.observe(name, time.perf_counter() - started_at, error, **labels)
+
+    def timed(self, name: str, **labels: Any) -> Callable[[F], F]:
+        """Decorate a function to run in a span, see span."""
+        def decorator(func: F) -> F:
+            @functools.wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with self.span(name, **labels):
+                    return func(*args, **kwargs)
+
+            return wrapper # type: ignore
+
+        return decorator
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get every span and counter, and the peak memory of the process, as JSON serializable data.
+
+        Returns:
+            Dict[str, Any]: 'spans' and 'counters' as lists of records with their labels, and 'peak_memory_bytes'.
+        """
+        with self._lock:
+            spans = [{"name": name, "labels": dict(labels), "count": span["count"], "sum": span["sum"],
+                      "max": span["max"], "mean": span["sum"] / span["count"], "errors": span["errors"]}
+                     for (name, labels), span in sorted(self._spans.items())]
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self._counters.items())]
+
+        return {"spans": spans, "counters": counters, "peak_memory_bytes": peak_memory_bytes()}
+
+    def to_json(self) -> str:
+        """Export the snapshot as a JSON document."""
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self) -> str:
+        """Export the spans as histograms and the counters in the Prometheus text format.
+
+        Returns:
+            str: The metrics, one sample per line.
+        """
+        def format_labels(labels: Labels, **extra: str) -> str:
+            pairs = [*labels, *extra.items()]
+            return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}" if pairs else ""
+
+        lines = ["# TYPE piqa_span_seconds histogram"]
+        with self._lock:
+            spans = [(key, {**span, "buckets": list(span["buckets"])}) for key, span in sorted(self._spans.items())]
+            counters = sorted(self._counters.items())
+
+        for (name, labels), span in spans:
+            span_labels = (("span", name), *labels)
+            cumulative = 0
+            for bound, bucket in zip(SPAN_BUCKETS, span["buckets"]):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"piqa_span_seconds_bucket{format_labels(span_labels, le=le)} {cumulative}")
+            lines.append(f"piqa_span_seconds_sum{format_labels(span_labels)} {span['sum']}")
+            lines.append(f"piqa_span_seconds_count{format_labels(span_labels)} {span['count']}")
+
+        lines.append("# TYPE piqa_span_errors_total counter")
+        for (name, labels), span in spans:
+            lines.append(f"piqa_span_errors_total{format_labels((('span', name), *labels))} {span['errors']}")
+
+        for name in dict.fromkeys(name for (name, _), _ in counters):
+            lines.append(f"# TYPE piqa_{name}_total counter")
+            lines.extend(f"piqa_{name}_total{format_labels(labels)} {value}"
+                         for (counter_name, labels), value in counters if counter_name == name)
+
+        peak_memory = peak_memory_bytes()
+        if peak_memory is not None:
+            lines.append("# TYPE piqa_peak_memory_bytes gauge")
+            lines.append(f"piqa_peak_memory_bytes {peak_memory}")
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """Forget every span and counter."""
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+
+
+# Shared by the whole process, configured by the INSTRUMENTATION_* settings
+metrics = Metrics(INSTRUMENTATION_ENABLED, INSTRUMENTATION_JSON_LOGS)
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1",
+                         registry: Optional[Metrics] = None) -> http.server.ThreadingHTTPServer:
+    """Serve the metrics on a background thread, in the Prometheus format at /metrics and as JSON at /metrics.json.
+
+    Args:
+        port (int): Port to listen on, 0 for any free port.
+        host (str, optional): Address to listen on. Defaults to localhost.
+        registry (Metrics, optional): Metrics to serve. Defaults to the shared metrics.
+
+    Returns:
+        http.server.ThreadingHTTPServer: The running server, stop it with shutdown().
+    """
+    registry = registry or metrics
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self) -> None: # pylint: disable=invalid-name
+            if self.path == "/metrics":
+                body, content_type = registry.to_prometheus(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = registry.to_json(), "application/json"
+            else:
+                self.send_error(404)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.end_headers()
+            self.wfile.write(body.encode("utf-8"))
+
+        def log_message(self, format: str, *args: Any) -> None: # pylint: disable=redefined-builtin
+            logging.debug(format % args)
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+
+    return server
@@ -1 +1,22 @@
-from .langchain_conversation import get_chat_completion
+from piqa.utils import lazy_exports
+
+_EXPORTS = {
+    "get_chat_completion": ".langchain_conversation",
+    "get_chat_model": ".langchain_conversation",
+    "AsyncCompletionEngine": ".async_engine",
+    "agenerate_chat_completion": ".async_engine",
+    "get_completion_engine": ".async_engine",
+    "astream_chat_completion": ".async_engine",
+    "stream_chat_completion": ".streaming",
+    "CompletionInterrupted": ".streaming",
+    "split_sections": ".streaming",
+    "tee_to_file": ".streaming",
+    "atee_to_file": ".streaming",
+    "PitchDeckMetrics": ".structured",
+    "get_structured_completion": ".structured",
+    "failed_sections": ".structured",
+    "agenerate_structured_completion": ".structured",
+}
+
+__all__ = list(_EXPORTS)
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS)
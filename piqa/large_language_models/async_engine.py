@@ -0,0 +1,386 @@
+import asyncio
+import functools
+import threading
+import time
+import weakref
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, List, Optional
+
+import pandas as pd
+
+from piqa.config import (logging,
+                         LLM_MAX_CONCURRENCY,
+                         LLM_MAX_PROMPT_TOKENS,
+                         LLM_RELEVANCE_FILTER,
+                         LLM_REQUESTS_PER_MINUTE,
+                         LLM_TOKENS_PER_MINUTE,
+                         LLM_TIMEOUT)
+from piqa.instrumentation import metrics
+from .chunking import get_token_counter
+from .langchain_conversation import (completion_cache,
+                                     get_chat_model,
+                                     _completion_cache_key,
+                                     record_usage,
+                                     _plan_messages,
+                                     OPENAI_MODEL)
+from .streaming import CompletionInterrupted, asplit_sections, streaming_chat_model, token_handler
+
+if TYPE_CHECKING:
+    from langchain.chat_models.base import BaseChatModel
+    from langchain.schema import BaseMessage
+
+
+class AsyncRateLimiter:
+    """Token bucket refilling a budget per minute, for use within a single event loop.
+
+    Args:
+        per_minute (float): Budget per minute, also the largest burst.
+        clock (Callable[[], float], optional): Monotonic clock. Defaults to time.monotonic.
+    """
+    def __init__(self, per_minute: float, clock: Callable[[], float] = time.monotonic):
+        self.per_minute = per_minute
+        self._clock = clock
+        self._available = per_minute
+        self._updated_at = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._available = min(self.per_minute, self._available + (now - self._updated_at) * self.per_minute / 60.0)
+        self._updated_at = now
+
+    async def acquire(self, amount: float = 1) -> float:
+        """Wait until the amount is available and take it from the budget.
+
+        Args:
+            amount (float, optional): Amount to take, capped at the budget per minute. Defaults to 1.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        amount = min(amount, self.per_minute)
+        started_at = self._clock()
+
+        self._refill()
+        while self._available < amount:
+            await asyncio.sleep((amount - self._available) * 60.0 / self.per_minute)
+            self._refill()
+
+        self._available -= amount
+        return self._clock() - started_at
+
+
+def _observe_request(request: "asyncio.Future[Any]", started_at: float) -> None:
+    error = asyncio.CancelledError() if request.cancelled() else request.exception()
+    metrics.observe("chat_completion", time.perf_counter() - started_at, error, model=OPENAI_MODEL)
+
+
+class AsyncCompletionEngine:
+    """Requests completions concurrently within request and token rate limits.
+
+    Completions are looked up in and stored to the completion cache. The concurrency and rate limits apply to all
+    requests of the engine, including those of different decks, so sharing an engine shares its limits.
+
+    An engine is used by one event loop at a time, see get_completion_engine for the engine of every event loop. It
+    can be used again from a new event loop once the previous one stopped running.
+
+    Args:
+        chat_model (BaseChatModel, optional): Chat model to request completions from. Defaults to the chat model of
+            the package.
+        max_concurrency (int, optional): Maximum number of requests in flight. Defaults to the LLM_MAX_CONCURRENCY
+            setting.
+        requests_per_minute (float, optional): Maximum number of requests per minute, 0 for unlimited. Defaults to the
+            LLM_REQUESTS_PER_MINUTE setting.
+        tokens_per_minute (float, optional): Maximum number of prompt tokens per minute, 0 for unlimited. Defaults to
+            the LLM_TOKENS_PER_MINUTE setting.
+        timeout (float, optional): Seconds after which a request is cancelled, 0 for no timeout. Defaults to the
+            LLM_TIMEOUT setting.
+        count_tokens (Callable[[str], int], optional): Counts the tokens of a text. Defaults to the token counter of
+            the model.
+
+    Attributes:
+        requests (int): Number of requests sent to the chat model.
+        cache_hits (int): Number of completions served from the completion cache.
+        timeouts (int): Number of requests that timed out.
+    """
+    def __init__(self, chat_model: Optional["BaseChatModel"] = None, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = LLM_TOKENS_PER_MINUTE, timeout: float = LLM_TIMEOUT,
+                 count_tokens: Optional[Callable[[str], int]] = None):
+        self._chat_model = chat_model
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.timeout = timeout
+        self.count_tokens = count_tokens or get_token_counter(getattr(chat_model, "model_name", OPENAI_MODEL))
+
+        self.requests = 0
+        self.cache_hits = 0
+        self.timeouts = 0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+
+    @property
+    def chat_model(self) -> "BaseChatModel":
+        return self._chat_model or get_chat_model()
+
+    def _bind_to_running_loop(self) -> None:
+        # asyncio primitives belong to one event loop, they are recreated when the engine is used from a new one
+        loop = asyncio.get_running_loop()
+
+        with self._loop_lock:
+            if loop is self._loop:
+                return
+
+            if self._loop is not None and self._loop.is_running():
+                raise RuntimeError("The completion engine is used by another running event loop, use one engine per "
+                                   "event loop, see get_completion_engine")
+
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._request_limiter = AsyncRateLimiter(self.requests_per_minute) if self.requests_per_minute else None
+            self._token_limiter = AsyncRateLimiter(self.tokens_per_minute) if self.tokens_per_minute else None
+
+    async def complete(self, messages: List["BaseMessage"], use_cache: bool = True) -> str:
+        """Get the completion of a prompt, from the completion cache if it was requested before.
+
+        Args:
+            messages (List[BaseMessage]): Formatted chat prompts.
+            use_cache (bool, optional): Look up and store the completion in the cache. Defaults to True.
+
+        Returns:
+            str: Completion generated by the chat model.
+        """
+        self._bind_to_running_loop()
+        key = _completion_cache_key(self.chat_model._identifying_params, messages) # pylint: disable=protected-access
+
+        if use_cache:
+            cached = completion_cache.get(key)
+            if cached is not None:
+                self.cache_hits += 1
+                return cached["content"]
+
+        async with self._semaphore:
+            await self._acquire_budget(messages)
+            self.requests += 1
+
+            try:
+                with metrics.span("chat_completion", model=OPENAI_MODEL):
+                    response = await asyncio.wait_for(self.chat_model.apredict_messages(messages),
+                                                      self.timeout or None)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                metrics.count("errors", stage="completion", error="TimeoutError")
+                logging.warning(f"Completion request timed out after {self.timeout}s")
+                raise
+
+        record_usage(messages, response.content, self.count_tokens)
+
+        if use_cache:
+            completion_cache.set(key, {"content": response.content})
+
+        return response.content
+
+    async def _acquire_budget(self, messages: List["BaseMessage"]) -> None:
+        if self._request_limiter:
+            await self._request_limiter.acquire()
+        if self._token_limiter:
+            await self._token_limiter.acquire(sum(self.count_tokens(message.content) for message in messages))
+
+    async def stream(self, messages: List["BaseMessage"], use_cache: bool = True) -> AsyncIterator[str]:
+        """Stream the completion of a prompt, or the whole completion at once if it is cached.
+
+        The timeout applies to the whole completion, not to every token.
+
+        Args:
+            messages (List[BaseMessage]): Formatted chat prompts.
+            use_cache (bool, optional): Look up and store the completion in the cache. Defaults to True.
+
+        Yields:
+            str: Tokens of the completion.
+        """
+        self._bind_to_running_loop()
+        key = _completion_cache_key(self.chat_model._identifying_params, messages) # pylint: disable=protected-access
+
+        if use_cache:
+            cached = completion_cache.get(key)
+            if cached is not None:
+                self.cache_hits += 1
+                yield cached["content"]
+                return
+
+        async with self._semaphore:
+            await self._acquire_budget(messages)
+            self.requests += 1
+
+            loop = asyncio.get_running_loop()
+            tokens: "asyncio.Queue[str]" = asyncio.Queue()
+            # Synchronous callback handlers may be called from an executor thread
+            handler = token_handler(lambda token: loop.call_soon_threadsafe(tokens.put_nowait, token))
+            request = asyncio.ensure_future(
+                streaming_chat_model(self.chat_model).apredict_messages(messages, callbacks=[handler])
+            )
+            # Timed until the request is done, not until the caller consumed every token
+            request.add_done_callback(functools.partial(_observe_request, started_at=time.perf_counter()))
+            deadline = loop.time() + self.timeout if self.timeout else None
+            streamed = False
+
+            try:
+                while True:
+                    next_token = asyncio.ensure_future(tokens.get())
+                    done, _ = await asyncio.wait({next_token, request}, return_when=asyncio.FIRST_COMPLETED,
+                                                 timeout=deadline - loop.time() if deadline else None)
+
+                    if next_token in done:
+                        streamed = True
+                        yield next_token.result()
+                        continue
+
+                    next_token.cancel()
+                    if request in done:
+                        break
+
+                    self.timeouts += 1
+                    metrics.count("errors", stage="completion", error="TimeoutError")
+                    logging.warning(f"Completion request timed out after {self.timeout}s")
+                    raise asyncio.TimeoutError()
+            finally:
+                request.cancel()
+
+            while not tokens.empty():
+                streamed = True
+                yield tokens.get_nowait()
+
+            content = request.result().content
+            record_usage(messages, content, self.count_tokens)
+
+        if not streamed:
+            yield content
+
+        if use_cache:
+            completion_cache.set(key, {"content": content})
+
+    def stats(self) -> Dict[str, int]:
+        """Get the request, cache hit and timeout counters.
+
+        Returns:
+            Dict[str, int]: Number of requests, cache hits and timeouts.
+        """
+        return {"requests": self.requests, "cache_hits": self.cache_hits, "timeouts": self.timeouts}
+
+
+_completion_engines: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncCompletionEngine]" = (
+    weakref.WeakKeyDictionary()
+)
+_completion_engines_lock = threading.Lock()
+
+
+def get_completion_engine() -> AsyncCompletionEngine:
+    """Get the completion engine shared by every caller in the running event loop.
+
+    Event loops in different threads get different engines, so they never share asyncio primitives.
+
+    Returns:
+        AsyncCompletionEngine: The engine of the running event loop.
+
+    Raises:
+        RuntimeError: If no event loop is running.
+    """
+    loop = asyncio.get_running_loop()
+
+    with _completion_engines_lock:
+        if loop not in _completion_engines:
+            _completion_engines[loop] = AsyncCompletionEngine()
+
+        return _completion_engines[loop]
+
+
+async def _aprepare_messages(df: pd.DataFrame, engine: AsyncCompletionEngine, use_cache: bool,
+                             max_prompt_tokens: int, filter_relevance: bool) -> List["BaseMessage"]:
+    """Build the final prompt of a deck, summarizing the chunks of every round concurrently, see _plan_messages."""
+    plan = _plan_messages(df, max_prompt_tokens, engine.count_tokens, filter_relevance)
+
+    try:
+        prompts = next(plan)
+        while True:
+            notes = await asyncio.gather(*[engine.complete(messages, use_cache) for messages in prompts])
+            prompts = plan.send(list(notes))
+    except StopIteration as stop:
+        return stop.value
+
+
+async def agenerate_chat_completion(df: pd.DataFrame, engine: Optional[AsyncCompletionEngine] = None,
+                                    use_cache: bool = True,
+                                    max_prompt_tokens: int = LLM_MAX_PROMPT_TOKENS,
+                                    filter_relevance: bool = LLM_RELEVANCE_FILTER) -> str:
+    """Generate completion for the chat model without blocking the event loop.
+
+    Works like get_chat_completion, with the chunks of long decks summarized concurrently by the engine.
+
+    Args:
+        df (pd.DataFrame): Dataframe containing text.
+        engine (AsyncCompletionEngine, optional): Engine to request completions with. Defaults to the shared engine.
+        use_cache (bool, optional): Reuse the completion of an identical earlier request and cache new ones.
+            Defaults to True.
+        max_prompt_tokens (int, optional): Maximum number of tokens of a prompt. Defaults to the
+            LLM_MAX_PROMPT_TOKENS setting.
+        filter_relevance (bool, optional): Drop duplicate and the least relevant elements. Defaults to the
+            LLM_RELEVANCE_FILTER setting.
+
+    Returns:
+        str: Completion generated by the chat model.
+    """
+    engine = engine or get_completion_engine()
+
+    try:
+        logging.info("Generating completion...")
+        formatted_prompt = await _aprepare_messages(df, engine, use_cache, max_prompt_tokens, filter_relevance)
+        return await engine.complete(formatted_prompt, use_cache)
+
+    except Exception as e:
+        logging.error(f"Error generating chat completion: {e}")
+        metrics.count("errors", stage="completion", error=type(e).__name__)
+        return "Error generating chat completion"
+
+
+async def astream_chat_completion(df: pd.DataFrame, engine: Optional[AsyncCompletionEngine] = None,
+                                  use_cache: bool = True, by_section: bool = False,
+                                  max_prompt_tokens: int = LLM_MAX_PROMPT_TOKENS,
+                                  filter_relevance: bool = LLM_RELEVANCE_FILTER) -> AsyncIterator[str]:
+    """Generate completion for the chat model, yielding it while it is generated without blocking the event loop.
+
+    Args:
+        df (pd.DataFrame): Dataframe containing text.
+        engine (AsyncCompletionEngine, optional): Engine to request completions with. Defaults to the shared engine.
+        use_cache (bool, optional): Reuse the completion of an identical earlier request and cache new ones.
+            Defaults to True.
+        by_section (bool, optional): Yield whole markdown sections instead of tokens. Defaults to False.
+        max_prompt_tokens (int, optional): Maximum number of tokens of a prompt. Defaults to the
+            LLM_MAX_PROMPT_TOKENS setting.
+        filter_relevance (bool, optional): Drop duplicate and the least relevant elements. Defaults to the
+            LLM_RELEVANCE_FILTER setting.
+
+    Yields:
+        str: Tokens or sections of the completion.
+
+    Raises:
+        CompletionInterrupted: If the request fails after part of the answer was yielded, see stream_chat_completion.
+    """
+    engine = engine or get_completion_engine()
+    streamed = False
+
+    try:
+        logging.info("Streaming completion...")
+        formatted_prompt = await _aprepare_messages(df, engine, use_cache, max_prompt_tokens, filter_relevance)
+        pieces = engine.stream(formatted_prompt, use_cache)
+
+        async for piece in asplit_sections(pieces) if by_section else pieces:
+            streamed = True
+            yield piece
+
+    except Exception as e:
+        logging.error(f"Error generating chat completion: {e}")
+        metrics.count("errors", stage="completion", error=type(e).__name__)
+
+        if streamed:
+            raise CompletionInterrupted(f"Error generating chat completion: {e}") from e
+        yield "Error generating chat completion"
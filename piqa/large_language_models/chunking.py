@@ -0,0 +1,130 @@
+import re
+from typing import Callable, Iterator, List, Optional
+
+import pandas as pd
+
+try:
+    import tiktoken
+except ImportError: # pragma: no cover - tiktoken is optional
+    tiktoken = None
+
+# Elements that start a new section of a deck
+SECTION_PATH_PATTERN = re.compile(r"/(Title|H\d)(\[\d+\])?$")
+
+# Rough number of characters per token of English text, used when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+
+def get_token_counter(model: Optional[str] = None) -> Callable[[str], int]:
+    """Get a function counting the tokens of a text for a model.
+
+    Args:
+        model (str, optional): Name of the OpenAI model. Defaults to None (the cl100k_base encoding).
+
+    Returns:
+        Callable[[str], int]: Counts the tokens of a text, exactly with tiktoken if it is installed and estimated from
+            the number of characters otherwise.
+    """
+    if tiktoken is None:
+        return lambda text: -(-len(text) // CHARS_PER_TOKEN)
+
+    try:
+        encoding = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("cl100k_base")
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def _sections(df: pd.DataFrame) -> Iterator[List[str]]:
+    """Group the texts of the elements into sections, split at page changes and titles or headings."""
+    pages = df["Page"] if "Page" in df else pd.Series(0, index=df.index)
+    paths = df["Path"].astype(str) if "Path" in df else pd.Series("", index=df.index)
+
+    section: List[str] = []
+    previous_page = None
+
+    for text, page, path in zip(df["Text"], pages, paths):
+        if section and (page != previous_page or SECTION_PATH_PATTERN.search(path)):
+            yield section
+            section = []
+
+        section.append(text)
+        previous_page = page
+
+    if section:
+        yield section
+
+
+def _split_text(text: str, max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    """Split a text that does not fit the budget at word boundaries."""
+    parts: List[str] = []
+    words: List[str] = []
+    tokens = 0
+
+    for word in text.split():
+        word_tokens = count_tokens(f" {word}")
+
+        if words and tokens + word_tokens > max_tokens:
+            parts.append(" ".join(words))
+            words, tokens = [], 0
+
+        words.append(word)
+        tokens += word_tokens
+
+    if words:
+        parts.append(" ".join(words))
+
+    return parts
+
+
+def chunk_elements(df: pd.DataFrame, max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    """Pack the texts of the elements into chunks that each fit a token budget.
+
+    Whole sections are kept together where possible, a section is only split over several chunks if it does not fit
+    the budget on its own. Every text is counted once and chunk sizes are the sum of their parts, plus one token per
+    separator, which stays within a token or two of counting the joined chunk.
+
+    Args:
+        df (pd.DataFrame): Dataframe containing text and optionally the 'Page' and 'Path' of every element.
+        max_tokens (int): Maximum number of tokens of a chunk.
+        count_tokens (Callable[[str], int]): Counts the tokens of a text.
+
+    Returns:
+        List[str]: The chunks, in document order.
+    """
+    chunks: List[str] = []
+    parts: List[str] = []
+    tokens = 0
+
+    def add(text: str, text_tokens: int) -> None:
+        nonlocal parts, tokens
+        separator_tokens = 1 if parts else 0
+
+        if parts and tokens + separator_tokens + text_tokens > max_tokens:
+            chunks.append(" ".join(parts))
+            parts, tokens, separator_tokens = [], 0, 0
+
+        parts.append(text)
+        tokens += separator_tokens + text_tokens
+
+    for section in _sections(df):
+        counts = [count_tokens(text) for text in section]
+
+        if sum(counts) + len(section) - 1 <= max_tokens:
+            add(" ".join(section), sum(counts) + len(section) - 1)
+            continue
+
+        # Oversized sections are split per element, and oversized elements at word boundaries
+        for text, text_tokens in zip(section, counts):
+            if text_tokens <= max_tokens:
+                add(text, text_tokens)
+                continue
+
+            for part in _split_text(text, max_tokens, count_tokens):
+                add(part, count_tokens(part))
+
+    if parts:
+        chunks.append(" ".join(parts))
+
+    return chunks
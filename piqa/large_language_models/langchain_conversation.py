@@ -1,18 +1,90 @@
-import os
-from typing import List
+import hashlib
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, Generator, List, Tuple
 import pandas as pd
 
-from piqa.config import logging
-from langchain.chat_models import ChatOpenAI
-from langchain.prompts.chat import (
-    ChatPromptTemplate,
-    HumanMessagePromptTemplate
-)
+from piqa.cache import DiskCache
+from piqa.instrumentation import metrics
+from piqa.config import (logging,
+                         LLM_CACHE_ENABLED,
+                         LLM_CACHE_DIR,
+                         LLM_CACHE_MAX_BYTES,
+                         LLM_CACHE_MAX_AGE,
+                         LLM_MAX_PROMPT_TOKENS,
+                         LLM_MAX_WORKERS,
+                         LLM_RELEVANCE_FILTER,
+                         LLM_MAX_CONTENT_TOKENS,
+                         OPENAI_API_KEY,
+                         OPENAI_MODEL)
+from .chunking import chunk_elements, get_token_counter
+from .relevance import select_relevant_elements
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+# langchain takes seconds to import, so it is only imported once a prompt is formatted or a model is created
+if TYPE_CHECKING:
+    from langchain.chat_models import ChatOpenAI
+    from langchain.schema import BaseMessage
 
-chat = ChatOpenAI(temperature=0, openai_api_key=OPENAI_API_KEY, model=OPENAI_MODEL) # type: ignore
+completion_cache = DiskCache(LLM_CACHE_DIR, max_bytes=LLM_CACHE_MAX_BYTES, max_age=LLM_CACHE_MAX_AGE,
+                             enabled=LLM_CACHE_ENABLED, name="llm")
+
+_chat_model_lock = threading.Lock()
+
+
+def get_chat_model() -> "ChatOpenAI":
+    """Get the chat model of the package, creating it on first use.
+
+    Returns:
+        ChatOpenAI: The chat model, also available as the module attribute 'chat'.
+    """
+    global chat # pylint: disable=global-variable-undefined
+
+    if "chat" not in globals():
+        # Threads of the completion pool, the service and process_pdfs may ask for the model at the same time
+        with _chat_model_lock:
+            if "chat" not in globals():
+                from langchain.chat_models import ChatOpenAI
+                chat = ChatOpenAI(temperature=0, openai_api_key=OPENAI_API_KEY, model=OPENAI_MODEL) # type: ignore
+
+    return chat
+
+
+def __getattr__(name: str) -> Any:
+    if name == "chat":
+        return get_chat_model()
+
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+INSTRUCTION = ("You are a venture capitalist looking to invest in a startup. You have been given a "
+               "startup's pitch deck. You are asked to extract key information from the document and provide "
+               "a recommendation on whether to invest in the startup or not.")
+
+TASK_TEMPLATE = """TASK:
+        Extract key information from the content below. The content is the text of a pitch deck. Only use the
+        content provided and be as precise (include important numbers) and concise as possible.  Structure your answer
+        into the following sections: Name of the product, Team (in this format: <NAME>: <TITLE> - <OTHER INFO>),
+        Traction, Problem, Solution, Market, Market Size, Product-Market Fit, Go-to-market (GTM) Strategy, Target
+        Customers, Competition, Business Model, and Revenue Model, a concise summary of the content below (maximum of
+        80 words), A longer summary of the content below (maximum of 200 words) and a critical, step by step, guide
+        on how to assess the risks of investing in this startup, and a recommendation on whether to invest in the
+        startup or not. Only include the sections if the relevant information is present in the content. Use structure
+        for each section if relevant, like a list or table. Include a header for each section. Format the output in
+        Markdown. CONTENT: {pdf_content} ANSWER: """
+
+# Summarizes one chunk of a deck that is too long for a single prompt, the notes of all chunks are then passed to
+# TASK_TEMPLATE as the content
+MAP_TEMPLATE = """TASK:
+        The content below is one part of the text of a pitch deck. Extract every piece of information in it about the
+        product, team (names and titles), traction, problem, solution, market, market size, product-market fit,
+        go-to-market strategy, target customers, competition, business model and revenue model. Keep names and
+        numbers exactly as written and leave out anything else. Only use the content provided. Answer with a concise
+        list of notes. CONTENT: {pdf_content} NOTES: """
+
+# Number of times the notes of the chunks are summarized again if they are still too long for a single prompt
+MAX_REDUCE_ROUNDS = 3
 
 
 def format_prompt(df: pd.DataFrame, instruction: str, task_template: str) -> List:
@@ -26,7 +98,13 @@ def format_prompt(df: pd.DataFrame, instruction: str, task_template: str) -> Lis
     Returns:
         List: Formatted chat prompts.
     """
-    pdf_content = ' '.join(df['Text'])
+    return _format_messages(' '.join(df['Text']), instruction, task_template)
+
+
+@metrics.timed("format_prompt")
+def _format_messages(pdf_content: str, instruction: str, task_template: str) -> List["BaseMessage"]:
+    from langchain.prompts.chat import ChatPromptTemplate, HumanMessagePromptTemplate
+
     instruction_human_prompt = HumanMessagePromptTemplate.from_template(instruction)
     task_human_prompt = HumanMessagePromptTemplate.from_template(task_template)
 
@@ -34,37 +112,191 @@ def format_prompt(df: pd.DataFrame, instruction: str, task_template: str) -> Lis
     return chat_prompt.format_prompt(instruction=instruction, pdf_content=pdf_content).to_messages()
 
 
-def get_chat_completion(df: pd.DataFrame) -> str:
+def _normalize_content(content: str) -> str:
+    # Indentation and line wrapping of the templates do not change the prompt
+    return re.sub(r"\s+", " ", content).strip()
+
+
+def _completion_cache_key(params: Dict[str, Any], messages: List["BaseMessage"]) -> str:
+    """Hash the model, its parameters and the normalized messages of a completion request.
+
+    Args:
+        params (Dict[str, Any]): Model name and parameters of the chat model.
+        messages (List[BaseMessage]): Formatted chat prompts.
+
+    Returns:
+        str: The cache key.
+    """
+    request = {
+        "params": params,
+        "messages": [{"type": message.type, "content": _normalize_content(message.content)} for message in messages],
+    }
+
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def record_usage(messages: List["BaseMessage"], content: str, count_tokens: Callable[[str], int]) -> None:
+    """Count a completion request and its prompt and completion tokens in the metrics.
+
+    Args:
+        messages (List[BaseMessage]): Formatted chat prompts.
+        content (str): Completion generated by the chat model.
+        count_tokens (Callable[[str], int]): Counts the tokens of a text.
+    """
+    metrics.count("llm_requests", model=OPENAI_MODEL)
+    metrics.count("prompt_tokens", sum(count_tokens(message.content) for message in messages), model=OPENAI_MODEL)
+    metrics.count("completion_tokens", count_tokens(content), model=OPENAI_MODEL)
+
+
+def _complete(messages: List["BaseMessage"], use_cache: bool = True) -> str:
+    """Get the completion of a prompt, from the completion cache if it was requested before.
+
+    Args:
+        messages (List[BaseMessage]): Formatted chat prompts.
+        use_cache (bool, optional): Look up and store the completion in the cache. Defaults to True.
+
+    Returns:
+        str: Completion generated by the chat model.
+    """
+    chat_model = get_chat_model()
+    key = _completion_cache_key(chat_model._identifying_params, messages) # pylint: disable=protected-access
+
+    if use_cache:
+        cached = completion_cache.get(key)
+        if cached is not None:
+            logging.info("Using cached completion")
+            return cached["content"]
+
+    with metrics.span("chat_completion", model=OPENAI_MODEL):
+        content = chat_model(messages).content
+    record_usage(messages, content, get_token_counter(OPENAI_MODEL))
+
+    if use_cache:
+        completion_cache.set(key, {"content": content})
+
+    return content
+
+
+def _map_prompts(prompts: List[List["BaseMessage"]], use_cache: bool, max_workers: int) -> List[str]:
+    """Summarize chunks of a deck into notes concurrently, keeping their order."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda messages: _complete(messages, use_cache), prompts))
+
+
+def _content_budget(max_prompt_tokens: int, count_tokens: Callable[[str], int]) -> int:
+    """Get the number of tokens of deck content that fit a prompt next to the instructions."""
+    content_budget = max_prompt_tokens - count_tokens(INSTRUCTION + max(TASK_TEMPLATE, MAP_TEMPLATE, key=len))
+
+    if content_budget <= 0:
+        raise ValueError(f"A prompt of {max_prompt_tokens} tokens does not fit the instructions")
+
+    return content_budget
+
+
+def _chunk_content(df: pd.DataFrame, max_prompt_tokens: int, count_tokens: Callable[[str], int],
+                   filter_relevance: bool) -> Tuple[List[str], int]:
+    """Select the content of a deck and split it into chunks that each fit a prompt.
+
+    Args:
+        df (pd.DataFrame): Dataframe containing text.
+        max_prompt_tokens (int): Maximum number of tokens of a prompt.
+        count_tokens (Callable[[str], int]): Counts the tokens of a text.
+        filter_relevance (bool): Drop duplicate elements and keep the most relevant ones within
+            LLM_MAX_CONTENT_TOKENS, or only drop duplicates if that setting is 0.
+
+    Returns:
+        Tuple[List[str], int]: The chunks and the number of content tokens that fit a prompt.
+    """
+    content_budget = _content_budget(max_prompt_tokens, count_tokens)
+
+    if filter_relevance:
+        selected = select_relevant_elements(df, LLM_MAX_CONTENT_TOKENS or None, count_tokens)
+        logging.debug(f"Selected {len(selected)} of {len(df)} elements for the prompt")
+        df = selected
+
+    return chunk_elements(df, content_budget, count_tokens), content_budget
+
+
+MessagePlan = Generator[List[List["BaseMessage"]], List[str], List["BaseMessage"]]
+
+
+def _plan_messages(df: pd.DataFrame, max_prompt_tokens: int, count_tokens: Callable[[str], int],
+                   filter_relevance: bool) -> MessagePlan:
+    """Plan the final prompt of a deck, summarizing its chunks first if it does not fit a single prompt.
+
+    The plan does not request completions itself, so the sync and async APIs share it. Every round of summaries
+    yields the prompts of the chunks and is sent back their notes, in order. The final prompt is returned.
+
+    Args:
+        df (pd.DataFrame): Dataframe containing text.
+        max_prompt_tokens (int): Maximum number of tokens of a prompt.
+        count_tokens (Callable[[str], int]): Counts the tokens of a text.
+        filter_relevance (bool): Drop duplicate and the least relevant elements, see _chunk_content.
+
+    Returns:
+        MessagePlan: Generator of the summary prompts, returning the final prompt.
+    """
+    chunks, content_budget = _chunk_content(df, max_prompt_tokens, count_tokens, filter_relevance)
+
+    for reduce_round in range(MAX_REDUCE_ROUNDS):
+        if len(chunks) <= 1:
+            break
+
+        logging.info(f"Summarizing {len(chunks)} chunks of the content (round {reduce_round + 1})")
+        notes = yield [_format_messages(chunk, INSTRUCTION, MAP_TEMPLATE) for chunk in chunks]
+        chunks = chunk_elements(pd.DataFrame({"Text": notes}), content_budget, count_tokens)
+
+    if len(chunks) > 1:
+        logging.warning(f"Content still spans {len(chunks)} chunks after summarizing, the prompt may be too long")
+
+    formatted_prompt = _format_messages(" ".join(chunks), INSTRUCTION, TASK_TEMPLATE)
+    logging.debug(f"PROMPT: {formatted_prompt}")
+
+    return formatted_prompt
+
+
+def _prepare_messages(df: pd.DataFrame, use_cache: bool, max_prompt_tokens: int, max_workers: int,
+                      filter_relevance: bool) -> List["BaseMessage"]:
+    """Build the final prompt of a deck, summarizing the chunks of every round in threads, see _plan_messages."""
+    plan = _plan_messages(df, max_prompt_tokens, get_token_counter(OPENAI_MODEL), filter_relevance)
+
+    try:
+        prompts = next(plan)
+        while True:
+            prompts = plan.send(_map_prompts(prompts, use_cache, max_workers))
+    except StopIteration as stop:
+        return stop.value
+
+
+def get_chat_completion(df: pd.DataFrame, use_cache: bool = True, max_prompt_tokens: int = LLM_MAX_PROMPT_TOKENS,
+                        max_workers: int = LLM_MAX_WORKERS, filter_relevance: bool = LLM_RELEVANCE_FILTER) -> str:
     """Generate completion for the chat model.
 
+    Repeated elements such as footers are dropped and, if the deck does not fit the LLM_MAX_CONTENT_TOKENS budget,
+    only its most relevant elements for the sections of the answer are kept. Content that still does not fit a single
+    prompt is split into chunks at page and section boundaries. The chunks are summarized into notes concurrently and
+    the notes are combined into the final answer.
+
     Args:
         df (pd.DataFrame): Dataframe containing text.
+        use_cache (bool, optional): Reuse the completion of an identical earlier request and cache new ones.
+            Defaults to True.
+        max_prompt_tokens (int, optional): Maximum number of tokens of a prompt. Defaults to the
+            LLM_MAX_PROMPT_TOKENS setting.
+        max_workers (int, optional): Number of chunks summarized at the same time. Defaults to the LLM_MAX_WORKERS
+            setting.
+        filter_relevance (bool, optional): Drop duplicate and the least relevant elements. Defaults to the
+            LLM_RELEVANCE_FILTER setting.
 
     Returns:
         str: Completion generated by the chat model.
     """
     try:
         logging.info("Generating completion...")
-        instruction = ("You are a venture capitalist looking to invest in a startup. You have been given a "
-                       "startup's pitch deck. You are asked to extract key information from the document and provide "
-                       "a recommendation on whether to invest in the startup or not.")
-        task_template = """TASK:
-        Extract key information from the content below. The content is the text of a pitch deck. Only use the
-        content provided and be as precise (include important numbers) and concise as possible.  Structure your answer
-        into the following sections: Name of the product, Team (in this format: <NAME>: <TITLE> - <OTHER INFO>),
-        Traction, Problem, Solution, Market, Market Size, Product-Market Fit, Go-to-market (GTM) Strategy, Target
-        Customers, Competition, Business Model, and Revenue Model, a concise summary of the content below (maximum of
-        80 words), A longer summary of the content below (maximum of 200 words) and a critical, step by step, guide
-        on how to assess the risks of investing in this startup, and a recommendation on whether to invest in the
-        startup or not. Only include the sections if the relevant information is present in the content. Use structure
-        for each section if relevant, like a list or table. Include a header for each section. Format the output in
-        Markdown. CONTENT: {pdf_content} ANSWER: """
-
-        formatted_prompt = format_prompt(df, instruction, task_template)
-        logging.debug(f"PROMPT: {formatted_prompt}")
-        resp = chat(formatted_prompt)
-        return resp.dict()["content"]
+        formatted_prompt = _prepare_messages(df, use_cache, max_prompt_tokens, max_workers, filter_relevance)
+        return _complete(formatted_prompt, use_cache)
 
     except Exception as e:
         logging.error(f"Error generating chat completion: {e}")
+        metrics.count("errors", stage="completion", error=type(e).__name__)
         return "Error generating chat completion"
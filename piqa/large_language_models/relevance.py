@@ -0,0 +1,200 @@
+import re
+from typing import Callable, Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# Terms that indicate an element is relevant to a section of the answer
+SECTION_TERMS: Dict[str, Sequence[str]] = {
+    "Team": ("team", "founder", "founders", "cofounder", "ceo", "cto", "coo", "cfo", "vp", "head", "director",
+             "advisor", "advisors", "board", "former", "previously", "experience", "phd", "engineer"),
+    "Traction": ("traction", "customers", "users", "revenue", "growth", "mrr", "arr", "monthly", "active", "signed",
+                 "pilots", "retention", "month", "year", "grew"),
+    "Problem": ("problem", "pain", "challenge", "difficult", "hard", "expensive", "current", "lack",
+                "struggle", "inefficient"),
+    "Solution": ("solution", "product", "platform", "we", "our", "easy", "simple", "helps", "enables", "automates",
+                 "features", "how", "works"),
+    "Market": ("market", "industry", "segment", "trends", "opportunity", "tam", "sam", "som", "size", "billion",
+               "million", "bn", "cagr", "total", "addressable"),
+    "Go-to-market": ("go", "gtm", "sales", "channel", "channels", "marketing", "partners", "partnerships",
+                     "distribution", "acquisition", "funnel", "inbound", "outbound", "target", "customers"),
+    "Competition": ("competition", "competitors", "competitive", "alternatives", "vs", "versus", "advantage",
+                    "differentiation", "unique", "moat", "landscape"),
+    "Business Model": ("business", "model", "pricing", "price", "subscription", "saas", "fee", "plan", "per",
+                       "margin", "ltv", "cac", "monetization", "revenue"),
+    "Financials": ("raise", "raising", "funding", "investment", "round", "seed", "series", "use", "funds",
+                   "runway", "valuation", "investors", "forecast", "projections"),
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z]+")
+
+# Short text repeated on this many pages, and on at least this share of the pages, is page furniture such as footers
+FURNITURE_MIN_PAGES = 3
+FURNITURE_MIN_SHARE = 0.5
+FURNITURE_MAX_WORDS = 12
+
+
+def normalize_text(texts: pd.Series) -> pd.Series:
+    """Normalize texts so repeated elements compare equal.
+
+    Args:
+        texts (pd.Series): Texts of the elements.
+
+    Returns:
+        pd.Series: Lowercased texts with punctuation and whitespace collapsed, numbers, '%' and currencies are kept.
+    """
+    return (texts.astype(str).str.lower()
+            .str.replace(r"[^\w%$€£]+", " ", regex=True)
+            .str.strip())
+
+
+def remove_duplicate_elements(df: pd.DataFrame) -> pd.DataFrame:
+    """Drop elements whose normalized text was seen before, page furniture and elements without letters or numbers.
+
+    Page furniture, such as footers and page numbers, is short text that only differs by its numbers and repeats on
+    many pages, see FURNITURE_MIN_PAGES. Its first occurrence is kept, and so is every occurrence on a page where it is
+    ambiguous, e.g. a metric next to the page number. Numbers that are not repeated are kept.
+
+    Args:
+        df (pd.DataFrame): Dataframe containing text and optionally the 'Page' of every element.
+
+    Returns:
+        pd.DataFrame: The first occurrence of every text, in document order.
+    """
+    normalized = normalize_text(df["Text"])
+    keys = pd.util.hash_pandas_object(normalized, index=False)
+    keep = ~keys.duplicated() & normalized.str.contains(r"[^\W_]", regex=True)
+
+    if "Page" in df and len(df):
+        templates = normalized.str.replace(r"\d+", "0", regex=True)
+        pages = df["Page"].groupby(templates).transform("nunique")
+        per_page = df["Page"].groupby([templates, df["Page"]]).transform("size")
+        furniture = ((pages >= max(FURNITURE_MIN_PAGES, FURNITURE_MIN_SHARE * df["Page"].nunique()))
+                     & (normalized.str.count(" ") < FURNITURE_MAX_WORDS))
+        keep &= ~(furniture & (per_page == 1) & templates.duplicated())
+
+    return df[keep]
+
+
+def score_sections(df: pd.DataFrame, sections: Optional[Dict[str, Sequence[str]]] = None, k1: float = 1.5,
+                   b: float = 0.75) -> pd.DataFrame:
+    """Score how relevant every element is to every section with BM25, treating elements as documents.
+
+    Args:
+        df (pd.DataFrame): Dataframe containing text.
+        sections (Dict[str, Sequence[str]], optional): Query terms per section. Defaults to SECTION_TERMS.
+        k1 (float, optional): BM25 term frequency saturation. Defaults to 1.5.
+        b (float, optional): BM25 length normalization. Defaults to 0.75.
+
+    Returns:
+        pd.DataFrame: One column of scores per section, with the index of the elements.
+    """
+    sections = sections or SECTION_TERMS
+    documents = [TOKEN_PATTERN.findall(text.lower()) for text in df["Text"].astype(str)]
+
+    # Only the query terms are counted, BM25 ignores every other term apart from the document lengths
+    terms = dict.fromkeys(term for section_terms in sections.values() for term in section_terms)
+    vocabulary = {term: column for column, term in enumerate(terms)}
+    rows = [row for row, tokens in enumerate(documents) for token in tokens if token in vocabulary]
+    columns = [vocabulary[token] for tokens in documents for token in tokens if token in vocabulary]
+
+    term_frequencies = np.zeros((len(documents), len(vocabulary)), dtype=np.float32)
+    np.add.at(term_frequencies, (np.array(rows, dtype=np.intp), np.array(columns, dtype=np.intp)), 1)
+
+    lengths = np.array([len(tokens) for tokens in documents], dtype=np.float32)[:, None]
+    average_length = max(float(lengths.mean()), 1.0) if len(documents) else 1.0
+    document_frequencies = (term_frequencies > 0).sum(axis=0)
+    idf = np.log1p((len(documents) - document_frequencies + 0.5) / (document_frequencies + 0.5))
+
+    weights = idf * term_frequencies * (k1 + 1) / (term_frequencies + k1 * (1 - b + b * lengths / average_length))
+
+    queries = np.zeros((len(vocabulary), len(sections)), dtype=np.float32)
+    for column, section_terms in enumerate(sections.values()):
+        queries[[vocabulary[term] for term in section_terms], column] = 1
+
+    return pd.DataFrame(weights @ queries, index=df.index, columns=list(sections))
+
+
+def select_relevant_elements(df: pd.DataFrame, max_tokens: Optional[int] = None,
+                             count_tokens: Optional[Callable[[str], int]] = None,
+                             sections: Optional[Dict[str, Sequence[str]]] = None) -> pd.DataFrame:
+    """Remove duplicate elements and keep the most relevant text that fits a token budget.
+
+    Elements are ranked by their best rank for any section, so every section gets its most relevant elements before
+    any section gets more. Elements of the first page, which usually name the product, come first. The selected
+    elements are returned in document order.
+
+    Args:
+        df (pd.DataFrame): Dataframe containing text and optionally the 'Page' of every element.
+        max_tokens (int, optional): Token budget of the selected texts. Defaults to None (no budget).
+        count_tokens (Callable[[str], int], optional): Counts the tokens of a text, required with a budget.
+        sections (Dict[str, Sequence[str]], optional): Query terms per section. Defaults to SECTION_TERMS.
+
+    Returns:
+        pd.DataFrame: The selected elements.
+    """
+    df = remove_duplicate_elements(df)
+
+    if max_tokens is None or df.empty:
+        return df
+
+    if count_tokens is None:
+        raise ValueError("count_tokens is required to select elements within a token budget")
+
+    # One token per element for the separator when the texts are joined
+    tokens = df["Text"].map(count_tokens).to_numpy() + 1
+    if tokens.sum() <= max_tokens:
+        return df
+
+    scores = score_sections(df, sections)
+    ranks = scores.rank(ascending=False, method="first")
+    ranks[scores <= 0] = np.inf
+    best_rank = ranks.min(axis=1).to_numpy()
+
+    if "Page" in df:
+        first_page = (df["Page"] == df["Page"].min()).to_numpy()
+        best_rank = np.where(first_page, 0, best_rank)
+
+    # Ties, such as elements that match no section, keep their document order
+    order = np.lexsort((np.arange(len(df)), best_rank))
+    keep = np.zeros(len(df), dtype=bool)
+    used = 0
+
+    # Elements that do not fit are skipped so smaller, less relevant ones can still fill the budget
+    for position in order:
+        if used + tokens[position] <= max_tokens:
+            keep[position] = True
+            used += tokens[position]
+
+    return df[keep]
+
+
+def select_section_elements(df: pd.DataFrame, terms: Optional[Sequence[str]], max_tokens: Optional[int] = None,
+                            count_tokens: Optional[Callable[[str], int]] = None) -> pd.DataFrame:
+    """Select the elements relevant to one part of the answer, within a token budget.
+
+    Only elements that match any of the terms are kept, with the elements of the first page. If no element matches,
+    the whole deck is used.
+
+    Args:
+        df (pd.DataFrame): Dataframe containing text and optionally the 'Page' of every element.
+        terms (Sequence[str], optional): Query terms of the part of the answer, None to keep every element.
+        max_tokens (int, optional): Token budget of the selected texts. Defaults to None (no budget).
+        count_tokens (Callable[[str], int], optional): Counts the tokens of a text, required with a budget.
+
+    Returns:
+        pd.DataFrame: The selected elements, in document order.
+    """
+    if terms is None:
+        return select_relevant_elements(df, max_tokens, count_tokens)
+
+    df = remove_duplicate_elements(df)
+    sections = {"Section": terms}
+    relevant = (score_sections(df, sections)["Section"] > 0).to_numpy()
+
+    if relevant.any():
+        if "Page" in df:
+            relevant |= (df["Page"] == df["Page"].min()).to_numpy()
+        df = df[relevant]
+
+    return select_relevant_elements(df, max_tokens, count_tokens, sections)
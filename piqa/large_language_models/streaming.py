@@ -0,0 +1,272 @@
+import copy
+import functools
+import os
+import queue
+import threading
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Iterable, Iterator, List, Tuple
+
+import pandas as pd
+
+from piqa.config import (logging,
+                         LLM_MAX_PROMPT_TOKENS,
+                         LLM_MAX_WORKERS,
+                         LLM_RELEVANCE_FILTER)
+from piqa.instrumentation import metrics
+from .chunking import get_token_counter
+from .langchain_conversation import (completion_cache,
+                                     get_chat_model,
+                                     record_usage,
+                                     _completion_cache_key,
+                                     _prepare_messages,
+                                     OPENAI_MODEL)
+
+if TYPE_CHECKING:
+    from langchain.callbacks.base import BaseCallbackHandler
+    from langchain.chat_models.base import BaseChatModel
+    from langchain.schema import BaseMessage
+
+
+class CompletionInterrupted(Exception):
+    """Raised when a streamed completion fails after part of it was yielded, so the part is not mistaken for the
+    whole answer."""
+
+
+@functools.lru_cache(maxsize=None)
+def _token_handler_class() -> type:
+    # Defined on first use so langchain is not imported with the package
+    from langchain.callbacks.base import BaseCallbackHandler
+
+    class TokenHandler(BaseCallbackHandler):
+        """Passes every new token of a streamed completion to a function."""
+        def __init__(self, on_token: Callable[[str], None]):
+            self.on_token = on_token
+
+        def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+            self.on_token(token)
+
+    return TokenHandler
+
+
+def token_handler(on_token: Callable[[str], None]) -> "BaseCallbackHandler":
+    """Create a langchain callback handler that passes every new token to a function.
+
+    Args:
+        on_token (Callable[[str], None]): Called with every token, possibly from another thread.
+
+    Returns:
+        BaseCallbackHandler: The handler.
+    """
+    return _token_handler_class()(on_token)
+
+
+def streaming_chat_model(chat_model: "BaseChatModel") -> "BaseChatModel":
+    """Get a copy of a chat model that streams its tokens to the callback handlers."""
+    # BaseModel.copy() would drop the fields excluded from serialization, such as the callbacks
+    streaming_model = copy.copy(chat_model)
+    streaming_model.streaming = True
+
+    return streaming_model
+
+
+def _pop_sections(buffer: str) -> Tuple[List[str], str]:
+    """Split the finished sections off streamed markdown, the text after the last header may still grow."""
+    sections = []
+    header = buffer.find("\n#")
+
+    while header >= 0:
+        sections.append(buffer[:header + 1])
+        buffer = buffer[header + 1:]
+        header = buffer.find("\n#")
+
+    return sections, buffer
+
+
+def split_sections(pieces: Iterable[str]) -> Iterator[str]:
+    """Regroup streamed pieces of markdown into whole sections.
+
+    A section is yielded as soon as the header of the next one starts, the last section once the stream ends.
+
+    Args:
+        pieces (Iterable[str]): Streamed tokens or text.
+
+    Yields:
+        str: The sections, each starting at its header line.
+    """
+    buffer = ""
+
+    for piece in pieces:
+        sections, buffer = _pop_sections(buffer + piece)
+        yield from sections
+
+    if buffer:
+        yield buffer
+
+
+async def asplit_sections(pieces: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Regroup streamed pieces of markdown into whole sections, see split_sections.
+
+    Args:
+        pieces (AsyncIterator[str]): Streamed tokens or text.
+
+    Yields:
+        str: The sections, each starting at its header line.
+    """
+    buffer = ""
+
+    async for piece in pieces:
+        sections, buffer = _pop_sections(buffer + piece)
+        for section in sections:
+            yield section
+
+    if buffer:
+        yield buffer
+
+
+def tee_to_file(pieces: Iterable[str], path: str) -> Iterator[str]:
+    """Pass streamed pieces through while appending them to a file as they arrive.
+
+    If the stream raises, e.g. CompletionInterrupted, the partial file is removed.
+
+    Args:
+        pieces (Iterable[str]): Streamed tokens or sections.
+        path (str): File to write, truncated first.
+
+    Yields:
+        str: The pieces, unchanged.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    try:
+        with open(path, "w") as f:
+            for piece in pieces:
+                f.write(piece)
+                f.flush()
+                yield piece
+    except Exception:
+        os.remove(path)
+        raise
+
+
+async def atee_to_file(pieces: AsyncIterator[str], path: str) -> AsyncIterator[str]:
+    """Pass streamed pieces through while appending them to a file as they arrive, see tee_to_file.
+
+    Args:
+        pieces (AsyncIterator[str]): Streamed tokens or sections.
+        path (str): File to write, truncated first.
+
+    Yields:
+        str: The pieces, unchanged.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    try:
+        with open(path, "w") as f:
+            async for piece in pieces:
+                f.write(piece)
+                f.flush()
+                yield piece
+    except Exception:
+        os.remove(path)
+        raise
+
+
+_DONE = object()
+
+
+def _stream(messages: List["BaseMessage"], use_cache: bool = True) -> Iterator[str]:
+    """Stream the completion of a prompt, or the whole completion at once if it is cached.
+
+    Args:
+        messages (List[BaseMessage]): Formatted chat prompts.
+        use_cache (bool, optional): Look up and store the completion in the cache. Defaults to True.
+
+    Yields:
+        str: Tokens of the completion.
+    """
+    chat_model = get_chat_model()
+    key = _completion_cache_key(chat_model._identifying_params, messages) # pylint: disable=protected-access
+
+    if use_cache:
+        cached = completion_cache.get(key)
+        if cached is not None:
+            logging.info("Using cached completion")
+            yield cached["content"]
+            return
+
+    # The request runs on a thread that hands its tokens over through a queue
+    tokens: "queue.Queue[Any]" = queue.Queue()
+    result: List[Any] = []
+
+    def request() -> None:
+        try:
+            with metrics.span("chat_completion", model=OPENAI_MODEL):
+                result.append(streaming_chat_model(chat_model)(messages, callbacks=[token_handler(tokens.put)]))
+        except Exception as e: # pylint: disable=broad-except
+            result.append(e)
+        finally:
+            tokens.put(_DONE)
+
+    threading.Thread(target=request, daemon=True).start()
+
+    streamed = False
+    for token in iter(tokens.get, _DONE):
+        streamed = True
+        yield token
+
+    if isinstance(result[0], Exception):
+        raise result[0]
+
+    content = result[0].content
+    record_usage(messages, content, get_token_counter(OPENAI_MODEL))
+    if not streamed:
+        yield content
+
+    if use_cache:
+        completion_cache.set(key, {"content": content})
+
+
+def stream_chat_completion(df: pd.DataFrame, use_cache: bool = True, by_section: bool = False,
+                           max_prompt_tokens: int = LLM_MAX_PROMPT_TOKENS, max_workers: int = LLM_MAX_WORKERS,
+                           filter_relevance: bool = LLM_RELEVANCE_FILTER) -> Iterator[str]:
+    """Generate completion for the chat model, yielding it while it is generated.
+
+    Prompts are built like get_chat_completion builds them, chunks of long decks are summarized before the final
+    answer starts streaming. A request that fails before the answer starts yields the error message instead, one that
+    fails after it started raises CompletionInterrupted.
+
+    Args:
+        df (pd.DataFrame): Dataframe containing text.
+        use_cache (bool, optional): Reuse the completion of an identical earlier request and cache new ones.
+            Defaults to True.
+        by_section (bool, optional): Yield whole markdown sections instead of tokens. Defaults to False.
+        max_prompt_tokens (int, optional): Maximum number of tokens of a prompt. Defaults to the
+            LLM_MAX_PROMPT_TOKENS setting.
+        max_workers (int, optional): Number of chunks summarized at the same time. Defaults to the LLM_MAX_WORKERS
+            setting.
+        filter_relevance (bool, optional): Drop duplicate and the least relevant elements. Defaults to the
+            LLM_RELEVANCE_FILTER setting.
+
+    Yields:
+        str: Tokens or sections of the completion.
+
+    Raises:
+        CompletionInterrupted: If the request fails after part of the answer was yielded.
+    """
+    streamed = False
+
+    try:
+        logging.info("Streaming completion...")
+        formatted_prompt = _prepare_messages(df, use_cache, max_prompt_tokens, max_workers, filter_relevance)
+        pieces = _stream(formatted_prompt, use_cache)
+
+        for piece in split_sections(pieces) if by_section else pieces:
+            streamed = True
+            yield piece
+
+    except Exception as e:
+        logging.error(f"Error generating chat completion: {e}")
+        metrics.count("errors", stage="completion", error=type(e).__name__)
+
+        if streamed:
+            raise CompletionInterrupted(f"Error generating chat completion: {e}") from e
+        yield "Error generating chat completion"
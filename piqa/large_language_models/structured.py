@@ -0,0 +1,277 @@
+import asyncio
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, TypedDict
+
+import pandas as pd
+
+from piqa.config import (logging,
+                         LLM_MAX_PROMPT_TOKENS,
+                         LLM_MAX_WORKERS,
+                         LLM_RELEVANCE_FILTER)
+from piqa.instrumentation import metrics
+from .async_engine import AsyncCompletionEngine, get_completion_engine
+from .chunking import get_token_counter
+from .langchain_conversation import _complete, _format_messages, INSTRUCTION, OPENAI_MODEL
+from .relevance import SECTION_TERMS, select_section_elements
+
+
+class PitchDeckMetrics(TypedDict):
+    """The sections of the answer, in markdown, None if the deck holds no information about a section."""
+    name_of_the_product: Optional[str]
+    team: Optional[str]
+    traction: Optional[str]
+    problem: Optional[str]
+    solution: Optional[str]
+    market: Optional[str]
+    market_size: Optional[str]
+    product_market_fit: Optional[str]
+    go_to_market_strategy: Optional[str]
+    target_customers: Optional[str]
+    competition: Optional[str]
+    business_model: Optional[str]
+    revenue_model: Optional[str]
+    concise_summary: Optional[str]
+    longer_summary: Optional[str]
+    risk_assessment: Optional[str]
+    recommendation: Optional[str]
+
+
+class SectionsResult(dict):
+    """PitchDeckMetrics that also list the sections whose request failed, see failed_sections.
+
+    Attributes:
+        failed (List[str]): Keys of the sections whose request failed, their value is None.
+    """
+    def __init__(self, sections: Dict[str, Optional[str]], failed: List[str]):
+        super().__init__(sections)
+        self.failed = failed
+
+
+def failed_sections(result: PitchDeckMetrics) -> List[str]:
+    """Get the sections of a structured result whose request failed.
+
+    Results that were serialized lost which requests failed, every section of a result without any section is then
+    considered failed.
+
+    Args:
+        result (PitchDeckMetrics): The result of get_structured_completion.
+
+    Returns:
+        List[str]: Keys of the failed sections, empty if every request succeeded.
+    """
+    if isinstance(result, SectionsResult):
+        return result.failed
+
+    return list(result) if all(value is None for value in result.values()) else []
+
+
+class SectionGroup(NamedTuple):
+    """Sections of the answer that are requested together, from the elements relevant to any of them.
+
+    Attributes:
+        sections (Dict[str, str]): Description of every section, by key of PitchDeckMetrics.
+        terms (Optional[Sequence[str]]): Query terms of the relevant elements, None to use the whole deck.
+    """
+    sections: Dict[str, str]
+    terms: Optional[Sequence[str]]
+
+
+SECTION_GROUPS: Dict[str, SectionGroup] = {
+    "Product": SectionGroup({
+        "name_of_the_product": "Name of the product",
+        "problem": "Problem",
+        "solution": "Solution",
+        "product_market_fit": "Product-Market Fit",
+    }, (*SECTION_TERMS["Problem"], *SECTION_TERMS["Solution"])),
+    "Team": SectionGroup({
+        "team": "Team, one line per person in this format: <NAME>: <TITLE> - <OTHER INFO>",
+    }, SECTION_TERMS["Team"]),
+    "Traction": SectionGroup({
+        "traction": "Traction",
+    }, SECTION_TERMS["Traction"]),
+    "Market": SectionGroup({
+        "market": "Market",
+        "market_size": "Market Size",
+        "target_customers": "Target Customers",
+        "competition": "Competition",
+    }, (*SECTION_TERMS["Market"], *SECTION_TERMS["Competition"])),
+    "Business": SectionGroup({
+        "go_to_market_strategy": "Go-to-market (GTM) Strategy",
+        "business_model": "Business Model",
+        "revenue_model": "Revenue Model",
+    }, (*SECTION_TERMS["Go-to-market"], *SECTION_TERMS["Business Model"], *SECTION_TERMS["Financials"])),
+    "Assessment": SectionGroup({
+        "concise_summary": "A concise summary of the content (maximum of 80 words)",
+        "longer_summary": "A longer summary of the content (maximum of 200 words)",
+        "risk_assessment": "A critical, step by step, guide on how to assess the risks of investing in this startup",
+        "recommendation": "A recommendation on whether to invest in the startup or not",
+    }, None),
+}
+
+SECTION_TEMPLATE = """TASK:
+        Extract key information from the content below. The content is the text of a pitch deck, or the parts of it
+        relevant to the task. Only use the content provided and be as precise (include important numbers) and
+        concise as possible. Answer with a JSON object with exactly these keys: {sections}. The value of every key is
+        the section in Markdown, without a header, using structure like a list or table if relevant, or null if the
+        relevant information is not present in the content. CONTENT: {pdf_content} ANSWER: """
+
+JSON_OBJECT_PATTERN = re.compile(r"\{.*\}", re.DOTALL)
+
+
+def _format_section_messages(group: SectionGroup, pdf_content: str) -> List:
+    """Format the chat prompt of a group of sections."""
+    sections = ", ".join(f'"{key}" ({description})' for key, description in group.sections.items())
+    task_template = SECTION_TEMPLATE.replace("{sections}", sections)
+
+    return _format_messages(pdf_content, INSTRUCTION, task_template)
+
+
+def _group_prompts(df: pd.DataFrame, max_prompt_tokens: int, count_tokens: Callable[[str], int],
+                   filter_relevance: bool) -> List[Tuple[SectionGroup, List]]:
+    """Build the prompt of every group of sections from the elements relevant to it, within one prompt each."""
+    prompts = []
+
+    for name, group in SECTION_GROUPS.items():
+        empty_prompt = _format_section_messages(group, "")
+        content_budget = max_prompt_tokens - sum(count_tokens(message.content) for message in empty_prompt)
+
+        if content_budget <= 0:
+            raise ValueError(f"A prompt of {max_prompt_tokens} tokens does not fit the instructions")
+
+        terms = group.terms if filter_relevance else None
+        selected = select_section_elements(df, terms, content_budget, count_tokens)
+        logging.debug(f"Selected {len(selected)} of {len(df)} elements for the {name} sections")
+
+        prompts.append((group, _format_section_messages(group, " ".join(selected["Text"]))))
+
+    return prompts
+
+
+def parse_sections(content: str, keys: Sequence[str]) -> Dict[str, Optional[str]]:
+    """Parse the JSON answer of a group of sections.
+
+    Args:
+        content (str): Completion generated by the chat model.
+        keys (Sequence[str]): Keys of the sections that were requested.
+
+    Returns:
+        Dict[str, Optional[str]]: The requested sections, None for sections that are missing, empty or could not be
+            parsed.
+    """
+    match = JSON_OBJECT_PATTERN.search(content)
+
+    try:
+        answer = json.loads(match.group(0)) if match else None
+    except json.JSONDecodeError:
+        answer = None
+
+    if not isinstance(answer, dict):
+        logging.warning(f"Could not parse the sections {', '.join(keys)} from the completion")
+        answer = {}
+
+    sections: Dict[str, Optional[str]] = {}
+    for key in keys:
+        value = answer.get(key)
+
+        if isinstance(value, (list, dict)):
+            value = json.dumps(value, ensure_ascii=False)
+
+        sections[key] = (str(value).strip() or None) if value is not None else None
+
+    return sections
+
+
+def _merge_sections(groups: List[SectionGroup], completions: List[Optional[str]]) -> PitchDeckMetrics:
+    """Combine the completions of all groups into one dict in the order of the sections, with None for the sections
+    of failed requests."""
+    sections: Dict[str, Optional[str]] = {}
+    failed: List[str] = []
+
+    for group, completion in zip(groups, completions):
+        if completion is None:
+            sections.update(dict.fromkeys(group.sections))
+            failed.extend(group.sections)
+        else:
+            sections.update(parse_sections(completion, list(group.sections)))
+
+    return SectionsResult({key: sections.get(key) for key in PitchDeckMetrics.__annotations__}, # type: ignore
+                          [key for key in PitchDeckMetrics.__annotations__ if key in failed])
+
+
+def get_structured_completion(df: pd.DataFrame, use_cache: bool = True,
+                              max_prompt_tokens: int = LLM_MAX_PROMPT_TOKENS, max_workers: int = LLM_MAX_WORKERS,
+                              filter_relevance: bool = LLM_RELEVANCE_FILTER) -> PitchDeckMetrics:
+    """Generate the answer as one entry per section, requesting groups of sections in parallel.
+
+    Every group of sections is prompted with only the elements relevant to it, so the prompts are smaller than the
+    single prompt of get_chat_completion and are answered faster.
+
+    Args:
+        df (pd.DataFrame): Dataframe containing text.
+        use_cache (bool, optional): Reuse the completion of an identical earlier request and cache new ones.
+            Defaults to True.
+        max_prompt_tokens (int, optional): Maximum number of tokens of a prompt. Defaults to the
+            LLM_MAX_PROMPT_TOKENS setting.
+        max_workers (int, optional): Number of groups requested at the same time. Defaults to the LLM_MAX_WORKERS
+            setting.
+        filter_relevance (bool, optional): Drop duplicate elements and prompt every group with the elements
+            relevant to it, instead of the whole deck. Defaults to the LLM_RELEVANCE_FILTER setting.
+
+    Returns:
+        PitchDeckMetrics: The sections, None for sections without information or whose request failed, see
+            failed_sections.
+    """
+    logging.info("Generating structured completion...")
+    prompts = _group_prompts(df, max_prompt_tokens, get_token_counter(OPENAI_MODEL), filter_relevance)
+
+    def complete(messages: List) -> Optional[str]:
+        try:
+            return _complete(messages, use_cache)
+        except Exception as e: # pylint: disable=broad-except
+            logging.error(f"Error generating chat completion: {e}")
+            metrics.count("errors", stage="completion", error=type(e).__name__)
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        completions = list(executor.map(complete, [messages for _, messages in prompts]))
+
+    return _merge_sections([group for group, _ in prompts], completions)
+
+
+async def agenerate_structured_completion(df: pd.DataFrame, engine: Optional[AsyncCompletionEngine] = None,
+                                          use_cache: bool = True, max_prompt_tokens: int = LLM_MAX_PROMPT_TOKENS,
+                                          filter_relevance: bool = LLM_RELEVANCE_FILTER) -> PitchDeckMetrics:
+    """Generate the answer as one entry per section without blocking the event loop, see get_structured_completion.
+
+    Args:
+        df (pd.DataFrame): Dataframe containing text.
+        engine (AsyncCompletionEngine, optional): Engine to request completions with. Defaults to the shared engine.
+        use_cache (bool, optional): Reuse the completion of an identical earlier request and cache new ones.
+            Defaults to True.
+        max_prompt_tokens (int, optional): Maximum number of tokens of a prompt. Defaults to the
+            LLM_MAX_PROMPT_TOKENS setting.
+        filter_relevance (bool, optional): Drop duplicate elements and prompt every group with the elements
+            relevant to it, instead of the whole deck. Defaults to the LLM_RELEVANCE_FILTER setting.
+
+    Returns:
+        PitchDeckMetrics: The sections, None for sections without information or whose request failed, see
+            failed_sections.
+    """
+    engine = engine or get_completion_engine()
+
+    logging.info("Generating structured completion...")
+    prompts = _group_prompts(df, max_prompt_tokens, engine.count_tokens, filter_relevance)
+
+    async def complete(messages: List) -> Optional[str]:
+        try:
+            return await engine.complete(messages, use_cache)
+        except Exception as e: # pylint: disable=broad-except
+            logging.error(f"Error generating chat completion: {e}")
+            metrics.count("errors", stage="completion", error=type(e).__name__)
+            return None
+
+    completions = await asyncio.gather(*[complete(messages) for _, messages in prompts])
+
+    return _merge_sections([group for group, _ in prompts], list(completions))
@@ -0,0 +1,412 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from pdfrw import PdfReader
+
+from piqa.config import (logging,
+                         NEAR_DUPLICATES_DB_PATH,
+                         NEAR_DUPLICATE_PAGES_THRESHOLD)
+from piqa.instrumentation import metrics
+
+# 128 hash functions in 32 bands of 4 rows, decks about 42% similar or more share a band with even odds
+NUM_PERMUTATIONS = 128
+BANDS = 32
+SHINGLE_SIZE = 3
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_PERMUTATIONS = np.random.default_rng(20230601).integers(1, _MERSENNE_PRIME, size=(2, NUM_PERMUTATIONS, 1),
+                                                         dtype=np.int64)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS decks (
+    id TEXT PRIMARY KEY,
+    file_path TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    page_hashes TEXT NOT NULL,
+    page_keys TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bands (
+    band INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    deck_id TEXT NOT NULL,
+    PRIMARY KEY (band, hash, deck_id)
+);
+CREATE TABLE IF NOT EXISTS results (
+    deck_id TEXT NOT NULL,
+    options TEXT NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (deck_id, options)
+);
+"""
+
+
+class Fingerprint(NamedTuple):
+    """Text fingerprint of the selected pages of a deck.
+
+    Attributes:
+        signature (np.ndarray): MinHash signature of the word shingles of all pages, None for decks without text.
+        page_hashes (List[Optional[str]]): Hash of the normalized text of every page, None for pages without text.
+    """
+    signature: Optional[np.ndarray]
+    page_hashes: List[Optional[str]]
+
+
+class Match(NamedTuple):
+    """A prior deck similar to a fingerprint, see NearDuplicateIndex.query."""
+    deck_id: str
+    similarity: float
+    file_path: str
+    page_hashes: List[Optional[str]]
+    page_keys: List[str]
+    backend: str
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+def minhash_signature(words: Sequence[str], shingle_size: int = SHINGLE_SIZE) -> Optional[np.ndarray]:
+    """Compute the MinHash signature of the word shingles of a text.
+
+    The share of equal positions in the signatures of two texts estimates the Jaccard similarity of their shingles.
+
+    Args:
+        words (Sequence[str]): The normalized words of the text.
+        shingle_size (int, optional): Number of consecutive words of a shingle. Defaults to 3.
+
+    Returns:
+        Optional[np.ndarray]: NUM_PERMUTATIONS unsigned 32-bit minimums, None for a text without words.
+    """
+    if not words:
+        return None
+
+    shingles = {" ".join(words[i:i + shingle_size]) for i in range(max(len(words) - shingle_size + 1, 1))}
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.int64,
+                         count=len(shingles)) % _MERSENNE_PRIME
+
+    # One universal hash per row, all shingles at once
+    a, b = _PERMUTATIONS
+    return ((a * hashes[None, :] + b) % _MERSENNE_PRIME).min(axis=1).astype(np.uint32)
+
+
+def similarity(signature: np.ndarray, other: np.ndarray) -> float:
+    """Estimate the Jaccard similarity of two texts from their signatures."""
+    return float(np.mean(signature == other))
+
+
+def fingerprint_texts(page_texts: Sequence[str]) -> Fingerprint:
+    """Fingerprint a deck from the text of its pages.
+
+    Args:
+        page_texts (Sequence[str]): Text of every page, in order.
+
+    Returns:
+        Fingerprint: The fingerprint.
+    """
+    page_words = [_words(text) for text in page_texts]
+
+    return Fingerprint(
+        minhash_signature([word for words in page_words for word in words]),
+        [hashlib.sha256(" ".join(words).encode("utf-8")).hexdigest() if words else None for words in page_words],
+    )
+
+
+def fingerprint_elements(df: pd.DataFrame) -> Fingerprint:
+    """Fingerprint a deck from its flattened elements, see flatten_and_preprocess_adobe_json.
+
+    Args:
+        df (pd.DataFrame): Elements with 'Text' and 'Page' columns.
+
+    Returns:
+        Fingerprint: The fingerprint, with a page hash for every page from 0 to the last page with elements.
+    """
+    texts = df.dropna(subset=["Text"]).groupby("Page")["Text"].agg(" ".join)
+    page_count = int(texts.index.max()) + 1 if len(texts) else 0
+
+    return fingerprint_texts([texts.get(page, "") for page in range(page_count)])
+
+
+@metrics.timed("fingerprint")
+def fingerprint_pdf(pdf: PdfReader, page_indices: Sequence[int]) -> Fingerprint:
+    """Fingerprint the selected pages of a deck from the text layer of the PDF, without extracting it remotely.
+
+    Args:
+        pdf (PdfReader): The parsed PDF.
+        page_indices (Sequence[int]): Zero based indices of the pages.
+
+    Returns:
+        Fingerprint: The fingerprint, without signature for scanned decks.
+    """
+    from piqa.document_processing.local_extraction import extract_page_elements
+
+    page_texts = []
+    for page_index in page_indices:
+        try:
+            elements = extract_page_elements(pdf.pages[page_index], page_index)
+        except Exception as e: # pylint: disable=broad-except
+            logging.debug(f"Could not read the text of page {page_index}: {e}")
+            elements = []
+
+        page_texts.append(" ".join(element["Text"] for element in elements))
+
+    return fingerprint_texts(page_texts)
+
+
+def _band_hashes(signature: np.ndarray) -> List[str]:
+    return [hashlib.sha1(band.tobytes()).hexdigest()[:16] for band in np.split(signature, BANDS)]
+
+
+class NearDuplicateIndex:
+    """Locality sensitive hashing index of deck fingerprints and their results, persisted in SQLite.
+
+    Signatures are split into bands and a deck is a candidate when one band is equal, so a query looks up BANDS rows
+    instead of comparing all decks. Candidates are then ranked by their estimated similarity.
+
+    Args:
+        path (str, optional): Path to the database, ':memory:' for an index that is not persisted. Defaults to the
+            NEAR_DUPLICATES_DB_PATH setting.
+    """
+    def __init__(self, path: str = NEAR_DUPLICATES_DB_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+
+    def add(self, deck_id: str, fingerprint: Fingerprint, file_path: str, page_keys: Sequence[str],
+            backend: str) -> None:
+        """Index a deck, replacing a deck with the same identifier.
+
+        Args:
+            deck_id (str): Identifier of the deck, e.g. the hash of its content.
+            fingerprint (Fingerprint): Fingerprint of the selected pages, with a signature.
+            file_path (str): Path to the deck.
+            page_keys (Sequence[str]): Extraction cache key of every selected page.
+            backend (str): Name of the extraction backend the page keys are for.
+        """
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.execute("DELETE FROM bands WHERE deck_id = ?", (deck_id,))
+            self._connection.execute(
+                "INSERT OR REPLACE INTO decks VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (deck_id, file_path, fingerprint.signature.tobytes(), json.dumps(fingerprint.page_hashes),
+                 json.dumps(list(page_keys)), backend, time.time()),
+            )
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO bands VALUES (?, ?, ?)",
+                [(band, band_hash, deck_id) for band, band_hash in enumerate(_band_hashes(fingerprint.signature))],
+            )
+            self._connection.execute("COMMIT")
+
+    def query(self, fingerprint: Fingerprint, threshold: float = 0.0) -> List[Match]:
+        """Find the indexed decks similar to a fingerprint.
+
+        Args:
+            fingerprint (Fingerprint): Fingerprint of a deck.
+            threshold (float, optional): Minimum estimated similarity. Defaults to 0.0.
+
+        Returns:
+            List[Match]: The similar decks, most similar first.
+        """
+        if fingerprint.signature is None:
+            return []
+
+        bands = list(enumerate(_band_hashes(fingerprint.signature)))
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT * FROM decks WHERE id IN (SELECT deck_id FROM bands WHERE "
+                + " OR ".join(["(band = ? AND hash = ?)"] * len(bands)) + ")",
+                [value for band in bands for value in band],
+            ).fetchall()
+
+        matches = [
+            Match(deck_id, similarity(fingerprint.signature, np.frombuffer(signature, dtype=np.uint32)), file_path,
+                  json.loads(page_hashes), json.loads(page_keys), backend)
+            for deck_id, file_path, signature, page_hashes, page_keys, backend, _ in rows
+        ]
+
+        return sorted([match for match in matches if match.similarity >= threshold],
+                      key=lambda match: -match.similarity)
+
+    def set_result(self, deck_id: str, options: str, result: Any) -> None:
+        """Store the result of an indexed deck for a set of options, e.g. the model and whether it is structured."""
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                                     (deck_id, options, json.dumps(result)))
+
+    def get_result(self, deck_id: str, options: str) -> Optional[Any]:
+        """Get the result of an indexed deck for a set of options, None if there is none."""
+        with self._lock:
+            row = self._connection.execute("SELECT result FROM results WHERE deck_id = ? AND options = ?",
+                                           (deck_id, options)).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class NearDuplicateDetector:
+    """Skips redundant work on decks that were resubmitted with small edits.
+
+    A deck with the same text on every selected page as a prior deck with a result for the same options gets that
+    result, so no number in the result is stale. For a deck at least pages_threshold similar to a prior deck, every
+    page whose text is unchanged reuses the extraction of the page of the prior deck, so only changed pages are
+    extracted. Prompts built from unchanged content then also hit the completion cache.
+
+    Pages are compared by their text layer only, a page whose figures changed but not its text reuses the prior
+    extraction. Scanned decks have no text layer and are always processed.
+
+    Args:
+        index (NearDuplicateIndex, optional): Index of the prior decks. Defaults to the index persisted at the
+            NEAR_DUPLICATES_DB_PATH setting.
+        pages_threshold (float, optional): Similarity from which unchanged pages reuse prior extractions. Defaults to
+            the NEAR_DUPLICATE_PAGES_THRESHOLD setting.
+    """
+    def __init__(self, index: Optional[NearDuplicateIndex] = None,
+                 pages_threshold: float = NEAR_DUPLICATE_PAGES_THRESHOLD):
+        self.index = index or NearDuplicateIndex()
+        self.pages_threshold = pages_threshold
+
+        # A deck is looked up, extracted and remembered in turn, its fingerprint is computed once
+        self._lock = threading.Lock()
+        self._fingerprints: "OrderedDict[tuple, Fingerprint]" = OrderedDict()
+
+    def _fingerprint(self, pdf: PdfReader, file_path: str, page_indices: Sequence[int]) -> Fingerprint:
+        status = os.stat(file_path)
+        key = (file_path, status.st_size, status.st_mtime_ns, tuple(page_indices))
+
+        with self._lock:
+            if key in self._fingerprints:
+                self._fingerprints.move_to_end(key)
+                return self._fingerprints[key]
+
+        fingerprint = fingerprint_pdf(pdf, page_indices)
+
+        with self._lock:
+            self._fingerprints[key] = fingerprint
+            while len(self._fingerprints) > 64:
+                self._fingerprints.popitem(last=False)
+
+        return fingerprint
+
+    @staticmethod
+    def deck_id(file_path: str, page_indices: Sequence[int]) -> str:
+        """Identify the selected pages of a deck by the hash of its content and the selection."""
+        with open(file_path, "rb") as f:
+            hasher = hashlib.sha256(f.read())
+        hasher.update(json.dumps(list(page_indices)).encode("utf-8"))
+
+        return hasher.hexdigest()
+
+    def find_result(self, file_path: str, page_indices: Sequence[int], options: str) -> Optional[Any]:
+        """Get the result of a prior deck with the same text on the selected pages of a deck, e.g. exported again.
+
+        Args:
+            file_path (str): Path to the deck.
+            page_indices (Sequence[int]): Zero based indices of the selected pages.
+            options (str): Options the result must have been generated with.
+
+        Returns:
+            Optional[Any]: The prior result, None if there is no prior deck with the same page texts and a result.
+        """
+        fingerprint = self._fingerprint(PdfReader(file_path), file_path, page_indices)
+
+        # The same page texts have the same signature, the index finds them among the decks with the same bands
+        for match in self.index.query(fingerprint, 1.0):
+            if match.page_hashes != fingerprint.page_hashes:
+                continue
+
+            result = self.index.get_result(match.deck_id, options)
+            if result is not None:
+                logging.info(f"Reusing the result of {match.file_path}, its pages have the same text as {file_path}")
+                metrics.count("near_duplicates", policy="result")
+                return result
+
+        return None
+
+    def reuse_pages(self, file_path: str, page_indices: Sequence[int], backend: str) -> int:
+        """Copy the cached extractions of unchanged pages of similar prior decks to the pages of a deck.
+
+        Args:
+            file_path (str): Path to the deck.
+            page_indices (Sequence[int]): Zero based indices of the selected pages.
+            backend (str): Name of the extraction backend.
+
+        Returns:
+            int: Number of pages that reuse a prior extraction.
+        """
+        from piqa.document_processing.extraction import _page_cache_key, extraction_cache
+        from piqa.document_processing.pdf_operations import trim_pdf
+
+        pdf = PdfReader(file_path)
+        fingerprint = self._fingerprint(pdf, file_path, page_indices)
+        prior_pages: Dict[str, str] = {}
+
+        for match in reversed(self.index.query(fingerprint, self.pages_threshold)):
+            if match.backend == backend:
+                prior_pages.update((page_hash, page_key) for page_hash, page_key
+                                   in zip(match.page_hashes, match.page_keys) if page_hash is not None)
+
+        page_keys = [_page_cache_key(trim_pdf(pdf, [page_index])[0], backend) for page_index in page_indices]
+        reused: Dict[str, Any] = {}
+
+        for page_hash, page_key in zip(fingerprint.page_hashes, page_keys):
+            prior_key = prior_pages.get(page_hash) if page_hash is not None else None
+
+            if prior_key is not None and prior_key != page_key and extraction_cache.get(page_key) is None:
+                elements = extraction_cache.get(prior_key)
+                if elements is not None:
+                    reused[page_key] = elements
+
+        if reused:
+            extraction_cache.set_many(reused)
+            logging.info(f"Reusing the extraction of {len(reused)} of {len(page_keys)} pages of {file_path}")
+            metrics.count("near_duplicates", len(reused), policy="page")
+
+        return len(reused)
+
+    def remember(self, file_path: str, page_indices: Sequence[int], backend: str, options: str,
+                 result: Any) -> None:
+        """Index the selected pages of a processed deck and store its result.
+
+        Args:
+            file_path (str): Path to the deck.
+            page_indices (Sequence[int]): Zero based indices of the selected pages.
+            backend (str): Name of the extraction backend.
+            options (str): Options the result was generated with.
+            result (Any): The result.
+        """
+        from piqa.document_processing.extraction import _page_cache_key
+        from piqa.document_processing.pdf_operations import trim_pdf
+
+        pdf = PdfReader(file_path)
+        fingerprint = self._fingerprint(pdf, file_path, page_indices)
+        if fingerprint.signature is None:
+            return
+
+        deck_id = self.deck_id(file_path, page_indices)
+        page_keys = [_page_cache_key(trim_pdf(pdf, [page_index])[0], backend) for page_index in page_indices]
+
+        self.index.add(deck_id, fingerprint, file_path, page_keys, backend)
+        self.index.set_result(deck_id, options, result)
+
+
+def options_key(**options: Any) -> str:
+    """Serialize the options a result depends on, see NearDuplicateDetector."""
+    return json.dumps(options, sort_keys=True, default=str)
@@ -0,0 +1,110 @@
+import asyncio
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from piqa.config import logging
+from piqa.instrumentation import metrics
+
+
+class Stage(NamedTuple):
+    """A step of a pipeline.
+
+    Attributes:
+        name (str): Name of the stage in the statistics.
+        func (Callable[[Any, Any], Awaitable[Any]]): Called with the item and the value of the previous stage, the
+            item itself for the first stage, and returns the value for the next stage.
+        workers (int): Number of items the stage works on at the same time.
+    """
+    name: str
+    func: Callable[[Any, Any], Awaitable[Any]]
+    workers: int
+
+
+class StageFailed(NamedTuple):
+    """Value of an item whose stage raised an exception, passed on without running the later stages."""
+    stage: str
+    error: Exception
+
+
+_DONE = object()
+
+
+async def run_pipeline(items: Iterable[Any], stages: List[Stage], queue_size: int = 8,
+                       stats: Optional[Dict[str, Dict[str, float]]] = None) -> AsyncIterator[Tuple[Any, Any]]:
+    """Run items through stages that work concurrently, connected by bounded queues.
+
+    While a stage works on one item, the earlier stages already work on the next ones, so the throughput is that of
+    the slowest stage. A full queue makes the stages before it wait, so at most queue_size items are held between
+    two stages.
+
+    Args:
+        items (Iterable[Any]): Items to process, consumed as the first stage takes them.
+        stages (List[Stage]): The stages, in order.
+        queue_size (int, optional): Capacity of the queue in front of every stage. Defaults to 8.
+        stats (Dict[str, Dict[str, float]], optional): Filled with the 'items', 'failures' and 'busy' seconds of every
+            stage, and the 'wall' seconds of the whole run under 'pipeline'.
+
+    Yields:
+        Tuple[Any, Any]: Every item with the value of the last stage, or a StageFailed, in order of completion.
+    """
+    stats = stats if stats is not None else {}
+    queues: List[asyncio.Queue] = [asyncio.Queue(maxsize=max(queue_size, 1)) for _ in range(len(stages) + 1)]
+    started_at = time.perf_counter()
+
+    async def feed() -> None:
+        try:
+            for item in items:
+                await queues[0].put((item, item))
+        finally:
+            await queues[0].put(_DONE)
+
+    async def work(index: int, stage: Stage, stage_stats: Dict[str, float]) -> None:
+        source, target = queues[index], queues[index + 1]
+
+        while True:
+            entry = await source.get()
+            if entry is _DONE:
+                # Every worker of the stage sees the end of the input
+                await source.put(_DONE)
+                return
+
+            item, value = entry
+            if not isinstance(value, StageFailed):
+                busy_since = time.perf_counter()
+                try:
+                    with metrics.span("pipeline_stage", stage=stage.name):
+                        value = await stage.func(item, value)
+                except Exception as e: # pylint: disable=broad-except
+                    logging.error(f"Error in the {stage.name} stage for {item}: {e}")
+                    metrics.count("errors", stage=stage.name, error=type(e).__name__)
+                    value = StageFailed(stage.name, e)
+                    stage_stats["failures"] += 1
+
+                stage_stats["items"] += 1
+                stage_stats["busy"] += time.perf_counter() - busy_since
+
+            await target.put((item, value))
+
+    async def run_stage(index: int, stage: Stage) -> None:
+        stage_stats = stats.setdefault(stage.name, {"items": 0, "failures": 0, "busy": 0.0})
+        await asyncio.gather(*[work(index, stage, stage_stats) for _ in range(max(stage.workers, 1))])
+        await queues[index + 1].put(_DONE)
+
+    tasks = [asyncio.ensure_future(feed())]
+    tasks += [asyncio.ensure_future(run_stage(index, stage)) for index, stage in enumerate(stages)]
+
+    try:
+        while True:
+            entry = await queues[-1].get()
+            if entry is _DONE:
+                break
+            yield entry
+
+        # Surface errors of the pipeline itself, such as an exception raised by the items iterable
+        await asyncio.gather(*tasks)
+
+    finally:
+        for task in tasks:
+            task.cancel()
+
+        stats["pipeline"] = {"wall": time.perf_counter() - started_at}
@@ -0,0 +1,503 @@
+import hashlib
+import http.server
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from piqa.config import (logging,
+                         SERVICE_DB_PATH,
+                         SERVICE_DOCUMENTS_PATH,
+                         SERVICE_HOST,
+                         SERVICE_MAX_UPLOAD_BYTES,
+                         SERVICE_PORT,
+                         SERVICE_UPLOADS_PATH,
+                         SERVICE_WORKERS)
+from piqa.cache import atomic_write
+from piqa.client import PiQaClient, is_error_result
+from piqa.instrumentation import metrics
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    structured INTEGER NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created_at);
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_in_flight ON jobs (content_hash, structured)
+    WHERE status IN ('queued', 'running');
+"""
+
+
+class Job(NamedTuple):
+    """A deck submitted to the service.
+
+    Attributes:
+        id (str): Identifier of the job.
+        content_hash (str): SHA-256 of the deck, identical decks have the same hash.
+        file_path (str): Path to the deck.
+        structured (bool): Request one entry per section instead of markdown.
+        priority (int): Jobs with a higher priority are worked on first, then the oldest.
+        status (str): One of 'queued', 'running', 'done' and 'failed'.
+        result (Optional[Union[str, Dict[str, Any]]]): Metrics of the deck once done.
+        error (Optional[str]): Why the job failed.
+        created_at (float): Time of the submission.
+        started_at (Optional[float]): Time a worker started the job.
+        finished_at (Optional[float]): Time the job was done or failed.
+    """
+    id: str
+    content_hash: str
+    file_path: str
+    structured: bool
+    priority: int
+    status: str
+    result: Optional[Union[str, Dict[str, Any]]]
+    error: Optional[str]
+    created_at: float
+    started_at: Optional[float]
+    finished_at: Optional[float]
+
+    def status_dict(self) -> Dict[str, Any]:
+        """Get the job without its result, as JSON serializable data."""
+        return {key: value for key, value in self._asdict().items() if key != "result"}
+
+
+def _to_job(row: sqlite3.Row) -> Job:
+    values = dict(row)
+    values["structured"] = bool(values["structured"])
+    values["result"] = json.loads(values["result"]) if values["result"] is not None else None
+
+    return Job(**values)
+
+
+def content_hash(content: bytes) -> str:
+    """Hash the content of a deck, see Job.content_hash."""
+    return hashlib.sha256(content).hexdigest()
+
+
+class JobQueue:
+    """Priority queue of jobs persisted in SQLite, so queued jobs survive a restart of the service.
+
+    A deck that is already queued or running, with the same content and options, is not queued again: its submission
+    returns the job in flight.
+
+    Args:
+        path (str, optional): Path to the database, ':memory:' for a queue that is not persisted. Defaults to the
+            SERVICE_DB_PATH setting.
+    """
+    def __init__(self, path: str = SERVICE_DB_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+
+        # Workers wait on the condition until a job is submitted
+        self._lock = threading.Lock()
+        self._submitted = threading.Condition(self._lock)
+
+    def _find_in_flight(self, digest: str, structured: bool) -> Optional[Job]:
+        row = self._connection.execute(
+            "SELECT * FROM jobs WHERE content_hash = ? AND structured = ? AND status IN (?, ?)",
+            (digest, int(structured), QUEUED, RUNNING),
+        ).fetchone()
+
+        return _to_job(row) if row else None
+
+    def submit(self, file_path: str, digest: str, priority: int = 0, structured: bool = False) -> Tuple[Job, bool]:
+        """Queue a deck, unless an identical deck is already in flight.
+
+        Args:
+            file_path (str): Path to the deck.
+            digest (str): Content hash of the deck, see content_hash.
+            priority (int, optional): Jobs with a higher priority are worked on first. Defaults to 0.
+            structured (bool, optional): Request one entry per section instead of markdown. Defaults to False.
+
+        Returns:
+            Tuple[Job, bool]: The job, and whether it was deduplicated to a job already in flight.
+        """
+        with self._lock:
+            in_flight = self._find_in_flight(digest, structured)
+            if in_flight is not None:
+                if priority > in_flight.priority and in_flight.status == QUEUED:
+                    # A more urgent duplicate makes the queued job more urgent
+                    self._connection.execute("UPDATE jobs SET priority = ? WHERE id = ?", (priority, in_flight.id))
+                    in_flight = in_flight._replace(priority=priority)
+                return in_flight, True
+
+            job_id = hashlib.sha256(f"{digest}:{structured}:{time.time_ns()}".encode("utf-8")).hexdigest()[:16]
+            try:
+                self._connection.execute(
+                    "INSERT INTO jobs (id, content_hash, file_path, structured, priority, status, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, digest, file_path, int(structured), priority, QUEUED, time.time()),
+                )
+            except sqlite3.IntegrityError:
+                # Another process queued the same deck in the meantime
+                in_flight = self._find_in_flight(digest, structured)
+                if in_flight is None:
+                    raise
+                return in_flight, True
+
+            self._submitted.notify()
+
+        return self.get(job_id), False # type: ignore
+
+    def claim(self, timeout: Optional[float] = None) -> Optional[Job]:
+        """Take the most urgent queued job and mark it running, waiting for one to be submitted if the queue is empty.
+
+        Args:
+            timeout (float, optional): Seconds to wait for a job, None to wait until one is submitted. Defaults to None.
+
+        Returns:
+            Optional[Job]: The job, or None if none was submitted in time.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        with self._lock:
+            while True:
+                row = self._connection.execute(
+                    "SELECT id FROM jobs WHERE status = ? ORDER BY priority DESC, created_at, rowid LIMIT 1", (QUEUED,)
+                ).fetchone()
+
+                if row is not None:
+                    claimed = self._connection.execute(
+                        "UPDATE jobs SET status = ?, started_at = ? WHERE id = ? AND status = ?",
+                        (RUNNING, time.time(), row["id"], QUEUED),
+                    ).rowcount
+                    if claimed:
+                        return _to_job(self._connection.execute("SELECT * FROM jobs WHERE id = ?",
+                                                                (row["id"],)).fetchone())
+                    continue
+
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._submitted.wait(remaining)
+
+    def finish(self, job_id: str, result: Optional[Union[str, Dict[str, Any]]] = None,
+               error: Optional[str] = None) -> None:
+        """Store the result of a job, or why it failed.
+
+        Args:
+            job_id (str): Identifier of the job.
+            result (Union[str, Dict[str, Any]], optional): Metrics of the deck. Defaults to None.
+            error (str, optional): Why the job failed, marks the job failed instead of done. Defaults to None.
+        """
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (FAILED if error is not None else DONE, json.dumps(result) if result is not None else None, error,
+                 time.time(), job_id),
+            )
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Get a job by its identifier, None if it does not exist."""
+        with self._lock:
+            row = self._connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+        return _to_job(row) if row else None
+
+    def requeue_running(self) -> int:
+        """Queue the jobs again that were running when the service stopped.
+
+        Returns:
+            int: Number of jobs queued again.
+        """
+        with self._lock:
+            requeued = self._connection.execute("UPDATE jobs SET status = ?, started_at = NULL WHERE status = ?",
+                                                (QUEUED, RUNNING)).rowcount
+            self._submitted.notify_all()
+
+        return requeued
+
+    def counts(self) -> Dict[str, int]:
+        """Get the number of jobs by status."""
+        with self._lock:
+            rows = self._connection.execute("SELECT status, COUNT(*) AS jobs FROM jobs GROUP BY status").fetchall()
+
+        counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)}
+        counts.update({row["status"]: row["jobs"] for row in rows})
+
+        return counts
+
+    def wake_all(self) -> None:
+        """Wake every worker waiting for a job, e.g. to stop them."""
+        with self._lock:
+            self._submitted.notify_all()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class PiQaService:
+    """Generates the metrics of queued decks in worker threads that share one warm client.
+
+    The client, its extraction backend, chat model and caches are created once and reused by every job, so a job only
+    pays for the work on its deck and not for imports, credentials and cold caches.
+
+    Args:
+        client (PiQaClient, optional): Client the jobs are run with. Defaults to a client with the default settings.
+        queue (JobQueue, optional): Queue of the jobs. Defaults to the queue persisted at the SERVICE_DB_PATH setting.
+        workers (int, optional): Jobs worked on at the same time. Defaults to the SERVICE_WORKERS setting.
+        uploads_path (str, optional): Folder uploaded decks are stored in, named by their content hash. Defaults to
+            the SERVICE_UPLOADS_PATH setting.
+        documents_path (str, optional): Folder decks submitted by path must be in, None to only accept uploads.
+            Defaults to the SERVICE_DOCUMENTS_PATH setting.
+    """
+    def __init__(self, client: Optional[PiQaClient] = None, queue: Optional[JobQueue] = None,
+                 workers: int = SERVICE_WORKERS, uploads_path: str = SERVICE_UPLOADS_PATH,
+                 documents_path: Optional[str] = SERVICE_DOCUMENTS_PATH or None):
+        self.client = client or PiQaClient()
+        self.queue = queue or JobQueue()
+        self.workers = workers
+        self.uploads_path = uploads_path
+        self.documents_path = documents_path
+
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def warm_up(self) -> None:
+        """Create the chat model and import langchain, before the first job needs them."""
+        started_at = time.perf_counter()
+
+        from piqa.large_language_models import get_chat_model
+        from piqa.large_language_models.langchain_conversation import _format_messages
+        get_chat_model()
+        _format_messages("", "", "")
+
+        logging.info(f"Warmed up in {time.perf_counter() - started_at:.2f}s")
+
+    def submit_path(self, file_path: str, priority: int = 0, structured: bool = False) -> Tuple[Job, bool]:
+        """Queue a deck in the documents folder, see JobQueue.submit.
+
+        Raises:
+            PermissionError: If path submissions are disabled or the deck is outside of the documents folder, after
+                resolving symbolic links.
+            ValueError: If the deck is larger than the SERVICE_MAX_UPLOAD_BYTES setting.
+        """
+        if self.documents_path is None:
+            raise PermissionError("Decks can only be uploaded")
+
+        root = os.path.join(os.path.realpath(self.documents_path), "")
+        file_path = os.path.realpath(file_path)
+        if not file_path.startswith(root):
+            raise PermissionError(f"Decks must be in {self.documents_path}")
+
+        if os.path.getsize(file_path) > SERVICE_MAX_UPLOAD_BYTES:
+            raise ValueError(f"Decks are limited to {SERVICE_MAX_UPLOAD_BYTES} bytes")
+
+        with open(file_path, "rb") as f:
+            digest = content_hash(f.read())
+
+        return self._submit(file_path, digest, priority, structured)
+
+    def submit_upload(self, content: bytes, priority: int = 0, structured: bool = False) -> Tuple[Job, bool]:
+        """Store an uploaded deck and queue it, see JobQueue.submit."""
+        digest = content_hash(content)
+        file_path = os.path.join(self.uploads_path, f"{digest}.pdf")
+
+        if not os.path.exists(file_path):
+            # Concurrent uploads of the same deck each write their own file, the last one replaces the others
+            atomic_write(file_path, content)
+
+        return self._submit(file_path, digest, priority, structured)
+
+    def _submit(self, file_path: str, digest: str, priority: int, structured: bool) -> Tuple[Job, bool]:
+        job, deduplicated = self.queue.submit(file_path, digest, priority, structured)
+
+        metrics.count("jobs_deduplicated" if deduplicated else "jobs_submitted")
+        logging.info(f"{'Deduplicated' if deduplicated else 'Queued'} job {job.id} for {file_path}")
+
+        return job, deduplicated
+
+    def run_job(self, job: Job) -> None:
+        """Generate the metrics of a job and store them in the queue."""
+        with metrics.span("job", structured=job.structured):
+            try:
+                result = self.client.generate_pitchdeck_metrics(job.file_path, job.structured)
+            except Exception as e: # pylint: disable=broad-except
+                logging.error(f"Error running job {job.id}: {e}")
+                result = "Error generating pitch deck metrics"
+
+        if is_error_result(result):
+            error = result if isinstance(result, str) else "Error generating chat completion"
+            logging.error(f"Job {job.id} failed: {error}")
+            metrics.count("errors", stage="job", error="JobFailed")
+            self.queue.finish(job.id, error=error)
+        else:
+            logging.info(f"Job {job.id} is done")
+            self.queue.finish(job.id, result)
+
+    def _work(self) -> None:
+        while not self._stopping.is_set():
+            job = self.queue.claim(timeout=1.0)
+            if job is not None:
+                self.run_job(job)
+
+    def start(self) -> None:
+        """Queue the jobs that were running when the service stopped again and start the workers."""
+        requeued = self.queue.requeue_running()
+        if requeued:
+            logging.info(f"Queued {requeued} interrupted jobs again")
+
+        self._stopping.clear()
+        self._threads = [threading.Thread(target=self._work, name=f"piqa-worker-{index}", daemon=True)
+                         for index in range(max(self.workers, 1))]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        """Stop the workers once they finished their current job."""
+        self._stopping.set()
+        self.queue.wake_all()
+
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+def _parse_bool(value: Optional[str]) -> bool:
+    return (value or "").lower() in ("1", "true", "yes")
+
+
+def make_server(service: PiQaService, host: str = SERVICE_HOST,
+                port: int = SERVICE_PORT) -> http.server.ThreadingHTTPServer:
+    """Create the HTTP server of a service.
+
+    Endpoints:
+        POST /jobs: Queue a deck, uploaded as the body with the 'application/pdf' content type, or a JSON object with
+            the 'path' of a deck in the documents folder of the service, 403 outside of it. The 'priority' and
+            'structured' options are given as query parameters, or as keys of the JSON object. Returns the job with
+            202, or 200 if an identical deck was in flight already.
+        GET /jobs/<id>: The status of a job.
+        GET /jobs/<id>/result: The result of a job that is done, 409 with its status otherwise.
+        GET /health: The number of jobs by status.
+        GET /metrics: The metrics of the process in the Prometheus format.
+
+    Args:
+        service (PiQaService): The service the jobs are submitted to.
+        host (str, optional): Address to listen on. Defaults to the SERVICE_HOST setting.
+        port (int, optional): Port to listen on, 0 for any free port. Defaults to the SERVICE_PORT setting.
+
+    Returns:
+        http.server.ThreadingHTTPServer: The server, run it with serve_forever().
+    """
+    class ServiceHandler(http.server.BaseHTTPRequestHandler):
+        def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+            content = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_POST(self) -> None: # pylint: disable=invalid-name
+            url = urllib.parse.urlparse(self.path)
+            if url.path != "/jobs":
+                self._send_json(404, {"error": f"Unknown path {url.path}"})
+                return
+
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > SERVICE_MAX_UPLOAD_BYTES:
+                self._send_json(413, {"error": f"Decks are limited to {SERVICE_MAX_UPLOAD_BYTES} bytes"})
+                return
+
+            body = self.rfile.read(length)
+            options: Dict[str, Any] = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+
+            try:
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    submission = json.loads(body)
+                    if not isinstance(submission, dict):
+                        raise ValueError("The body is not a JSON object")
+
+                    options.update(submission)
+                    priority, structured = int(options.get("priority", 0)), _parse_bool(str(options.get("structured")))
+                    job, deduplicated = service.submit_path(options["path"], priority, structured)
+                else:
+                    if not body.startswith(b"%PDF"):
+                        raise ValueError("The body is not a PDF file")
+                    priority, structured = int(options.get("priority", 0)), _parse_bool(options.get("structured"))
+                    job, deduplicated = service.submit_upload(body, priority, structured)
+
+            except PermissionError as e:
+                self._send_json(403, {"error": f"Invalid job: {e}"})
+                return
+            except (KeyError, ValueError, OSError) as e:
+                self._send_json(400, {"error": f"Invalid job: {e}"})
+                return
+
+            self._send_json(200 if deduplicated else 202, {"job": job.status_dict(), "deduplicated": deduplicated})
+
+        def do_GET(self) -> None: # pylint: disable=invalid-name
+            parts = urllib.parse.urlparse(self.path).path.strip("/").split("/")
+
+            if parts == ["health"]:
+                self._send_json(200, {"status": "ok", "jobs": service.queue.counts()})
+            elif parts == ["metrics"]:
+                content = metrics.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.end_headers()
+                self.wfile.write(content)
+            elif len(parts) in (2, 3) and parts[0] == "jobs" and parts[2:] in ([], ["result"]):
+                job = service.queue.get(parts[1])
+
+                if job is None:
+                    self._send_json(404, {"error": f"Unknown job {parts[1]}"})
+                elif len(parts) == 2:
+                    self._send_json(200, job.status_dict())
+                elif job.status != DONE:
+                    self._send_json(409, job.status_dict())
+                else:
+                    self._send_json(200, {"id": job.id, "result": job.result})
+            else:
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+        def log_message(self, format: str, *args: Any) -> None: # pylint: disable=redefined-builtin
+            logging.debug(format % args)
+
+    return http.server.ThreadingHTTPServer((host, port), ServiceHandler)
+
+
+def serve(host: str = SERVICE_HOST, port: int = SERVICE_PORT, workers: int = SERVICE_WORKERS) -> None:
+    """Run the service until interrupted, see make_server for its endpoints.
+
+    Args:
+        host (str, optional): Address to listen on. Defaults to the SERVICE_HOST setting.
+        port (int, optional): Port to listen on. Defaults to the SERVICE_PORT setting.
+        workers (int, optional): Jobs worked on at the same time. Defaults to the SERVICE_WORKERS setting.
+    """
+    service = PiQaService(workers=workers)
+    service.warm_up()
+    service.start()
+
+    server = make_server(service, host, port)
+    logging.info(f"Serving on http://{host}:{server.server_address[1]} with {workers} workers")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+        service.queue.close()
@@ -1,4 +1,15 @@
+import importlib
 import os
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+from piqa.config import logging
+from piqa.instrumentation import metrics
+
+_persistence_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="piqa-persistence")
+_pending_writes: Set[Future] = set()
+
 
 def relative_path(file: str, path: str) -> str:
     """Get the absolute path of a file relative to the current file's directory.
@@ -17,3 +28,62 @@ def relative_path(file: str, path: str) -> str:
     current_directory = os.path.dirname(current_file_path)
 
     return os.path.join(current_directory, path)
+
+
+def _write_files(files: Dict[str, bytes]) -> None:
+    for path, content in files.items():
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+        metrics.count("bytes_written", len(content), target="outputs")
+
+    logging.debug(f"Persisted {', '.join(files)}")
+
+
+def persist_in_background(files: Dict[str, bytes]) -> Future:
+    """Write files to disk on a background thread.
+
+    Args:
+        files (Dict[str, bytes]): Content to write, keyed by destination path.
+
+    Returns:
+        Future: Resolves once every file is written.
+    """
+    future = _persistence_executor.submit(_write_files, files)
+    _pending_writes.add(future)
+    future.add_done_callback(_pending_writes.discard)
+
+    return future
+
+
+def wait_for_pending_writes() -> None:
+    """Block until every write scheduled with persist_in_background is finished."""
+    wait(list(_pending_writes))
+
+
+def lazy_exports(package: str, exports: Dict[str, str]) -> Tuple[Callable[[str], Any], Callable[[], List[str]]]:
+    """Create the module level __getattr__ and __dir__ of a package that imports its public names on first use.
+
+    Keeps importing a package cheap when the heavy dependencies of its modules are not needed.
+
+    Args:
+        package (str): Name of the package, i.e. its __name__.
+        exports (Dict[str, str]): Relative module of every public name, e.g. {"process_pdf": ".extraction"}.
+
+    Returns:
+        Tuple[Callable[[str], Any], Callable[[], List[str]]]: The __getattr__ and __dir__ functions of the package.
+    """
+    def __getattr__(name: str) -> Any:
+        if name not in exports:
+            raise AttributeError(f"module '{package}' has no attribute '{name}'")
+
+        value = getattr(importlib.import_module(exports[name], package), name)
+
+        # Later lookups find the name directly without going through __getattr__
+        setattr(sys.modules[package], name, value)
+        return value
+
+    def __dir__() -> List[str]:
+        return sorted(exports)
+
+    return __getattr__, __dir__
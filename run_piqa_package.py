@@ -1,26 +1,35 @@
+import glob
 import os
-from dotenv import load_dotenv
-load_dotenv()
+import sys
 
 from piqa import PiQaClient
-from piqa.config import logging
-
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+from piqa.config import logging, OPENAI_MODEL, FINAL_OUTPUT_PATH, METRICS_PORT
+from piqa.instrumentation import metrics, start_metrics_server
 
 if __name__ == "__main__":
-    input_name = "moz"
-    file_path = f"data/documents/{input_name}.pdf"
+    # A single deck, or a directory of decks, e.g. python run_piqa_package.py data/documents
+    input_path = sys.argv[1] if len(sys.argv) > 1 else "data/documents/moz.pdf"
+    output_folder = FINAL_OUTPUT_PATH
+
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
 
     client = PiQaClient()
-    output = client.generate_pitchdeck_metrics(file_path)
 
-    output_folder = "data/final_output"
-    os.makedirs(output_folder, exist_ok=True)
+    if os.path.isdir(input_path):
+        # Decks are extracted while earlier decks are completed, every result is written as soon as it is done
+        file_paths = sorted(glob.glob(os.path.join(input_path, "*.pdf")))
+        results = client.pipeline_pitchdeck_metrics(file_paths, output_folder)
 
-    final_output_path = f"{output_folder}/{input_name}_{OPENAI_MODEL}_result.md"
-    with open(final_output_path, "w") as f:
-        f.write(output)
+        logging.info(f"Processed {len(results)} decks, the final outputs were written to {output_folder}")
+    else:
+        input_name = os.path.splitext(os.path.basename(input_path))[0]
+        final_output_path = f"{output_folder}/{input_name}_{OPENAI_MODEL}_result.md"
 
-        logging.info(f"The final output was written to {final_output_path}")
+        # Sections are written to the output file as soon as they are generated
+        for section in client.stream_pitchdeck_metrics(input_path, by_section=True, output_path=final_output_path):
+            logging.info(f"Generated section: {section.splitlines()[0] if section.strip() else ''}")
 
+        logging.info(f"The final output was written to {final_output_path}")
 
+    logging.info(f"Metrics: {metrics.to_json()}")
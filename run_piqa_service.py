@@ -0,0 +1,8 @@
+import sys
+
+from piqa.config import SERVICE_HOST, SERVICE_PORT, SERVICE_WORKERS
+from piqa.service import serve
+
+if __name__ == "__main__":
+    # Keeps one client warm and works on the queued decks until interrupted, e.g. python run_piqa_service.py 8080
+    serve(SERVICE_HOST, int(sys.argv[1]) if len(sys.argv) > 1 else SERVICE_PORT, SERVICE_WORKERS)
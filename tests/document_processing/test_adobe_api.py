@@ -1,16 +1,23 @@
+import io
 import json
 import os
+import zipfile
 import shutil
 import pytest
+from datetime import datetime, timedelta
 from unittest import mock
 from typing import Dict, Any
 
-from piqa.document_processing.adobe_api import (process_pdf, _update_bounds, _preprocess_pdf, _call_adobe_service, _extract_data_from_result, _postprocess_elements) # type: ignore
+from piqa.document_processing.adobe_api import (_call_adobe_service, _extract_data_from_result, AdobeExtractionSession, get_extraction_session) # type: ignore
+from piqa.document_processing.extraction import (process_pdf, _update_bounds, _postprocess_elements, _page_cache_key, extraction_cache, process_pdfs) # type: ignore
+from piqa.document_processing.pdf_operations import select_pages, trim_pdf
+from piqa.instrumentation import metrics
+from piqa.utils import wait_for_pending_writes
 
 def test_update_bounds():
     element = {
         "Bounds": [100, 200, 300, 400],
-        "Page": 1,
+        "Page": 0,
     }
     page_sizes = [
         {"page_index": 0, "width": 500, "height": 1000},
@@ -18,6 +25,18 @@ def test_update_bounds():
     _update_bounds(element, page_sizes, 72)
     assert element["PercentileBounds"] == {"left": 0.2, "top": 0.6, "right": 0.6, "bottom": 0.8}
 
+def _preprocess_pdf(input_file_path, output_file_path, max_number_pages, tail, pages=None):
+    from pdfrw import PdfReader
+
+    pdf_input = PdfReader(input_file_path)
+    trimmed_pdf, page_sizes = trim_pdf(pdf_input, select_pages(len(pdf_input.pages), max_number_pages, tail, pages))
+
+    os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+    with open(output_file_path, "wb") as f:
+        f.write(trimmed_pdf)
+
+    return page_sizes
+
 def test_preprocess_pdf():
     # provide input_file_path and output_file_path for testing
     # assuming the PDF has 10 pages, the first 5 pages should be processed
@@ -34,6 +53,7 @@ def test_call_adobe_service_and_extract_data_from_result():
 
 def test_postprocess_elements():
     # assuming correct json_data and page_sizes
+    wait_for_pending_writes()
     with open("tests/data/tmp/tmp-output.json", "r") as f:
         json_data = json.loads(f.read())
 
@@ -46,3 +66,168 @@ def test_process_pdf():
     # assuming a correct input_file_path
     result = process_pdf("tests/data/documents/moz.pdf")
     assert result != None
+
+def _moz_page_key(page_index: int, backend_name: str = "adobe") -> str:
+    from pdfrw import PdfReader
+    from piqa.document_processing.pdf_operations import trim_pdf
+
+    return _page_cache_key(trim_pdf(PdfReader("tests/data/documents/moz.pdf"), [page_index])[0], backend_name)
+
+def test_page_cache_key():
+    key = _moz_page_key(0)
+
+    assert key == _moz_page_key(0)
+    assert key != _moz_page_key(1)
+    assert key != _moz_page_key(0, "local")
+
+def test_process_pdf_cache_hit():
+    for page_index in range(3):
+        extraction_cache.set(_moz_page_key(page_index), [{"Text": f"cached {page_index}", "Page": 0}])
+
+    with mock.patch("piqa.document_processing.adobe_api._call_adobe_service") as call_adobe_service:
+        assert process_pdf("tests/data/documents/moz.pdf", 3) == {
+            "elements": [{"Text": f"cached {page_index}", "Page": page_index} for page_index in range(3)]
+        }
+        call_adobe_service.assert_not_called()
+
+def test_process_pdf_extracts_missing_pages_only():
+    from piqa.document_processing.extraction_backends import LocalExtractionBackend
+
+    extraction_cache.clear()
+    backend = LocalExtractionBackend()
+
+    with mock.patch.object(backend, "extract", wraps=backend.extract) as extract:
+        first = process_pdf("tests/data/documents/moz.pdf", 2, backend=backend)
+        second = process_pdf("tests/data/documents/moz.pdf", 4, backend=backend)
+
+    assert extract.call_count == 2
+    assert second["elements"][:len(first["elements"])] == first["elements"]
+    assert {element["Page"] for element in second["elements"]} == {0, 1, 2, 3}
+
+    # Only the two pages outside of the first window are extracted the second time
+    from pdfrw import PdfReader
+    assert len(PdfReader(fdata=extract.call_args[0][0]).pages) == 2
+
+def test_process_pdf_only_caches_pages_with_elements():
+    from piqa.document_processing.extraction_backends import ExtractionBackend
+
+    class FlakyBackend(ExtractionBackend):
+        name = "flaky"
+
+        def __init__(self):
+            self.results = [None, {"elements": [{"Text": "Title", "Page": 0, "Bounds": [0, 0, 10, 10]}]}]
+
+        def extract(self, source, output_path=None):
+            return self.results.pop(0)
+
+    extraction_cache.clear()
+    backend = FlakyBackend()
+
+    # A failed extraction caches nothing, the next call extracts both pages again and only caches the first one
+    assert process_pdf("tests/data/documents/moz.pdf", 2, backend=backend) is None
+    assert process_pdf("tests/data/documents/moz.pdf", 2, backend=backend)["elements"][0]["Text"] == "Title"
+    assert extraction_cache.get(_moz_page_key(0, "flaky")) is not None
+    assert extraction_cache.get(_moz_page_key(1, "flaky")) is None
+
+def test_process_pdfs_in_memory():
+    input_file_paths = ["tests/data/documents/moz.pdf", "tests/data/tmp/documents/moz-copy.pdf"]
+    os.makedirs("tests/data/tmp/documents", exist_ok=True)
+    shutil.copy(input_file_paths[0], input_file_paths[1])
+
+    with mock.patch.object(extraction_cache, "enabled", False), \
+            mock.patch("piqa.document_processing.adobe_api._call_adobe_service") as call_adobe_service, \
+            mock.patch("piqa.document_processing.adobe_api._extract_data_from_result",
+                       return_value={"elements": []}):
+        results = dict(process_pdfs(input_file_paths, max_number_pages=2, max_workers=2))
+
+    # Nothing was extracted for either document
+    assert results == {input_file_path: None for input_file_path in input_file_paths}
+
+    # Each job hands its own trimmed PDF to the service without writing it to disk
+    sources = [call.args[0] for call in call_adobe_service.call_args_list]
+    assert len(sources) == 2
+    assert all(isinstance(source, bytes) and source.startswith(b"%PDF-") for source in sources)
+
+def test_extraction_session_reuses_context_and_token():
+    token = mock.Mock(access_token="token", expired_at=datetime.now() + timedelta(hours=1))
+    authenticator = mock.Mock()
+    authenticator.refresh_token.return_value = token
+
+    with mock.patch("piqa.document_processing.adobe_api.Credentials") as credentials, \
+            mock.patch("piqa.document_processing.adobe_api.ExecutionContext") as execution_context:
+        execution_context.create.return_value = mock.Mock(authenticator=authenticator)
+        session = AdobeExtractionSession("credentials.json")
+
+        assert session.execution_context is session.execution_context
+        assert session.extract_pdf_options is session.extract_pdf_options
+        credentials.service_account_credentials_builder.assert_called_once()
+        execution_context.create.assert_called_once()
+
+        session.execution_context.authenticator.session_token()
+        session.execution_context.authenticator.session_token()
+        authenticator.refresh_token.assert_called_once()
+
+        token.expired_at = datetime.now() + timedelta(minutes=1)
+        session.execution_context.authenticator.session_token()
+        assert authenticator.refresh_token.call_count == 2
+
+def test_get_extraction_session_is_shared():
+    assert get_extraction_session() is get_extraction_session()
+
+def _zip_result(files: Dict[str, str]) -> mock.Mock:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_ref:
+        for name, content in files.items():
+            zip_ref.writestr(name, content)
+
+    result = mock.Mock(spec=["write_to_stream"])
+    result.write_to_stream.side_effect = lambda stream: (stream.write(buffer.getvalue()), stream.close())
+    return result
+
+def test_extract_data_from_result_in_memory():
+    result = _zip_result({"figures/fileoutpart0.png": "", "structuredData.json": '{"elements": []}'})
+
+    assert _extract_data_from_result(result) == {"elements": []}
+
+def test_extract_data_from_result_persists_in_background():
+    result = _zip_result({"structuredData.json": '{"elements": []}'})
+
+    assert _extract_data_from_result(result, "tests/data/tmp/persisted-output.zip") == {"elements": []}
+    wait_for_pending_writes()
+
+    with open("tests/data/tmp/persisted-output.json") as f:
+        assert json.load(f) == {"elements": []}
+    assert zipfile.is_zipfile("tests/data/tmp/persisted-output.zip")
+
+def test_extract_data_from_result_without_structured_data():
+    assert _extract_data_from_result(_zip_result({"figures/fileoutpart0.png": ""})) is None
+
+def test_preprocess_pdf_pages():
+    page_sizes = _preprocess_pdf("tests/data/documents/moz.pdf", "tests/data/tmp/documents/moz-pages.pdf", 5, False,
+                                 pages=[0, 2, -1])
+    assert [page_size["page_index"] for page_size in page_sizes] == [0, 1, 2]
+
+def test_process_pdf_records_preprocess_span():
+    from piqa.document_processing.extraction_backends import LocalExtractionBackend
+
+    def preprocess_spans():
+        return {span["labels"]["step"]: span["count"] for span in metrics.snapshot()["spans"]
+                if span["name"] == "preprocess_pdf"}
+
+    extraction_cache.clear()
+    before = preprocess_spans()
+    process_pdf("tests/data/documents/moz.pdf", 2, backend=LocalExtractionBackend())
+    after = preprocess_spans()
+
+    assert after["select"] == before.get("select", 0) + 1
+    assert after["trim"] == before.get("trim", 0) + 1
+
+def test_process_pdf_pages_share_cache():
+    extraction_cache.set(_moz_page_key(2), [{"Text": "cached", "Page": 0}])
+    extraction_cache.set(_moz_page_key(0), [{"Text": "first", "Page": 0}])
+
+    with mock.patch("piqa.document_processing.adobe_api._call_adobe_service") as call_adobe_service:
+        assert process_pdf("tests/data/documents/moz.pdf", pages=[2, 0]) == {
+            "elements": [{"Text": "cached", "Page": 0}, {"Text": "first", "Page": 1}]
+        }
+        call_adobe_service.assert_not_called()
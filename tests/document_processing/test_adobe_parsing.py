@@ -2,6 +2,7 @@ import pytest
 import pandas as pd
 from typing import Dict, Any
 from piqa.document_processing import flatten_and_preprocess_adobe_json
+from piqa.document_processing.adobe_parsing import DEFAULT_COLUMNS, save_elements, load_elements
 
 def test_flatten_and_preprocess_adobe_json_valid_data():
     json_data: Dict[Any, Any] = {
@@ -73,7 +74,7 @@ def test_flatten_and_preprocess_adobe_json_valid_data():
         ]
     }
     result: pd.DataFrame = flatten_and_preprocess_adobe_json(json_data)
-    assert result.shape == (2, 24)
+    assert result.shape == (2, len(DEFAULT_COLUMNS))
     assert 'Text' in result.columns.to_list()
     assert 'Foooobarrrrrrr' in result['Text'].to_list()
     assert "This is text, fantastic text, and it's in English!" in result['Text'].to_list()
@@ -147,3 +148,48 @@ def test_flatten_and_preprocess_adobe_json_missing_text_key():
     }
     with pytest.raises(KeyError):
         flatten_and_preprocess_adobe_json(json_data)
+
+
+def _elements_json_data() -> Dict[Any, Any]:
+    return {
+        'elements': [
+            {"Text": "ab", "Page": 0},
+            {
+                "Text": "Traction",
+                "Page": 1,
+                "TextSize": 24,
+                "Path": "//Document/H1",
+                "Font": {"name": "Arial,Bold", "weight": 700},
+                "PercentileBounds": {"left": 0.1, "top": 0.2, "right": 0.8, "bottom": 0.3},
+            },
+            {"Text": "Revenue grew 100% YoY", "Page": 2, "Path": "//Document/P"},
+        ]
+    }
+
+
+def test_flatten_and_preprocess_adobe_json_dtypes():
+    result: pd.DataFrame = flatten_and_preprocess_adobe_json(_elements_json_data())
+
+    assert result.index.to_list() == [1, 2]
+    assert result.columns.to_list() == list(DEFAULT_COLUMNS)
+    assert str(result['Page'].dtype) == "Int32"
+    assert str(result['PercentileBounds.left'].dtype) == "float32"
+    assert result['TextSize'].isna().to_list() == [False, True]
+
+
+def test_flatten_and_preprocess_adobe_json_selected_columns():
+    result: pd.DataFrame = flatten_and_preprocess_adobe_json(_elements_json_data(), columns=["Page", "Font.weight"])
+
+    assert result.columns.to_list() == ["Text", "Page", "Font.weight"]
+    assert result['Font.weight'].iloc[0] == 700
+
+
+@pytest.mark.parametrize("file_name", ["elements.parquet", "elements.arrow"])
+def test_save_and_load_elements(file_name):
+    result: pd.DataFrame = flatten_and_preprocess_adobe_json(_elements_json_data())
+    path = f"tests/data/tmp/{file_name}"
+
+    save_elements(result, path)
+
+    pd.testing.assert_frame_equal(load_elements(path), result)
+    assert load_elements(path, columns=["Text"])['Text'].to_list() == result['Text'].to_list()
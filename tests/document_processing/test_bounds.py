@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from piqa.document_processing.extraction import _postprocess_elements # type: ignore
+from piqa.document_processing.bounds import collect_bounded_elements, normalize_bounds
+
+PAGE_SIZES = [
+    {"page_index": 0, "width": 500, "height": 1000},
+    {"page_index": 1, "width": 1000, "height": 500},
+]
+
+def _json_data():
+    return {
+        "elements": [
+            {
+                "Bounds": [100, 200, 300, 400],
+                "Page": 0,
+                "CharBounds": [[100, 200, 200, 400], [200, 200, 300, 400]],
+                "Kids": [{"Bounds": [0, 0, 500, 1000], "Page": 0}, {"Text": "no bounds"}],
+            },
+            {"Bounds": [100, 100, 200, 200], "Page": 1},
+            {"Text": "no bounds"},
+        ]
+    }
+
+def test_collect_bounded_elements():
+    assert len(collect_bounded_elements(_json_data())) == 3
+
+def test_normalize_bounds_uses_each_page_size():
+    bounds_arrays = normalize_bounds(collect_bounded_elements(_json_data()), PAGE_SIZES)
+
+    np.testing.assert_allclose(bounds_arrays.percentile_bounds, [
+        [0.2, 0.6, 0.6, 0.8],
+        [0.0, 0.0, 1.0, 1.0],
+        [0.1, 0.6, 0.2, 0.8],
+    ])
+    assert bounds_arrays.char_offsets.tolist() == [0, 2, 2, 2]
+
+def test_postprocess_elements_char_bounds_per_character():
+    json_data = _postprocess_elements(_json_data(), PAGE_SIZES)
+    element = json_data["elements"][0]
+
+    assert element["PercentileBounds"] == pytest.approx({"left": 0.2, "top": 0.6, "right": 0.6, "bottom": 0.8})
+    np.testing.assert_allclose(element["PercentileCharBounds"], [[0.2, 0.6, 0.4, 0.8], [0.4, 0.6, 0.6, 0.8]])
+    assert element["Kids"][0]["PercentileBounds"] == {"left": 0.0, "top": 0.0, "right": 1.0, "bottom": 1.0}
+    assert "PercentileBounds" not in json_data["elements"][2]
+
+def test_postprocess_elements_dict_char_bounds():
+    element = _postprocess_elements(_json_data(), PAGE_SIZES, compact=False)["elements"][0]
+
+    assert element["PercentileCharBounds"][1] == pytest.approx({"left": 0.4, "top": 0.6, "right": 0.6, "bottom": 0.8})
+
+def test_postprocess_elements_without_bounds():
+    assert _postprocess_elements({"elements": [{"Text": "foo"}]}, PAGE_SIZES) == {"elements": [{"Text": "foo"}]}
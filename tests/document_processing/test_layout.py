@@ -0,0 +1,84 @@
+import cv2
+import numpy as np
+import pandas as pd
+from unittest import mock
+
+from piqa.document_processing.layout import (BOUND_COLUMNS, assign_blocks, detect_layout_blocks, merge_layout_blocks, reading_order, rectangles_to_percentile_bounds)
+
+def _two_column_slide() -> pd.DataFrame:
+    # Extracted in the order the lines were drawn, which interleaves the columns
+    rows = [
+        ("Moz", 0, 0.1, 0.05, 0.9, 0.1, "//Document/Title"),
+        ("We help marketers", 0, 0.1, 0.2, 0.45, 0.25, "//Document/P"),
+        ("$650K revenue", 0, 0.55, 0.2, 0.9, 0.25, "//Document/P[2]"),
+        ("rank in search", 0, 0.1, 0.26, 0.45, 0.3, "//Document/P[3]"),
+        ("per month", 0, 0.55, 0.26, 0.9, 0.3, "//Document/P[4]"),
+        ("moz.com", 0, 0.1, 0.95, 0.3, 0.98, "//Document/P[5]"),
+        ("Our team", 1, 0.1, 0.1, 0.5, 0.2, "//Document/Title[2]"),
+    ]
+    df = pd.DataFrame(rows, columns=["Text", "Page", *BOUND_COLUMNS, "Path"])
+    return df.astype({"Page": "Int32"})
+
+BLOCKS = {0: np.array([[0.08, 0.04, 0.92, 0.12], [0.08, 0.18, 0.47, 0.32], [0.53, 0.18, 0.92, 0.32]])}
+
+def test_rectangles_to_percentile_bounds():
+    np.testing.assert_allclose(rectangles_to_percentile_bounds([(100, 50, 200, 100)], 1000, 500),
+                               [[0.1, 0.1, 0.3, 0.3]])
+
+def test_assign_blocks():
+    block_bounds = np.array([[0.0, 0.0, 1.0, 1.0], [0.1, 0.1, 0.5, 0.5], [0.0, 0.0, 1.0, 1.0]])
+    block_pages = np.array([0, 0, 1])
+    bounds = np.array([
+        [0.2, 0.2, 0.3, 0.3],    # in both blocks of page 0, goes to the smallest
+        [0.6, 0.6, 0.7, 0.7],    # only in the page block
+        [0.2, 0.2, 0.3, 0.3],    # on page 1
+        [0.2, 0.2, 0.3, 0.3],    # on a page without blocks
+    ])
+
+    assert assign_blocks(bounds, np.array([0, 0, 1, 2]), block_bounds, block_pages).tolist() == [1, 0, 2, -1]
+
+def test_assign_blocks_by_overlap():
+    # The center is outside the block, but most of the element overlaps it
+    assigned = assign_blocks(np.array([[0.1, 0.1, 0.6, 0.2]]), np.array([0]), np.array([[0.0, 0.0, 0.34, 0.3]]),
+                             np.array([0]))
+    assert assigned.tolist() == [0]
+
+def test_reading_order_columns():
+    bounds = np.array([
+        [0.55, 0.2, 0.9, 0.3],   # right column
+        [0.1, 0.05, 0.9, 0.1],   # title
+        [0.1, 0.9, 0.9, 0.95],   # footer
+        [0.1, 0.2, 0.45, 0.5],   # left column, taller than the right one
+        [0.55, 0.35, 0.9, 0.5],  # right column, second paragraph
+    ])
+
+    assert reading_order(bounds).tolist() == [1, 3, 0, 4, 2]
+
+def test_merge_layout_blocks():
+    merged = merge_layout_blocks(_two_column_slide(), BLOCKS)
+
+    assert merged["Text"].tolist() == ["Moz", "We help marketers rank in search", "$650K revenue per month", "moz.com",
+                                       "Our team"]
+    assert merged["Path"].tolist() == ["//Document/Title", "//Document/P", "//Document/P[2]", "//Document/P[5]",
+                                       "//Document/Title[2]"]
+    assert merged.index.tolist() == [0, 1, 2, 5, 6]
+    assert merged.loc[1, BOUND_COLUMNS].tolist() == [0.1, 0.2, 0.45, 0.3]
+    assert list(merged.columns) == list(_two_column_slide().columns)
+
+def test_merge_layout_blocks_without_blocks():
+    df = _two_column_slide()
+
+    assert merge_layout_blocks(df, {})["Text"].tolist() == df["Text"].tolist()
+
+def test_detect_layout_blocks():
+    page = np.full((500, 1000), 255, dtype=np.uint8)
+    cv2.putText(page, "Lorem ipsum dolor", (100, 100), cv2.FONT_HERSHEY_SIMPLEX, 1, 0, 2)
+
+    with mock.patch("piqa.document_processing.layout.iter_pdf_images", return_value=iter([(3, page)])) as images:
+        blocks = detect_layout_blocks("deck.pdf", [3], scale=1.0)
+
+    assert images.call_args.kwargs["pages"] == [3]
+    assert list(blocks) == [0] and blocks[0].shape == (1, 4)
+
+    left, top, right, bottom = blocks[0][0]
+    assert 0 < left < 0.1 < right < 0.5 and 0 < top < 0.2 < bottom < 0.3
@@ -0,0 +1,74 @@
+import pytest
+from pdfrw import PdfDict, PdfName, PdfReader
+
+from piqa.document_processing.pdf_operations import trim_pdf
+from piqa.document_processing import (process_pdf,
+                                      get_extraction_backend,
+                                      AdobeExtractionBackend,
+                                      LocalExtractionBackend)
+from piqa.document_processing.local_extraction import (extract_text_elements,
+                                                       extract_page_elements,
+                                                       _parse_to_unicode) # type: ignore
+
+def test_parse_to_unicode():
+    cmap = b"""
+    2 beginbfchar
+    <0011> <0042>
+    <0102> <0061>
+    endbfchar
+    2 beginbfrange
+    <0003> <0004> [<0020> <0041>]
+    <010F> <0110> <0062>
+    endbfrange
+    """
+    assert _parse_to_unicode(cmap) == {0x11: "B", 0x102: "a", 0x3: " ", 0x4: "A", 0x10F: "b", 0x110: "c"}
+
+def test_extract_page_elements_schema():
+    elements = extract_page_elements(PdfReader("tests/data/documents/moz.pdf").pages[0], 0)
+    title = elements[0]
+
+    assert title["Text"] == "The Next Stage of Moz:"
+    assert title["Page"] == 0
+    assert title["TextSize"] == pytest.approx(39.96)
+    assert title["Font"]["weight"] == 700
+    assert title["Bounds"] == pytest.approx([168.31, 338.85, 552.0, 378.81], abs=10)
+
+def test_extract_text_elements_joins_lines_and_decodes_cid_fonts():
+    texts = [element["Text"] for element in extract_text_elements("tests/data/documents/moz.pdf")["elements"]]
+
+    # Shown with a Type0 font and a ToUnicode CMap, spread over several lines
+    assert "Gillian (Rand’s Mom) founds the company that will become SEOmoz" in texts
+    assert any("By 2007, it was all paid off" in text for text in texts)
+
+def test_extract_skips_corrupt_streams():
+    pdf = PdfReader("tests/data/documents/moz.pdf")
+    corrupt = PdfDict(Filter=PdfName.FlateDecode)
+    corrupt.stream = "not deflated"
+    pdf.pages[0].Contents = corrupt
+
+    json_data = LocalExtractionBackend().extract(trim_pdf(pdf, [0, 1])[0])
+
+    # The corrupt page has no elements, the other page is still extracted
+    assert json_data is not None
+    assert {element["Page"] for element in json_data["elements"]} == {1}
+
+def test_get_extraction_backend():
+    assert isinstance(get_extraction_backend("local"), LocalExtractionBackend)
+    assert isinstance(get_extraction_backend("adobe"), AdobeExtractionBackend)
+
+    with pytest.raises(ValueError):
+        get_extraction_backend("unknown")
+
+def test_process_pdf_local_backend():
+    json_data = process_pdf("tests/data/documents/moz.pdf", 2, backend=LocalExtractionBackend())
+
+    assert json_data is not None
+    assert {element["Page"] for element in json_data["elements"]} == {0, 1}
+    assert all(0 <= element["PercentileBounds"]["top"] <= element["PercentileBounds"]["bottom"] <= 1
+               for element in json_data["elements"])
+
+def test_process_pdf_local_backend_pages():
+    json_data = process_pdf("tests/data/documents/moz.pdf", backend=LocalExtractionBackend(), pages=[3])
+
+    assert json_data is not None
+    assert [element["Text"] for element in json_data["elements"]] == ["How’d We Do That?"]
@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+import pytest
+from unittest import mock
+from PIL import Image
+from pdfrw import PdfReader
+
+from piqa.document_processing.pdf_operations import (select_pages, get_page_sizes, trim_pdf, iter_pdf_images, convert_pdf_to_images)
+
+def test_select_pages_head_and_tail():
+    assert select_pages(10, 3) == [0, 1, 2]
+    assert select_pages(10, 3, tail=True) == [7, 8, 9]
+    assert select_pages(2, 5) == [0, 1]
+    assert select_pages(3) == [0, 1, 2]
+
+def test_select_pages_explicit():
+    assert select_pages(10, 3, pages=range(4, 7)) == [4, 5, 6]
+    assert select_pages(10, pages=[0, -1, 0]) == [0, 9]
+
+    with pytest.raises(IndexError):
+        select_pages(10, pages=[10])
+
+def test_trim_pdf():
+    pdf = PdfReader("tests/data/documents/moz.pdf")
+    trimmed_pdf, page_sizes = trim_pdf(pdf, [1, 3])
+
+    assert len(PdfReader(fdata=trimmed_pdf).pages) == 2
+    assert page_sizes == get_page_sizes(pdf, [1, 3])
+    assert page_sizes[1] == {"page_index": 1, "width": 720, "height": 540}
+
+def fake_convert_from_path(path, dpi, first_page, last_page, thread_count, grayscale):
+    mode = "L" if grayscale else "RGB"
+    return [Image.new(mode, (dpi // 10, dpi // 20)) for _ in range(first_page, last_page + 1)]
+
+def test_iter_pdf_images():
+    with mock.patch("pdf2image.convert_from_path", side_effect=fake_convert_from_path) as convert:
+        images = iter_pdf_images("tests/data/documents/moz.pdf", dpi=100, pages=[0, 1, 2, 5], thread_count=2,
+                                 as_array=True, grayscale=True)
+
+        # Nothing is rendered until the first page is consumed, then one batch at a time
+        assert convert.call_count == 0
+        page_index, image = next(images)
+        assert page_index == 0 and isinstance(image, np.ndarray) and image.shape == (5, 10)
+        assert convert.call_count == 1
+
+        assert [page_index for page_index, _ in images] == [1, 2, 5]
+
+    # Runs of consecutive pages of at most thread_count pages, rendered in one call each
+    assert [(call.kwargs["first_page"], call.kwargs["last_page"], call.kwargs["thread_count"])
+            for call in convert.call_args_list] == [(1, 2, 2), (3, 3, 1), (6, 6, 1)]
+
+def test_convert_pdf_to_images():
+    output_dir = "tests/data/tmp/images"
+
+    with mock.patch("pdf2image.convert_from_path", side_effect=fake_convert_from_path):
+        paths = convert_pdf_to_images("tests/data/documents/moz.pdf", output_dir, pages=range(2, 4))
+
+    assert paths == [os.path.join(output_dir, "moz_2.png"), os.path.join(output_dir, "moz_3.png")]
+    assert all(os.path.exists(path) for path in paths)
@@ -0,0 +1,129 @@
+import threading
+import time
+import pytest
+from unittest import mock
+
+from adobe.pdfservices.operation.exception.exceptions import ServiceApiException, ServiceUsageException, SdkException
+
+from piqa.document_processing.adobe_api import _is_retryable_error, AdobeExtractionBackend # type: ignore
+from piqa.document_processing.scheduling import ExtractionScheduler
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+def _flaky(failures: int, error: Exception):
+    calls = []
+
+    def call():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise error
+        return "result"
+
+    return call, calls
+
+def test_scheduler_retries_retryable_errors():
+    clock = FakeClock()
+    scheduler = ExtractionScheduler(max_retries=3, backoff_base=1, is_retryable=lambda err: True,
+                                    clock=clock, sleep=clock.sleep)
+    call, calls = _flaky(2, ValueError("throttled"))
+
+    assert scheduler.run(call) == "result"
+    assert len(calls) == 3
+    assert len(clock.sleeps) == 2
+    assert clock.sleeps[0] <= 1 and clock.sleeps[1] <= 2
+
+    stats = scheduler.stats()
+    assert stats["attempts"] == 3
+    assert stats["retries"] == 2
+    assert stats["successes"] == 1
+    assert stats["failures"] == 0
+    assert stats["backoff_total"] == pytest.approx(sum(clock.sleeps))
+
+def test_scheduler_gives_up():
+    clock = FakeClock()
+    scheduler = ExtractionScheduler(max_retries=2, is_retryable=lambda err: True, clock=clock, sleep=clock.sleep)
+    call, calls = _flaky(10, ValueError("throttled"))
+
+    with pytest.raises(ValueError):
+        scheduler.run(call)
+
+    assert len(calls) == 3
+    assert scheduler.stats()["failures"] == 1
+
+def test_scheduler_does_not_retry_other_errors():
+    scheduler = ExtractionScheduler(is_retryable=lambda err: isinstance(err, TimeoutError))
+    call, calls = _flaky(1, ValueError("invalid"))
+
+    with pytest.raises(ValueError):
+        scheduler.run(call)
+
+    assert len(calls) == 1
+    assert scheduler.stats()["retries"] == 0
+
+def test_scheduler_requests_per_minute():
+    clock = FakeClock()
+    scheduler = ExtractionScheduler(requests_per_minute=30, clock=clock, sleep=clock.sleep)
+
+    for _ in range(3):
+        scheduler.run(lambda: None)
+
+    # Attempts are spaced two seconds apart and the waits are recorded as queue time
+    assert clock.sleeps == [2.0, 2.0]
+    assert scheduler.stats()["queue_wait_total"] == pytest.approx(4.0)
+    assert scheduler.stats()["queue_wait_max"] == pytest.approx(2.0)
+
+def test_scheduler_max_concurrency():
+    scheduler = ExtractionScheduler(max_concurrency=2)
+    lock = threading.Lock()
+    in_flight = []
+    peak = []
+
+    def call():
+        with lock:
+            in_flight.append(1)
+            peak.append(len(in_flight))
+        time.sleep(0.02)
+        with lock:
+            in_flight.pop()
+
+    threads = [threading.Thread(target=scheduler.run, args=(call,)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(peak) == 2
+    assert scheduler.stats()["successes"] == 6
+
+def test_is_retryable_error():
+    assert _is_retryable_error(ServiceApiException("throttled", None, 429))
+    assert _is_retryable_error(ServiceApiException("unavailable", None, 503))
+    assert _is_retryable_error(ServiceUsageException("usage limit", None))
+    assert _is_retryable_error(SdkException("connection reset"))
+    assert not _is_retryable_error(ServiceApiException("bad pdf", None, 400))
+    assert not _is_retryable_error(ValueError("bug"))
+
+def test_adobe_backend_uses_scheduler():
+    clock = FakeClock()
+    scheduler = ExtractionScheduler(is_retryable=_is_retryable_error, clock=clock, sleep=clock.sleep)
+    call, calls = _flaky(1, ServiceApiException("throttled", None, 429))
+
+    backend = AdobeExtractionBackend(scheduler=scheduler)
+
+    with mock.patch("piqa.document_processing.adobe_api._call_adobe_service",
+                    side_effect=lambda source, session: call()), \
+            mock.patch("piqa.document_processing.adobe_api._extract_data_from_result", return_value={"elements": []}):
+        assert backend.extract(b"%PDF-") == {"elements": []}
+
+    assert len(calls) == 2
+    assert scheduler.stats()["retries"] == 1
@@ -3,7 +3,8 @@ import numpy as np
 import pytest
 from PIL import Image, ImageDraw, ImageFont
 
-from piqa.image_processing import detect_paragraphs
+from piqa.image_processing import detect_paragraphs, detect_paragraph_boxes, detect_paragraphs_batch
+from piqa.instrumentation import metrics
 
 def create_test_image(text: str, width: int, height: int, font_size: int, filename: str) -> None:
     image = Image.new('RGB', (width, height), color=(255, 255, 255))
@@ -22,6 +23,48 @@ def generate_test_images() -> None:
     create_test_image(text_two_paragraphs, 300, 150, 16, "two_paragraphs.png")
     create_test_image(text_paragraphs_with_space, 300, 200, 16, "paragraphs_with_space.png")
 
+def _page(width: int = 1200, height: int = 900) -> np.ndarray:
+    # Two blocks of text lines far apart, like a title and a paragraph on a slide
+    page = np.full((height, width, 3), 255, dtype=np.uint8)
+    for top in (100, 130, 160):
+        cv2.putText(page, "Lorem ipsum dolor sit amet", (100, top), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+    for top in (600, 630):
+        cv2.putText(page, "consectetur adipiscing elit", (500, top), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+    return page
+
+def test_detect_paragraph_boxes_matches_detect_paragraphs() -> None:
+    cv2.imwrite("tests/data/images/page.png", _page())
+
+    _, _, _, rectangles = detect_paragraphs("tests/data/images/page.png")
+
+    assert len(rectangles) == 2
+    assert detect_paragraph_boxes("tests/data/images/page.png") == rectangles
+    assert detect_paragraph_boxes(_page()) == rectangles
+
+def test_detect_paragraph_boxes_downscaled() -> None:
+    full_scale = sorted(detect_paragraph_boxes(_page()))
+    half_scale = sorted(detect_paragraph_boxes(cv2.cvtColor(_page(), cv2.COLOR_BGR2GRAY), scale=0.5))
+
+    # The boxes found at half the resolution are mapped back to within a few pixels of the full scale boxes
+    assert len(half_scale) == len(full_scale)
+    assert np.abs(np.array(half_scale) - np.array(full_scale)).max() <= 4
+
+def test_detect_paragraphs_batch() -> None:
+    pages = [_page(), _page(900, 700), _page()]
+    expected = [detect_paragraph_boxes(page) for page in pages]
+
+    assert list(detect_paragraphs_batch(iter(pages), scale=1.0, max_workers=2)) == expected
+    assert list(detect_paragraphs_batch(pages, scale=1.0, max_workers=1)) == expected
+
+def _detections() -> int:
+    return sum(span["count"] for span in metrics.snapshot()["spans"] if span["name"] == "detect_paragraphs")
+
+def test_detect_paragraphs_batch_records_spans_of_workers() -> None:
+    detections = _detections()
+    list(detect_paragraphs_batch([_page(), _page()], scale=1.0, max_workers=2))
+
+    assert _detections() == detections + 2
+
 # Temporarily disabled; This feature is to be built in the future
 
 # def test_detect_paragraphs_empty_image() -> None:
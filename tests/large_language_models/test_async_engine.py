@@ -0,0 +1,152 @@
+import asyncio
+import threading
+import time
+from typing import Any, List, Optional
+
+import pandas as pd
+import pytest
+from langchain.chat_models.base import SimpleChatModel
+from langchain.schema import AIMessage, BaseMessage, ChatGeneration, ChatResult, HumanMessage
+
+from piqa.large_language_models.async_engine import (AsyncCompletionEngine, AsyncRateLimiter, agenerate_chat_completion, get_completion_engine) # type: ignore
+from piqa.large_language_models.langchain_conversation import completion_cache # type: ignore
+
+class FakeChatModel(SimpleChatModel):
+    """Answers after a delay and records how many requests were in flight at the same time."""
+    delay: float = 0.01
+    in_flight: int = 0
+    peak: int = 0
+    prompts: List[str] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _call(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None,
+              **kwargs: Any) -> str:
+        return self._answer(messages)
+
+    def _answer(self, messages: List[BaseMessage]) -> str:
+        self.prompts.append(messages[-1].content)
+        return "# Metrics" if "ANSWER:" in messages[-1].content else f"- note {len(self.prompts)}"
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None,
+                         **kwargs: Any) -> ChatResult:
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._answer(messages)))])
+
+def _engine(chat_model: FakeChatModel, **kwargs: Any) -> AsyncCompletionEngine:
+    return AsyncCompletionEngine(chat_model, requests_per_minute=0, tokens_per_minute=0, timeout=0,
+                                 count_tokens=lambda text: len(text.split()), **kwargs)
+
+def test_engine_max_concurrency():
+    chat_model = FakeChatModel(prompts=[])
+    engine = _engine(chat_model, max_concurrency=3)
+
+    async def run():
+        return await asyncio.gather(*[
+            engine.complete([HumanMessage(content=f"prompt {i}")], use_cache=False) for i in range(10)
+        ])
+
+    assert len(asyncio.run(run())) == 10
+    assert chat_model.peak == 3
+    assert engine.stats()["requests"] == 10
+
+def test_engine_cache():
+    completion_cache.clear()
+    chat_model = FakeChatModel(prompts=[])
+    engine = _engine(chat_model)
+    messages = [HumanMessage(content="Extract the metrics ANSWER:")]
+
+    assert asyncio.run(engine.complete(messages)) == "# Metrics"
+    assert asyncio.run(engine.complete(messages)) == "# Metrics"
+    assert engine.stats() == {"requests": 1, "cache_hits": 1, "timeouts": 0}
+
+def test_engine_timeout():
+    engine = _engine(FakeChatModel(prompts=[], delay=1))
+    engine.timeout = 0.01
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(engine.complete([HumanMessage(content="slow")], use_cache=False))
+    assert engine.stats()["timeouts"] == 1
+
+def test_rate_limiter():
+    async def run():
+        limiter = AsyncRateLimiter(6000)
+        assert await limiter.acquire(6000) < 0.05
+
+        # The budget refills at 100 per second
+        started_at = time.monotonic()
+        await limiter.acquire(10)
+        return time.monotonic() - started_at
+
+    assert 0.05 < asyncio.run(run()) < 0.5
+
+def test_agenerate_chat_completion_map_reduce():
+    completion_cache.clear()
+    chat_model = FakeChatModel(prompts=[])
+    engine = _engine(chat_model)
+    df = pd.DataFrame({"Text": [f"Slide {page} " + "text " * 400 for page in range(4)], "Page": list(range(4))})
+
+    completion = agenerate_chat_completion(df, engine, max_prompt_tokens=1000, filter_relevance=False)
+    assert asyncio.run(completion) == "# Metrics"
+
+    # The four pages are summarized concurrently before the final prompt
+    assert sum("NOTES:" in prompt for prompt in chat_model.prompts) == 4
+    assert chat_model.peak == 4
+    assert "ANSWER:" in chat_model.prompts[-1]
+
+def _run_in_threads(*coroutine_functions):
+    results, errors = [None] * len(coroutine_functions), []
+    started = threading.Barrier(len(coroutine_functions))
+
+    def run(index, coroutine_function):
+        async def main():
+            started.wait(5)
+            return await coroutine_function()
+
+        try:
+            results[index] = asyncio.run(main())
+        except Exception as e: # pylint: disable=broad-except
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=item) for item in enumerate(coroutine_functions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results, errors
+
+def test_get_completion_engine_per_event_loop():
+    async def engines():
+        await asyncio.sleep(0.05)
+        return get_completion_engine(), get_completion_engine()
+
+    results, errors = _run_in_threads(engines, engines)
+
+    assert not errors
+    assert results[0][0] is results[0][1] and results[1][0] is results[1][1]
+    assert results[0][0] is not results[1][0]
+
+    with pytest.raises(RuntimeError):
+        get_completion_engine()
+
+def test_engine_is_used_by_one_running_event_loop():
+    completion_cache.clear()
+    chat_model = FakeChatModel(prompts=[], delay=0.2)
+    engine = _engine(chat_model)
+    messages = [HumanMessage(content="Extract the metrics ANSWER:")]
+
+    results, errors = _run_in_threads(lambda: engine.complete(messages, False), lambda: engine.complete(messages, False))
+
+    # The second event loop would replace the semaphore and limiters of the first one
+    assert results.count("# Metrics") == 1
+    assert len(errors) == 1 and isinstance(errors[0], RuntimeError)
+
+    # Once the first event loop stopped, the engine is used by a new one
+    assert asyncio.run(engine.complete(messages, False)) == "# Metrics"
@@ -0,0 +1,38 @@
+import pandas as pd
+
+from piqa.large_language_models.chunking import chunk_elements, get_token_counter
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+def test_get_token_counter():
+    count_tokens = get_token_counter("gpt-3.5-turbo")
+
+    assert count_tokens("") == 0
+    assert 0 < count_tokens("Traction: 10k monthly active users") < 20
+
+def test_chunk_elements_fits_in_one_chunk():
+    df = pd.DataFrame({"Text": ["Moz", "SEO made easy"], "Page": [0, 0]})
+
+    assert chunk_elements(df, 100, count_words) == ["Moz SEO made easy"]
+
+def test_chunk_elements_keeps_sections_together():
+    df = pd.DataFrame({
+        "Text": ["Problem", "Search is hard", "Solution", "We make it easy", "Team", "Jane Doe CEO"],
+        "Page": [0, 0, 0, 0, 1, 1],
+        "Path": ["//Document/H1", "//Document/P", "//Document/H1[2]", "//Document/P[2]", "//Document/Title",
+                 "//Document/P[3]"],
+    })
+
+    # The sections count 5, 6 and 5 tokens, one token per separator included
+    assert chunk_elements(df, 12, count_words) == [
+        "Problem Search is hard Solution We make it easy", "Team Jane Doe CEO"
+    ]
+    assert chunk_elements(df, 6, count_words) == [
+        "Problem Search is hard", "Solution We make it easy", "Team Jane Doe CEO"
+    ]
+
+def test_chunk_elements_splits_oversized_elements():
+    df = pd.DataFrame({"Text": ["one two three four five six seven"], "Page": [0]})
+
+    assert chunk_elements(df, 3, count_words) == ["one two three", "four five six", "seven"]
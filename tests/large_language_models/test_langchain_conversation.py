@@ -0,0 +1,116 @@
+import pandas as pd
+from unittest import mock
+
+from langchain.schema import AIMessage, HumanMessage
+
+from piqa.large_language_models.langchain_conversation import (get_chat_completion, _completion_cache_key, completion_cache) # type: ignore
+
+PARAMS = {"model_name": "gpt-3.5-turbo", "temperature": 0}
+
+def _df() -> pd.DataFrame:
+    return pd.DataFrame({"Text": ["PiQA helps investors", "Team: Jane Doe - CEO"]})
+
+def test_completion_cache_key():
+    key = _completion_cache_key(PARAMS, [HumanMessage(content="Extract  the\n   metrics")])
+
+    assert key == _completion_cache_key(PARAMS, [HumanMessage(content="Extract the metrics ")])
+    assert key != _completion_cache_key(PARAMS, [HumanMessage(content="Extract the team")])
+    assert key != _completion_cache_key({**PARAMS, "temperature": 0.7}, [HumanMessage(content="Extract the metrics")])
+    assert key != _completion_cache_key({**PARAMS, "model_name": "gpt-4"}, [HumanMessage(content="Extract the metrics")])
+
+def test_get_chat_completion_cached():
+    completion_cache.clear()
+
+    with mock.patch("piqa.large_language_models.langchain_conversation.chat") as chat:
+        chat.return_value = AIMessage(content="# Metrics")
+        chat._identifying_params = PARAMS
+
+        assert get_chat_completion(_df()) == "# Metrics"
+        assert get_chat_completion(_df()) == "# Metrics"
+        assert chat.call_count == 1
+
+        # Bypassing the cache always calls the model
+        assert get_chat_completion(_df(), use_cache=False) == "# Metrics"
+        assert chat.call_count == 2
+
+def test_get_chat_completion_error_not_cached():
+    completion_cache.clear()
+
+    with mock.patch("piqa.large_language_models.langchain_conversation.chat") as chat:
+        chat.side_effect = [Exception("context length exceeded"), AIMessage(content="# Metrics")]
+        chat._identifying_params = PARAMS
+
+        assert get_chat_completion(_df()) == "Error generating chat completion"
+        assert get_chat_completion(_df()) == "# Metrics"
+
+def test_get_chat_completion_map_reduce():
+    completion_cache.clear()
+    df = pd.DataFrame({"Text": [f"Slide {page} " + "text " * 400 for page in range(4)], "Page": list(range(4))})
+
+    def complete(messages):
+        return AIMessage(content="# Metrics" if "ANSWER:" in messages[-1].content else "- note")
+
+    with mock.patch("piqa.large_language_models.langchain_conversation.chat") as chat:
+        chat.side_effect = complete
+        chat._identifying_params = PARAMS
+
+        assert get_chat_completion(df, max_prompt_tokens=1000, filter_relevance=False) == "# Metrics"
+
+    # Every page is summarized separately before the notes are combined in one final prompt
+    prompts = [call.args[0][-1].content for call in chat.call_args_list]
+    assert sum("NOTES:" in prompt for prompt in prompts) == 4
+    assert "- note - note - note - note" in prompts[-1]
+
+def test_get_chat_completion_drops_repeated_elements():
+    completion_cache.clear()
+    df = pd.DataFrame({"Text": ["Moz", "moz.com | Page 1", "Team", "moz.com | Page 2", "Revenue 40%", "moz.com | Page 3"],
+                       "Page": [0, 0, 1, 1, 2, 2]})
+
+    with mock.patch("piqa.large_language_models.langchain_conversation.chat") as chat:
+        chat.return_value = AIMessage(content="# Metrics")
+        chat._identifying_params = PARAMS
+
+        assert get_chat_completion(df) == "# Metrics"
+
+    assert "Moz moz.com | Page 1 Team Revenue 40% ANSWER" in chat.call_args[0][0][-1].content
+
+def test_get_chat_completion_long_deck_default_settings():
+    completion_cache.clear()
+    df = pd.DataFrame({"Text": [f"Slide {page} revenue " + "text " * 2000 for page in range(4)],
+                       "Page": list(range(4))})
+
+    def complete(messages):
+        return AIMessage(content="# Metrics" if "ANSWER:" in messages[-1].content else "- note")
+
+    with mock.patch("piqa.large_language_models.langchain_conversation.chat") as chat:
+        chat.side_effect = complete
+        chat._identifying_params = PARAMS
+
+        assert get_chat_completion(df) == "# Metrics"
+
+    # The relevance filter keeps the whole deck, every page is summarized instead of being cut
+    prompts = [call.args[0][-1].content for call in chat.call_args_list]
+    assert sum("NOTES:" in prompt for prompt in prompts) == 4
+    assert all(f"Slide {page}" in "".join(prompts) for page in range(4))
+
+def test_get_chat_model_is_created_once_across_threads():
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from piqa.large_language_models import langchain_conversation
+
+    def slow_chat_model(**kwargs):
+        time.sleep(0.05)
+        return mock.Mock()
+
+    saved = langchain_conversation.__dict__.pop("chat", None)
+    try:
+        with mock.patch("langchain.chat_models.ChatOpenAI", side_effect=slow_chat_model) as chat_open_ai, \
+                ThreadPoolExecutor(max_workers=8) as executor:
+            models = list(executor.map(lambda _: langchain_conversation.get_chat_model(), range(8)))
+
+        assert chat_open_ai.call_count == 1
+        assert all(model is models[0] for model in models)
+    finally:
+        langchain_conversation.__dict__.pop("chat", None)
+        if saved is not None:
+            langchain_conversation.chat = saved
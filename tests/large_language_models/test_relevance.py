@@ -0,0 +1,73 @@
+import pandas as pd
+
+from piqa.large_language_models.relevance import (normalize_text, remove_duplicate_elements, score_sections, select_relevant_elements, select_section_elements)
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+def _deck() -> pd.DataFrame:
+    return pd.DataFrame({
+        "Text": [
+            "Moz", "SEO software made easy", "moz.com | Page 1",
+            "Our team", "Rand Fishkin, CEO and founder", "moz.com | Page 2",
+            "The market", "Search marketing is a $5 billion market", "Thank you for your attention today", "40%",
+            "moz.com | Page 3",
+        ],
+        "Page": [0, 0, 0, 1, 1, 1, 2, 2, 2, 2, 2],
+    })
+
+def test_normalize_text():
+    assert normalize_text(pd.Series(["moz.com | Page 1", "MOZ.COM  page 1", "$1.2M ARR"])).tolist() == [
+        "moz com page 1", "moz com page 1", "$1 2m arr"]
+
+def test_remove_duplicate_elements():
+    texts = remove_duplicate_elements(_deck())["Text"].tolist()
+
+    assert texts.count("moz.com | Page 1") == 1
+    assert "moz.com | Page 2" not in texts and "moz.com | Page 3" not in texts
+    assert "40%" in texts
+
+def test_remove_duplicate_elements_keeps_numbers():
+    metrics = ["Revenue grew 200% in 2019", "Revenue grew 350% in 2020", "40%", "12,000", "$1.2M ARR", "Q1 100 users",
+               "Q2 900 users"]
+    df = pd.DataFrame({"Text": metrics + ["40%", "•"], "Page": [0, 0, 1, 1, 2, 2, 3, 3, 3]})
+
+    assert remove_duplicate_elements(df)["Text"].tolist() == metrics
+
+    # Page numbers repeat on every page, numbers next to a page number are kept
+    pages = pd.DataFrame({"Text": ["Intro", "1", "Team", "2", "Traction", "12", "3", "Market", "4"],
+                          "Page": [0, 0, 1, 1, 2, 2, 2, 3, 3]})
+    assert remove_duplicate_elements(pages)["Text"].tolist() == ["Intro", "1", "Team", "Traction", "12", "3",
+                                                                   "Market"]
+
+def test_score_sections():
+    scores = score_sections(_deck())
+
+    assert scores["Team"].idxmax() == 4
+    assert scores["Market"].idxmax() == 7
+
+def test_select_relevant_elements():
+    df = _deck()
+    selected = select_relevant_elements(df, 30, count_words)
+
+    # The first page and the best element of every section are kept, in document order
+    assert selected["Text"].tolist()[:2] == ["Moz", "SEO software made easy"]
+    assert "Rand Fishkin, CEO and founder" in selected["Text"].tolist()
+    assert "Search marketing is a $5 billion market" in selected["Text"].tolist()
+    assert selected.index.is_monotonic_increasing
+    assert sum(count_words(text) + 1 for text in selected["Text"]) <= 30
+
+def test_select_relevant_elements_within_budget():
+    df = _deck()
+
+    assert select_relevant_elements(df, 1000, count_words).equals(remove_duplicate_elements(df))
+
+def test_select_section_elements():
+    texts = select_section_elements(_deck(), ["team", "founder"])["Text"].tolist()
+
+    # The matching elements and the first page, without repeated footers
+    assert texts == ["Moz", "SEO software made easy", "moz.com | Page 1", "Our team", "Rand Fishkin, CEO and founder"]
+
+    # Without matches, or without terms, the whole deck is used
+    assert len(select_section_elements(_deck(), ["blockchain"])) == len(remove_duplicate_elements(_deck()))
+    assert len(select_section_elements(_deck(), None)) == len(remove_duplicate_elements(_deck()))
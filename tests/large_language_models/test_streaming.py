@@ -0,0 +1,138 @@
+import asyncio
+import os
+from typing import Any, List, Optional
+
+import pandas as pd
+import pytest
+from unittest import mock
+from langchain.chat_models.base import SimpleChatModel
+from langchain.schema import AIMessage, BaseMessage, ChatGeneration, ChatResult
+
+from piqa.large_language_models.async_engine import AsyncCompletionEngine, astream_chat_completion # type: ignore
+from piqa.large_language_models.langchain_conversation import completion_cache # type: ignore
+from piqa.instrumentation import metrics
+from piqa.large_language_models.streaming import (CompletionInterrupted, split_sections, stream_chat_completion, tee_to_file) # type: ignore
+
+ANSWER = "# Name of the product\nMoz\n\n# Team\n- Rand Fishkin: CEO\n\n# Traction\n$650K / month\n"
+
+class FakeStreamingChatModel(SimpleChatModel):
+    """Streams a fixed answer in small tokens when streaming is enabled, failing after fail_after tokens if set."""
+    streaming: bool = False
+    fail_after: Optional[int] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming"
+
+    def _call(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None,
+              **kwargs: Any) -> str:
+        if self.streaming and run_manager:
+            for start in range(0, len(ANSWER), 5):
+                if start == 5 * (self.fail_after if self.fail_after is not None else -1):
+                    raise ConnectionError("connection reset")
+                run_manager.on_llm_new_token(ANSWER[start:start + 5])
+
+        return ANSWER
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None,
+                         **kwargs: Any) -> ChatResult:
+        if self.streaming and run_manager:
+            for start in range(0, len(ANSWER), 5):
+                if start == 5 * (self.fail_after if self.fail_after is not None else -1):
+                    raise ConnectionError("connection reset")
+                await run_manager.on_llm_new_token(ANSWER[start:start + 5])
+
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=ANSWER))])
+
+def _df() -> pd.DataFrame:
+    return pd.DataFrame({"Text": ["Moz", "Rand Fishkin, CEO"], "Page": [0, 1]})
+
+def test_split_sections():
+    tokens = [ANSWER[start:start + 3] for start in range(0, len(ANSWER), 3)]
+
+    assert list(split_sections(tokens)) == [
+        "# Name of the product\nMoz\n\n", "# Team\n- Rand Fishkin: CEO\n\n", "# Traction\n$650K / month\n"
+    ]
+
+def test_stream_chat_completion():
+    completion_cache.clear()
+
+    with mock.patch("piqa.large_language_models.langchain_conversation.chat", FakeStreamingChatModel()):
+        tokens = list(stream_chat_completion(_df()))
+        assert len(tokens) > 1
+        assert "".join(tokens) == ANSWER
+
+        # The completion is cached once it is finished and then returned in sections at once
+        assert list(stream_chat_completion(_df(), by_section=True))[0] == "# Name of the product\nMoz\n\n"
+
+def test_tee_to_file():
+    path = "tests/data/tmp/streaming/output.md"
+    written = []
+
+    for piece in tee_to_file(["# Team\n", "Rand"], path):
+        with open(path) as f:
+            written.append(f.read())
+
+    assert written == ["# Team\n", "# Team\nRand"]
+
+def test_astream_chat_completion():
+    completion_cache.clear()
+    engine = AsyncCompletionEngine(FakeStreamingChatModel(), requests_per_minute=0, tokens_per_minute=0, timeout=5)
+
+    async def collect(by_section: bool):
+        return [piece async for piece in astream_chat_completion(_df(), engine, by_section=by_section)]
+
+    tokens = asyncio.run(collect(False))
+    assert len(tokens) > 1
+    assert "".join(tokens) == ANSWER
+
+    assert asyncio.run(collect(True)) == [
+        "# Name of the product\nMoz\n\n", "# Team\n- Rand Fishkin: CEO\n\n", "# Traction\n$650K / month\n"
+    ]
+    assert engine.stats()["requests"] == 1
+
+def _completions() -> int:
+    return sum(span["count"] for span in metrics.snapshot()["spans"] if span["name"] == "chat_completion")
+
+def test_stream_chat_completion_records_span():
+    completion_cache.clear()
+    completions = _completions()
+
+    with mock.patch("piqa.large_language_models.langchain_conversation.chat", FakeStreamingChatModel()):
+        list(stream_chat_completion(_df()))
+
+    assert _completions() == completions + 1
+
+def test_stream_chat_completion_interrupted():
+    completion_cache.clear()
+    path = "tests/data/tmp/streaming/interrupted.md"
+
+    with mock.patch("piqa.large_language_models.langchain_conversation.chat", FakeStreamingChatModel(fail_after=0)):
+        assert list(stream_chat_completion(_df())) == ["Error generating chat completion"]
+
+    # Part of the answer was streamed, the error is raised instead of appended to it and the partial file removed
+    with mock.patch("piqa.large_language_models.langchain_conversation.chat", FakeStreamingChatModel(fail_after=3)):
+        tokens = []
+        with pytest.raises(CompletionInterrupted):
+            for token in tee_to_file(stream_chat_completion(_df()), path):
+                tokens.append(token)
+
+    assert "".join(tokens) == ANSWER[:15]
+    assert not os.path.exists(path)
+
+def test_astream_chat_completion_interrupted():
+    completion_cache.clear()
+    engine = AsyncCompletionEngine(FakeStreamingChatModel(fail_after=3), requests_per_minute=0, tokens_per_minute=0,
+                                   timeout=5)
+    tokens = []
+
+    async def collect():
+        async for token in astream_chat_completion(_df(), engine):
+            tokens.append(token)
+
+    completions = _completions()
+    with pytest.raises(CompletionInterrupted):
+        asyncio.run(collect())
+
+    assert "".join(tokens) == ANSWER[:15]
+    assert _completions() == completions + 1
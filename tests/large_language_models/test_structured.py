@@ -0,0 +1,87 @@
+import asyncio
+import json
+import re
+from typing import Any, List, Optional
+
+import pandas as pd
+from unittest import mock
+from langchain.chat_models.base import SimpleChatModel
+from langchain.schema import AIMessage, BaseMessage, ChatGeneration, ChatResult
+
+from piqa.large_language_models.async_engine import AsyncCompletionEngine # type: ignore
+from piqa.large_language_models.langchain_conversation import completion_cache # type: ignore
+from piqa.large_language_models.structured import (PitchDeckMetrics, SECTION_GROUPS, agenerate_structured_completion, get_structured_completion, parse_sections) # type: ignore
+
+class FakeSectionChatModel(SimpleChatModel):
+    """Answers every requested key with the content it was prompted with, and fails for the traction section."""
+    delay: float = 0.01
+    in_flight: int = 0
+    peak: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-sections"
+
+    def _call(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None,
+              **kwargs: Any) -> str:
+        prompt = messages[-1].content
+        keys = re.findall(r'"(\w+)" \(', prompt)
+
+        if keys == ["traction"]:
+            raise ValueError("rate limit reached")
+
+        content = prompt.split("CONTENT:")[1].split("ANSWER:")[0].strip()
+        return "Sure, here it is:\n" + json.dumps({key: content for key in keys})
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None,
+                         **kwargs: Any) -> ChatResult:
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._call(messages)))])
+
+def _deck() -> pd.DataFrame:
+    return pd.DataFrame({
+        "Text": ["Moz", "SEO software made easy", "Our team", "Rand Fishkin, CEO and founder",
+                 "Search marketing is a $5 billion market", "Pricing: subscription per month"],
+        "Page": [0, 0, 1, 1, 2, 3],
+    })
+
+def test_parse_sections():
+    content = 'The sections:\n```json\n{"team": "- Rand Fishkin: CEO", "traction": null, "market": ["SEO", "SEM"]}\n```'
+
+    assert parse_sections(content, ["team", "traction", "market", "problem"]) == {
+        "team": "- Rand Fishkin: CEO", "traction": None, "market": '["SEO", "SEM"]', "problem": None,
+    }
+    assert parse_sections("No JSON here", ["team"]) == {"team": None}
+
+def test_get_structured_completion():
+    completion_cache.clear()
+
+    with mock.patch("piqa.large_language_models.langchain_conversation.chat", FakeSectionChatModel()):
+        metrics = get_structured_completion(_deck())
+
+    # One entry per section, in the order of the sections of the task template
+    assert list(metrics) == list(PitchDeckMetrics.__annotations__)
+
+    # Every group is prompted with the first page and the elements relevant to it
+    assert metrics["team"] == "Moz SEO software made easy Our team Rand Fishkin, CEO and founder"
+    assert metrics["market_size"] == "Moz SEO software made easy Search marketing is a $5 billion market"
+    assert "Pricing" in metrics["business_model"] and "Rand" not in metrics["business_model"]
+    assert "Rand" in metrics["concise_summary"] and "billion" in metrics["concise_summary"]
+
+    # A failed request only empties its own sections
+    assert metrics["traction"] is None
+
+def test_agenerate_structured_completion():
+    completion_cache.clear()
+    chat_model = FakeSectionChatModel()
+    engine = AsyncCompletionEngine(chat_model, requests_per_minute=0, tokens_per_minute=0, timeout=0)
+
+    metrics = asyncio.run(agenerate_structured_completion(_deck(), engine))
+
+    assert metrics["team"] == "Moz SEO software made easy Our team Rand Fishkin, CEO and founder"
+    assert metrics["traction"] is None
+    assert chat_model.peak == len(SECTION_GROUPS)
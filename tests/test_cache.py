@@ -0,0 +1,56 @@
+import json
+import os
+import time
+
+from piqa.cache import DiskCache
+
+
+def test_disk_cache_hit_and_miss(tmp_path):
+    cache = DiskCache(str(tmp_path))
+
+    assert cache.get("key") is None
+    cache.set("key", {"elements": [1, 2, 3]})
+
+    assert cache.get("key") == {"elements": [1, 2, 3]}
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_disk_cache_persists_index(tmp_path):
+    DiskCache(str(tmp_path)).set("key", "value")
+
+    with open(os.path.join(tmp_path, "index.json")) as f:
+        assert "key" in json.load(f)
+
+    assert DiskCache(str(tmp_path)).get("key") == "value"
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=20)
+
+    cache.set("first", "a" * 8)
+    cache.set("second", "b" * 8)
+    cache.get("first")
+    cache.set("third", "c" * 8)
+
+    assert "first" in cache
+    assert "second" not in cache
+    assert "third" in cache
+    assert not os.path.exists(os.path.join(tmp_path, "second.json"))
+
+
+def test_disk_cache_expires_old_entries(tmp_path):
+    cache = DiskCache(str(tmp_path), max_age=0.01)
+    cache.set("key", "value")
+    time.sleep(0.02)
+
+    assert cache.get("key") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_disk_cache_disabled(tmp_path):
+    cache = DiskCache(str(tmp_path), enabled=False)
+    cache.set("key", "value")
+
+    assert cache.get("key") is None
+    assert not os.path.exists(os.path.join(tmp_path, "index.json"))
@@ -1 +1,72 @@
-# TODO: TEST ME!
+import os
+import shutil
+import subprocess
+import sys
+from unittest import mock
+
+import numpy as np
+
+from piqa import PiQaClient
+from piqa.config import OPENAI_MODEL
+from piqa.document_processing import LocalExtractionBackend
+
+def test_generate_pitchdeck_metrics_batch():
+    client = PiQaClient(max_number_pages=2, extraction_backend=LocalExtractionBackend())
+    file_paths = ["tests/data/documents/moz.pdf", "tests/data/documents/missing.pdf"]
+
+    async def complete(df, engine, use_cache):
+        return f"# {len(df)} elements"
+
+    with mock.patch("piqa.client.agenerate_chat_completion", side_effect=complete):
+        results = client.generate_pitchdeck_metrics_batch(file_paths)
+
+    assert list(results) == file_paths
+    assert results["tests/data/documents/moz.pdf"].startswith("# ")
+    assert results["tests/data/documents/missing.pdf"] == "Error generating pitch deck metrics"
+
+def test_pipeline_pitchdeck_metrics(tmp_path):
+    client = PiQaClient(max_number_pages=2, extraction_backend=LocalExtractionBackend())
+    failing = str(tmp_path / "failing.pdf")
+    shutil.copy("tests/data/documents/moz.pdf", failing)
+    file_paths = ["tests/data/documents/moz.pdf", "tests/data/documents/missing.pdf", failing]
+    output_dir = "tests/data/tmp/final_output"
+    completions = iter(["Error generating chat completion"])
+
+    async def complete(df, engine, use_cache):
+        return next(completions, f"# {len(df)} elements")
+
+    with mock.patch("piqa.client.agenerate_chat_completion", side_effect=complete):
+        results = client.pipeline_pitchdeck_metrics(file_paths, output_dir, extraction_workers=2)
+
+    assert sorted(results) == sorted(file_paths)
+    assert results["tests/data/documents/missing.pdf"] == "Error generating pitch deck metrics"
+    completed = [file_path for file_path in (file_paths[0], failing) if results[file_path].startswith("# ")]
+    assert len(completed) == 1
+
+    # Only the result of the deck that was completed is written, errors are not
+    name = os.path.splitext(os.path.basename(completed[0]))[0]
+    assert os.listdir(output_dir) == [f"{name}_{OPENAI_MODEL}_result.md"]
+    with open(os.path.join(output_dir, f"{name}_{OPENAI_MODEL}_result.md")) as f:
+        assert f.read() == results[completed[0]]
+
+def test_extract_elements_layout_blocks():
+    client = PiQaClient(max_number_pages=2, extraction_backend=LocalExtractionBackend(), layout_blocks=True)
+    page_block = np.array([[0.0, 0.0, 1.0, 1.0]])
+
+    with mock.patch("piqa.client.detect_layout_blocks", return_value={0: page_block}) as detect_layout_blocks:
+        df = client._extract_elements("tests/data/documents/moz.pdf")
+
+    # Every element of the first page is merged into its single block, the second page has no blocks
+    assert detect_layout_blocks.call_args.args == ("tests/data/documents/moz.pdf", [0, 1])
+    assert (df["Page"] == 0).sum() == 1
+    assert (df["Page"] == 1).sum() > 1
+
+def test_client_import_is_lazy():
+    # langchain and OpenCV are only imported once a completion is requested or paragraphs are detected, the Adobe
+    # SDK once the Adobe backend is used and pdf2image once pages are rendered
+    code = ("import sys; from piqa import PiQaClient; from piqa.document_processing import LocalExtractionBackend; "
+            "PiQaClient(extraction_backend=LocalExtractionBackend()); "
+            "print(sorted({'langchain', 'cv2', 'adobe', 'pdf2image'} & {name.split('.')[0] for name in sys.modules}))")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip() == "[]"
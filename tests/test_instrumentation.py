@@ -0,0 +1,91 @@
+import json
+import logging
+import urllib.request
+
+import pytest
+
+from piqa.cache import DiskCache
+from piqa.instrumentation import Metrics, metrics, start_metrics_server
+
+def _counter(registry, name, **labels):
+    return sum(counter["value"] for counter in registry.snapshot()["counters"]
+               if counter["name"] == name and all(counter["labels"].get(k) == str(v) for k, v in labels.items()))
+
+def test_span_records_duration_errors_and_parent(caplog):
+    registry = Metrics(json_logs=True)
+
+    with caplog.at_level(logging.INFO, logger="piqa.instrumentation"):
+        with registry.span("outer"):
+            with registry.span("inner", backend="local"):
+                pass
+
+        with pytest.raises(ValueError):
+            with registry.span("inner", backend="local"):
+                raise ValueError("boom")
+
+    spans = {span["name"]: span for span in registry.snapshot()["spans"]}
+    assert spans["inner"]["count"] == 2
+    assert spans["inner"]["errors"] == 1
+    assert spans["inner"]["labels"] == {"backend": "local"}
+    assert spans["outer"]["count"] == 1
+
+    events = [json.loads(record.getMessage()) for record in caplog.records]
+    assert events[0]["span"] == "inner" and events[0]["parent"] == "outer"
+    assert events[-1]["error"] == "ValueError: boom" and events[-1]["parent"] is None
+
+def test_timed_and_disabled():
+    registry = Metrics()
+
+    @registry.timed("work")
+    def work(value):
+        return value * 2
+
+    assert work(2) == 4
+    assert registry.snapshot()["spans"][0]["count"] == 1
+
+    disabled = Metrics(enabled=False)
+    with disabled.span("work"):
+        disabled.count("cache_hits")
+    assert disabled.snapshot()["spans"] == [] and disabled.snapshot()["counters"] == []
+
+def test_to_prometheus():
+    registry = Metrics()
+    registry.observe("extract", 0.2, backend="adobe")
+    registry.count("prompt_tokens", 120)
+    registry.count("prompt_tokens", 30)
+
+    text = registry.to_prometheus()
+
+    assert 'piqa_span_seconds_bucket{span="extract",backend="adobe",le="0.1"} 0' in text
+    assert 'piqa_span_seconds_bucket{span="extract",backend="adobe",le="0.5"} 1' in text
+    assert 'piqa_span_seconds_bucket{span="extract",backend="adobe",le="+Inf"} 1' in text
+    assert 'piqa_span_seconds_count{span="extract",backend="adobe"} 1' in text
+    assert "piqa_prompt_tokens_total 150" in text
+
+def test_metrics_server():
+    registry = Metrics()
+    registry.count("cache_hits", cache="llm")
+    server = start_metrics_server(0, registry=registry)
+
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert 'piqa_cache_hits_total{cache="llm"} 1' in response.read().decode("utf-8")
+        with urllib.request.urlopen(f"{url}/metrics.json") as response:
+            assert json.loads(response.read())["counters"][0]["name"] == "cache_hits"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_disk_cache_counts_hits_misses_and_bytes(tmp_path):
+    metrics.reset()
+    cache = DiskCache(str(tmp_path), name="test")
+
+    assert cache.get("key") is None
+    cache.set("key", "value")
+    assert cache.get("key") == "value"
+
+    assert _counter(metrics, "cache_misses", cache="test") == 1
+    assert _counter(metrics, "cache_hits", cache="test") == 1
+    assert _counter(metrics, "bytes_written", target="test_cache") > 0
+    assert _counter(metrics, "bytes_read", source="test_cache") > 0
@@ -0,0 +1,120 @@
+from unittest import mock
+
+import pandas as pd
+from pdfrw import PdfReader
+
+from piqa import PiQaClient
+from piqa.document_processing import LocalExtractionBackend
+from piqa.document_processing.pdf_operations import trim_pdf
+from piqa.large_language_models.structured import SectionsResult
+from piqa.near_duplicates import (NearDuplicateDetector, NearDuplicateIndex, fingerprint_elements, fingerprint_texts,
+                                  similarity)
+
+WORDS = [f"word{i}" for i in range(400)]
+
+def _deck(tmp_path, name, page_indices, widen_first_page=False):
+    pdf = PdfReader("tests/data/documents/moz.pdf")
+    if widen_first_page:
+        # Same text, different bytes, like a deck exported again
+        media_box = pdf.pages[0].MediaBox
+        pdf.pages[0].MediaBox = [0, 0, float(media_box[2]) + 1, float(media_box[3])]
+
+    path = tmp_path / name
+    path.write_bytes(trim_pdf(pdf, page_indices)[0])
+    return str(path)
+
+def test_minhash_estimates_jaccard_similarity():
+    deck = fingerprint_texts([" ".join(WORDS)])
+    edited = fingerprint_texts([" ".join(WORDS[:380] + [f"edit{i}" for i in range(20)])])
+    unrelated = fingerprint_texts([" ".join(f"other{i}" for i in range(400))])
+
+    # 378 of the 418 shingles of both texts are shared
+    assert abs(similarity(deck.signature, edited.signature) - 378 / 418) < 0.1
+    assert similarity(deck.signature, unrelated.signature) < 0.1
+    assert fingerprint_texts(["", " "]).signature is None
+
+def test_fingerprint_elements_hashes_pages():
+    df = pd.DataFrame({"Text": ["Title", "Body", None, "Second page"], "Page": [0, 0, 0, 2]})
+    fingerprint = fingerprint_elements(df)
+
+    assert fingerprint.page_hashes[1] is None
+    assert fingerprint.page_hashes[0] == fingerprint_texts(["title body"]).page_hashes[0]
+    assert len(fingerprint.page_hashes) == 3
+
+def test_index_finds_similar_decks_after_reopening(tmp_path):
+    path = str(tmp_path / "index.sqlite3")
+    index = NearDuplicateIndex(path)
+    index.add("deck", fingerprint_texts([" ".join(WORDS)]), "deck.pdf", ["key"], "local")
+    index.add("other", fingerprint_texts([" ".join(f"other{i}" for i in range(400))]), "other.pdf", ["key"], "local")
+    index.set_result("deck", "options", {"team": "Founders"})
+    index.close()
+
+    reopened = NearDuplicateIndex(path)
+    matches = reopened.query(fingerprint_texts([" ".join(WORDS[:390] + ["edit"])]), threshold=0.5)
+
+    assert [match.deck_id for match in matches] == ["deck"]
+    assert reopened.get_result("deck", "options") == {"team": "Founders"}
+    assert reopened.get_result("deck", "other options") is None
+
+def test_client_reuses_results_and_unchanged_pages(tmp_path):
+    detector = NearDuplicateDetector(NearDuplicateIndex(":memory:"))
+    client = PiQaClient(max_number_pages=4, extraction_backend=LocalExtractionBackend(),
+                        near_duplicate_detector=detector)
+    deck, copy = _deck(tmp_path, "deck.pdf", [0, 1, 2, 3]), _deck(tmp_path, "copy.pdf", [0, 1, 2, 3])
+    edited = _deck(tmp_path, "edited.pdf", [0, 1, 2, 4], widen_first_page=True)
+
+    with mock.patch("piqa.client.get_chat_completion", return_value="# Metrics") as get_chat_completion:
+        assert client.generate_pitchdeck_metrics(deck) == "# Metrics"
+        assert client.generate_pitchdeck_metrics(copy) == "# Metrics"
+        assert get_chat_completion.call_count == 1
+
+        # Only the last page changed, the first page reuses the extraction although its bytes changed
+        assert detector.reuse_pages(edited, [0, 1, 2, 3], "local") == 1
+        client.generate_pitchdeck_metrics(edited)
+        assert get_chat_completion.call_count == 2
+
+    # Structured results are not reused for markdown
+    with mock.patch("piqa.client.get_structured_completion", return_value={"team": None}) as structured:
+        client.generate_pitchdeck_metrics(copy, structured=True)
+        assert structured.call_count == 1
+
+def test_results_are_only_reused_for_unchanged_pages(tmp_path):
+    detector = NearDuplicateDetector(NearDuplicateIndex(":memory:"))
+    deck, copy = _deck(tmp_path, "deck.pdf", [0, 1, 2, 3]), _deck(tmp_path, "copy.pdf", [0, 1, 2, 3], True)
+    edited = _deck(tmp_path, "edited.pdf", [0, 1, 2, 4])
+    detector.remember(deck, [0, 1, 2, 3], "local", "options", "# Metrics")
+
+    assert detector.find_result(copy, [0, 1, 2, 3], "options") == "# Metrics"
+    assert detector.find_result(edited, [0, 1, 2, 3], "options") is None
+
+def test_client_does_not_reuse_failed_sections(tmp_path):
+    detector = NearDuplicateDetector(NearDuplicateIndex(":memory:"))
+    client = PiQaClient(max_number_pages=4, extraction_backend=LocalExtractionBackend(),
+                        near_duplicate_detector=detector)
+    deck = _deck(tmp_path, "deck.pdf", [0, 1, 2, 3])
+    partial = SectionsResult({"team": "Founders", "traction": None}, ["traction"])
+
+    with mock.patch("piqa.client.get_structured_completion", side_effect=[partial, {"team": None}]) as structured:
+        assert client.generate_pitchdeck_metrics(deck, structured=True) == partial
+        assert client.generate_pitchdeck_metrics(deck, structured=True) == {"team": None}
+        assert structured.call_count == 2
+
+    assert detector.find_result(deck, [0, 1, 2, 3], client._result_options(True)) is None
+
+def test_results_are_not_reused_after_prompt_settings_change(tmp_path):
+    client = PiQaClient(max_number_pages=4, extraction_backend=LocalExtractionBackend(),
+                        near_duplicate_detector=NearDuplicateDetector(NearDuplicateIndex(":memory:")))
+    deck = _deck(tmp_path, "deck.pdf", [0, 1, 2, 3])
+
+    with mock.patch("piqa.client.get_chat_completion", return_value="# Metrics") as get_chat_completion:
+        client.generate_pitchdeck_metrics(deck)
+
+        for setting, value in [("LLM_MAX_PROMPT_TOKENS", 1000), ("LLM_RELEVANCE_FILTER", False),
+                               ("LLM_MAX_CONTENT_TOKENS", 2000)]:
+            with mock.patch(f"piqa.client.{setting}", value):
+                client.generate_pitchdeck_metrics(deck)
+
+        assert get_chat_completion.call_count == 4
+
+        client.generate_pitchdeck_metrics(deck)
+        assert get_chat_completion.call_count == 4
@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+import pytest
+
+from piqa.pipeline import Stage, StageFailed, run_pipeline
+
+def _collect(items, stages, queue_size=2, stats=None):
+    async def collect():
+        return [entry async for entry in run_pipeline(items, stages, queue_size, stats)]
+
+    return asyncio.run(collect())
+
+def test_run_pipeline_overlaps_stages():
+    async def slow_stage(item, value):
+        await asyncio.sleep(0.05)
+        return value * 10
+
+    async def plus_one(item, value):
+        await asyncio.sleep(0.05)
+        return value + 1
+
+    stats = {}
+    started_at = time.perf_counter()
+    results = _collect(range(4), [Stage("first", slow_stage, 1), Stage("second", plus_one, 1)], stats=stats)
+
+    # Four items through two stages of 50ms take five steps instead of eight when the stages overlap
+    assert time.perf_counter() - started_at < 0.35
+    assert results == [(0, 1), (1, 11), (2, 21), (3, 31)]
+    assert stats["first"]["items"] == 4 and stats["second"]["items"] == 4
+    assert stats["pipeline"]["wall"] > 0
+
+def test_run_pipeline_backpressure():
+    consumed = []
+    in_flight = 0
+    peak = 0
+
+    def items():
+        for item in range(20):
+            consumed.append(item)
+            yield item
+
+    async def slow_stage(item, value):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return value
+
+    async def first_results():
+        pipeline = run_pipeline(items(), [Stage("slow", slow_stage, 3)], queue_size=2)
+        results = [await pipeline.__anext__() for _ in range(2)]
+        await pipeline.aclose()
+        return results
+
+    assert len(asyncio.run(first_results())) == 2
+
+    # Only the items in the workers and the bounded queues were taken from the input
+    assert len(consumed) < 20
+    assert peak == 3
+
+def test_run_pipeline_failed_items_skip_later_stages():
+    calls = []
+
+    async def fail_odd(item, value):
+        if value % 2:
+            raise ValueError("odd")
+        return value
+
+    async def record(item, value):
+        calls.append(item)
+        return value
+
+    stats = {}
+    results = dict(_collect(range(4), [Stage("check", fail_odd, 2), Stage("record", record, 2)], stats=stats))
+
+    assert results[0] == 0 and results[2] == 2
+    assert isinstance(results[1], StageFailed) and results[1].stage == "check"
+    assert sorted(calls) == [0, 2]
+    assert stats["check"]["failures"] == 2
+
+def test_run_pipeline_input_error():
+    def items():
+        yield 1
+        raise OSError("directory is gone")
+
+    async def identity(item, value):
+        return value
+
+    with pytest.raises(OSError):
+        _collect(items(), [Stage("identity", identity, 1)])
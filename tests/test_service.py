@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from unittest import mock
+
+import pytest
+
+from piqa.service import DONE, FAILED, QUEUED, RUNNING, JobQueue, PiQaService, content_hash, make_server
+
+DECK = "tests/data/documents/moz.pdf"
+
+def test_job_queue_priority_and_deduplication(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+
+    low, _ = queue.submit("low.pdf", "a", priority=0)
+    high, _ = queue.submit("high.pdf", "b", priority=5)
+    duplicate, deduplicated = queue.submit("copy-of-low.pdf", "a", priority=0)
+
+    assert deduplicated and duplicate.id == low.id
+    assert queue.submit("low.pdf", "a", structured=True)[1] is False
+
+    assert queue.claim(timeout=0).id == high.id
+    assert queue.claim(timeout=0).id == low.id
+
+    # A finished deck is queued again
+    queue.finish(low.id, "# Metrics")
+    assert queue.get(low.id).status == DONE and queue.get(low.id).result == "# Metrics"
+    assert queue.submit("low.pdf", "a")[1] is False
+
+def test_job_queue_duplicate_raises_priority():
+    queue = JobQueue(":memory:")
+
+    first, _ = queue.submit("first.pdf", "a")
+    queue.submit("second.pdf", "b", priority=1)
+    job, deduplicated = queue.submit("first.pdf", "a", priority=2)
+
+    assert deduplicated and job.priority == 2
+    assert queue.claim(timeout=0).id == first.id
+
+def test_job_queue_persists_and_requeues_running_jobs(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    queue = JobQueue(path)
+    running, _ = queue.submit("running.pdf", "a")
+    queued, _ = queue.submit("queued.pdf", "b")
+    queue.claim(timeout=0)
+    queue.close()
+
+    restarted = JobQueue(path)
+    assert restarted.get(running.id).status == RUNNING
+    assert restarted.requeue_running() == 1
+    assert restarted.counts() == {QUEUED: 2, RUNNING: 0, DONE: 0, FAILED: 0}
+    assert {restarted.claim(timeout=0).id, restarted.claim(timeout=0).id} == {running.id, queued.id}
+
+def test_job_queue_claim_waits_for_submission():
+    queue = JobQueue(":memory:")
+    threading.Timer(0.05, queue.submit, ("deck.pdf", "a")).start()
+
+    assert queue.claim(timeout=0.01) is None
+    assert queue.claim(timeout=2).file_path == "deck.pdf"
+
+def test_service_fails_jobs_without_sections(tmp_path):
+    client = mock.Mock()
+    client.generate_pitchdeck_metrics.side_effect = [{"team": None, "traction": None},
+                                                     {"team": "Founders", "traction": None}]
+    service = PiQaService(client, JobQueue(":memory:"), workers=1, uploads_path=str(tmp_path),
+                          documents_path=os.path.dirname(DECK))
+
+    failed, _ = service.submit_path(DECK, structured=True)
+    service.run_job(service.queue.claim(timeout=0))
+    assert service.queue.get(failed.id).status == FAILED
+
+    # Sections that failed next to answered ones are null in the result of a done job
+    partial, _ = service.submit_path(DECK, structured=True)
+    service.run_job(service.queue.claim(timeout=0))
+    assert service.queue.get(partial.id).result == {"team": "Founders", "traction": None}
+
+def test_service_concurrent_identical_uploads(tmp_path):
+    service = PiQaService(mock.Mock(), JobQueue(":memory:"), workers=1, uploads_path=str(tmp_path))
+    with open(DECK, "rb") as f:
+        deck = f.read()
+
+    jobs = []
+    threads = [threading.Thread(target=lambda: jobs.append(service.submit_upload(deck)[0].id)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(jobs) == 8 and len(set(jobs)) == 1
+    assert os.listdir(tmp_path) == [f"{content_hash(deck)}.pdf"]
+    assert (tmp_path / f"{content_hash(deck)}.pdf").read_bytes() == deck
+
+def test_service_only_accepts_paths_in_the_documents_folder(tmp_path):
+    documents_path = tmp_path / "documents"
+    documents_path.mkdir()
+    (documents_path / "link.pdf").symlink_to(os.path.abspath(DECK))
+    (documents_path / "deck.pdf").write_bytes(b"%PDF-1.4 deck")
+    service = PiQaService(mock.Mock(), JobQueue(":memory:"), workers=1, uploads_path=str(tmp_path / "uploads"),
+                          documents_path=str(documents_path))
+
+    deck = str(documents_path / "deck.pdf")
+    assert service.submit_path(deck)[0].file_path == os.path.realpath(deck)
+    for file_path in [DECK, str(documents_path / "link.pdf"), str(documents_path / ".." / "documents.pdf")]:
+        with pytest.raises(PermissionError):
+            service.submit_path(file_path)
+
+    with mock.patch("piqa.service.SERVICE_MAX_UPLOAD_BYTES", 4), pytest.raises(ValueError):
+        service.submit_path(deck)
+
+    service.documents_path = None
+    with pytest.raises(PermissionError):
+        service.submit_path(deck)
+
+def _request(url, data=None, content_type="application/pdf"):
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": content_type} if data else {})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+def test_service_http(tmp_path):
+    client = mock.Mock()
+    started, release = threading.Event(), threading.Event()
+
+    def generate(file_path, structured):
+        started.set()
+        release.wait(5)
+        return "# Metrics" if structured is False else "No data extracted"
+
+    client.generate_pitchdeck_metrics.side_effect = generate
+    service = PiQaService(client, JobQueue(":memory:"), workers=1, uploads_path=str(tmp_path),
+                          documents_path=os.path.dirname(DECK))
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    service.start()
+
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with open(DECK, "rb") as f:
+            deck = f.read()
+
+        status, body = _request(f"{url}/jobs?priority=1", deck)
+        assert status == 202 and not body["deduplicated"]
+        job_id = body["job"]["id"]
+        assert (tmp_path / f"{content_hash(deck)}.pdf").exists()
+
+        # The same deck by path while the upload is in flight is deduplicated
+        assert started.wait(5)
+        status, body = _request(f"{url}/jobs", json.dumps({"path": DECK}).encode(), "application/json")
+        assert status == 200 and body["deduplicated"] and body["job"]["id"] == job_id
+
+        assert _request(f"{url}/jobs/{job_id}/result")[0] == 409
+        release.set()
+
+        for _ in range(100):
+            if _request(f"{url}/jobs/{job_id}")[1]["status"] == DONE:
+                break
+            time.sleep(0.05)
+
+        assert _request(f"{url}/jobs/{job_id}/result") == (200, {"id": job_id, "result": "# Metrics"})
+        assert _request(f"{url}/jobs", b"not a pdf")[0] == 400
+        assert _request(f"{url}/jobs", json.dumps([DECK]).encode(), "application/json")[0] == 400
+        assert _request(f"{url}/jobs", json.dumps({"path": "README.md"}).encode(), "application/json")[0] == 403
+        assert _request(f"{url}/jobs/unknown")[0] == 404
+        assert _request(f"{url}/health")[1]["jobs"][DONE] == 1
+
+        # Results that mean the deck could not be processed fail the job
+        status, body = _request(f"{url}/jobs?structured=true", deck)
+        for _ in range(100):
+            if _request(f"{url}/jobs/{body['job']['id']}")[1]["status"] == FAILED:
+                break
+            time.sleep(0.05)
+        assert _request(f"{url}/jobs/{body['job']['id']}")[1]["error"] == "No data extracted"
+
+    finally:
+        release.set()
+        server.shutdown()
+        server.server_close()
+        service.stop()